@@ -206,6 +206,8 @@ summary_rawnav = summary_rawnav.assign(
 # Remove duplicate runs
 summary_rawnav = summary_rawnav[
     ~summary_rawnav.duplicated(['filename', 'index_run_start'], keep='last')]
+# Runs without pings, such as from a tag on the last line of a file, have no run_id
+summary_rawnav = wr.add_run_id(wr.drop_runs_without_pings(summary_rawnav))
 
 # Output Summary Files
 path_summary_rawnav = os.path.join(path_processed_data, "rawnav_summary.parquet")
@@ -257,7 +259,7 @@ for analysis_route in analysis_routes:
 
         # Join Additional Identifying Information
         temp = summary_rawnav.query('route == @analysis_route') \
-            [['filename', 'index_run_start', 'wday', 'start_date_time']]
+            [['filename', 'index_run_start', 'run_id', 'wday', 'start_date_time']]
 
         out_rawnav_dat = out_rawnav_dat.merge(temp,
                                               on=['filename', 'index_run_start'],
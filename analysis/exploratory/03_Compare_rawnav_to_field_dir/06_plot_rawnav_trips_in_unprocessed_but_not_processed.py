@@ -45,19 +45,19 @@ wmata_crs = 2248
 # 1. Read rawnav data. Subset trips that were observed in field and 
 #  un-processed rawnav
 # -----------------------------------------------------------------------------
-# 1.1 All rawnav data
-rawnav_dat = (
-    wr.read_cleaned_rawnav(
-        analysis_routes_=analysis_routes,
-        analysis_days_=analysis_days,
-        path = os.path.join(path_processed_data, "rawnav_data.parquet"))
-    .drop(columns=['blank', 'lat_raw', 'long_raw', 'sat_cnt'])
-                )
-# 1.2 Summary--field data
+# 1.1 Summary--field data
 path_validation_df = os.path.join(path_processed_data, "field_rawnav_dat.csv")
 rawnav_field_summary_dat = (pd.read_csv(path_validation_df, index_col=0)
                             .query("has_data_from_rawnav_unprocessed == 1"))
 
+# 1.2 Rawnav data for the field trips only
+rawnav_dat = (
+    wr.read_runs(
+        path = os.path.join(path_processed_data, "rawnav_data.parquet"),
+        run_keys = rawnav_field_summary_dat[['filename', 'index_run_start']])
+    .drop(columns=['blank', 'lat_raw', 'long_raw', 'sat_cnt'])
+                )
+
 temp = rawnav_dat.head()
 # 1.3 Merge rawanv and Summary--field data (subset)
 rawnav_qjump_dat = (
@@ -71,8 +71,10 @@ q_jump_route_list = ['S1', 'S2', 'S4', 'S9',
 # If desired, a subset of routes above or the entire list. Code will iterate on the analysis_routes list
 analysis_routes = q_jump_route_list
 
-run_inventory = False # inventory (or re-inventory files), otherwise reload saved inventory if available
+run_inventory = False # inventory new or changed files, otherwise reload saved inventory if available
+inventory_n_workers = 1 # processes used to inventory files up front, increase on machines with more cores. With 1, files are inventoried as they are parsed, reading each once
 run_existing = False # whether to redo outputs that currently exist or skip over them
+buffer_rows = 2000000 # rows of cleaned rawnav data held in memory before writing, lower if memory is limited
 
 # 1.3 Import User-Defined Package
 ############################################
@@ -90,36 +92,44 @@ begin_time = datetime.now()  ##
 zipped_files_dir_parent = os.path.join(path_source_data, "October 2019 Rawnav")
 file_universe = glob.glob(os.path.join(zipped_files_dir_parent, "*.txt.zip"))
 
-if run_inventory: 
-    rawnav_inventory = wr.find_rawnav_routes(file_universe, nmax=restrict_n, quiet=True)
-    
-    path_rawnav_inventory = os.path.join(path_processed_data,"rawnav_inventory.parquet")
-    shutil.rmtree(path_rawnav_inventory, ignore_errors=True) 
-    os.mkdir(path_rawnav_inventory)
-        
-    # Note: partitioning required, using filename avoids resorting of values, filename column
-    # will be sorted to end on reload however.
-    rawnav_inventory.to_parquet(
-        path = path_rawnav_inventory,
-        partition_cols = ['filename'],
-        index = False
-    )
+path_inventory = os.path.join(path_processed_data,"rawnav_inventory.parquet")
+rawnav_manifest = None
+
+if run_inventory and (inventory_n_workers > 1):
+    # New or changed files are searched for tags in parallel up front, and read again when 
+    # parsed in Section 3
+    rawnav_inventory, _ = wr.update_rawnav_inventory(
+        file_universe, 
+        path_inventory=path_inventory,
+        nmax=restrict_n, 
+        quiet=True,
+        n_workers=inventory_n_workers)
+
+elif run_inventory:
+    # Only files that are new or whose contents changed since the last run need to be searched
+    # for tags. This is done as they are parsed in Section 3, so that each is only read once, 
+    # and the saved inventory and its file manifest are then updated in place.
+    rawnav_inventory, rawnav_manifest = wr.get_changed_rawnav_files(
+        file_universe, 
+        path_inventory=path_inventory,
+        nmax=restrict_n)
        
 else:
     try:
         rawnav_inventory = (
-            pd.read_parquet(path=os.path.join(path_processed_data,"rawnav_inventory.parquet"))
+            pd.read_parquet(path=path_inventory)
             .assign(filename = lambda x: x.filename.astype(str)) #returned as categorical
         )
         
     except:
         raise("No rawnav inventory found")
  
+# Files with at least one run on an analysis route. All tags of these files are kept, as they
+# are needed to split the file into runs
 rawnav_inventory_filtered = (
     rawnav_inventory[
-        rawnav_inventory
-        .groupby('filename',sort = False)['route']
-        .transform(lambda x: x.isin(analysis_routes).any())
+        rawnav_inventory.filename.isin(
+            rawnav_inventory.loc[rawnav_inventory.route.isin(analysis_routes), 'filename'])
     ]
 )
    
@@ -128,161 +138,57 @@ rawnav_inventory_filtered = (
     .assign(line_num = lambda x: x.line_num.astype('int'))
 )
     
-if len(rawnav_inventory_filtered) == 0:
+if (len(rawnav_inventory_filtered) == 0) and \
+    ((rawnav_manifest is None) or (not rawnav_manifest.changed.any())):
     raise Exception("No Analysis Routes found in file_universe")
 
 execution_time = str(datetime.now() - begin_time).split('.')[0]
 print("Run Time Section 2 Identify Relevant Files for Analysis Routes : {}".format(execution_time))
 
-# 3 Load Raw RawNav data
+# 3 Load, Clean, and Output RawNav data
 ########################################################################################################################
 begin_time = datetime.now()
-# data is loaded into a dictionary named by the ID
-route_rawnav_tag_dict = {}
-
-# Iterate over each file, skipping to the first row where data in our filtered inventory is found
-# Rather than read run-by-run, we read the rest of the file, then filter to relevant routes later
-rawnav_inv_filt_first = rawnav_inventory_filtered.groupby(['fullpath', 'filename']).line_num.min().reset_index()
-rawnav_inventory_filtered_valid = rawnav_inventory_filtered
-
-for index, row in rawnav_inv_filt_first.iterrows():
-    tag_info_line_no = rawnav_inventory_filtered[rawnav_inventory_filtered['filename'] == row['filename']]
-    reference = min(tag_info_line_no.line_num)
-    # -1 refers to the fact that the tag line identifying the start of a run will be removed, such
-    # that the second row associated with a run will become the first row of data. This helps to 
-    # ensure that indices of the processed data will line up with values in the rawnav inventory
-    tag_info_line_no.loc[:, "new_line_no"] = tag_info_line_no.line_num - reference - 1
-    temp = wr.load_rawnav_data(
-        zip_folder_path=row['fullpath'],
-        skiprows=row['line_num'])
-
-    if type(temp) != type(None):
-        route_rawnav_tag_dict[row['filename']] = dict(RawData=temp, tagLineInfo=tag_info_line_no)
-    else:
-        remove_file = row['filename']  
-        rawnav_inventory_filtered_valid  = rawnav_inventory_filtered_valid.query('filename!= @remove_file')
-
-execution_time = str(datetime.now() - begin_time).split('.')[0]
-print("Run Time Section 3 Load Raw RawNav Data : {}".format(execution_time))
-
-# 4 Clean RawNav data
-########################################################################################################################
-begin_time = datetime.now()  ##
-
-rawnav_data_dict = {}
-summary_data_dict = {}
-
-for key, datadict in route_rawnav_tag_dict.items():
-    temp_dat = wr.clean_rawnav_data(
-        data_dict=datadict,
-        filename=key)
-
-    rawnav_data_dict[key] = temp_dat['rawnavdata']
-    summary_data_dict[key] = temp_dat['summary_data']     
-
-route_rawnav_tag_dict = None
-
-execution_time = str(datetime.now() - begin_time).split('.')[0]
-print("Run Time Section 4 Clean RawNav Data : {}".format(execution_time))
-
-# 5 Output
-########################################################################################################################
-begin_time = datetime.now()  
-# 5.1 Output Summary Rawnav data
-############################################
-
-# Combine summary files, filter to analysis routes, convert col types once NAs removed
-summary_rawnav = pd.concat(summary_data_dict.values())
-
-summary_rawnav = summary_rawnav[summary_rawnav['route'].isin(analysis_routes)]
-summary_rawnav = summary_rawnav.assign(
-    route=lambda x: x.route.astype('str'),
-    pattern=lambda x: x.pattern.astype('int32'))
-
-# Remove duplicate runs
-summary_rawnav = summary_rawnav[
-    ~summary_rawnav.duplicated(['filename', 'index_run_start'], keep='last')]  
-
-# Output Summary Files
+# Each file is loaded, cleaned, and appended to the summary and processed datasets in turn, 
+# so that no more than buffer_rows rows of cleaned data are held in memory at once. Only the lines
+# of runs on analysis routes are parsed.
 path_summary_rawnav = os.path.join(path_processed_data,"rawnav_summary.parquet")
+path_rawnav_data = os.path.join(path_processed_data, "rawnav_data.parquet")
 
 if not os.path.isdir(path_summary_rawnav):
     os.mkdir(path_summary_rawnav)
-      
-for analysis_route in analysis_routes:
-    
-    path_summary_route = os.path.join(path_summary_rawnav,"route={}".format(analysis_route))
-    
-    if (os.path.isdir(path_summary_route) and run_existing) or (not os.path.isdir(path_summary_route)): 
-        shutil.rmtree(os.path.join(path_summary_route), ignore_errors=True) 
-           
-        summary_rawnav_fil = summary_rawnav.query('route == @analysis_route')
-        
-        table_summary = pa.Table.from_pandas(summary_rawnav_fil,
-                                             schema = wr.rawnav_summary_schema())
-        
-        pq.write_to_dataset(table_summary, 
-                            root_path=os.path.join(path_summary_rawnav),
-                            partition_cols=['route','wday'])
-    else:
-        print('skipping summary output of {}'.format(analysis_route))
-    
-# 5.2 Output Processed Rawnav data
-############################################
-# Export Data
-path_rawnav_data = os.path.join(path_processed_data, "rawnav_data.parquet")
-
 if not os.path.isdir(path_rawnav_data):
     os.mkdir(path_rawnav_data)
 
+output_routes = []
 for analysis_route in analysis_routes:
     
+    path_summary_route = os.path.join(path_summary_rawnav,"route={}".format(analysis_route))
     path_rawnav_route = os.path.join(path_rawnav_data,"route={}".format(analysis_route))
     
-    if (os.path.isdir(path_rawnav_route) and run_existing) or (not os.path.isdir(path_rawnav_route)): 
-        shutil.rmtree(os.path.join(path_rawnav_route), ignore_errors=True) 
-    
-        # Merge Cleaned Rawnav Files Containing The Analysis Route
-        out_rawnav_dat = wr.subset_rawnav_run(
-            rawnav_data_dict_=rawnav_data_dict,
-            rawnav_inventory_filtered_valid_=rawnav_inventory_filtered_valid,
-            analysis_routes_=analysis_route)
-        
-        if out_rawnav_dat.shape == (0, 0):
-            continue
-        
-        # Join Additional Identifying Information
-        temp = summary_rawnav.query('route == @analysis_route')\
-            [['filename', 'index_run_start', 'wday', 'start_date_time']]
-                
-        out_rawnav_dat = out_rawnav_dat.merge(temp, 
-                                              on=['filename', 'index_run_start'], 
-                                              how='left')
-    
-        assert (out_rawnav_dat.groupby(['filename', 'index_run_start', 'index_loc'])['index_loc'].
-                count().values.max() == 1)
-        
-        # Column conversion after missing values removed
-        out_rawnav_dat = out_rawnav_dat.assign(
-            route=lambda x: x.route.astype('str'),
-            #should be okay as int32 if everything goes to plan, but for safety will keep as double
-            # and convert pattern later
-            pattern=lambda x: x.pattern.astype('double')) 
-    
-        # Output    
-        shutil.rmtree(os.path.join(path_rawnav_data,"route={}".format(analysis_route)), ignore_errors=True) 
-                
-        table = pa.Table.from_pandas(out_rawnav_dat,
-                                     schema = wr.rawnav_data_schema())
-        
-        pq.write_to_dataset(table, 
-                            root_path=os.path.join(path_rawnav_data),
-                            partition_cols=['route','wday'])
+    # Existing data for these routes is replaced once all files are parsed, see overwrite below
+    if run_existing or (not os.path.isdir(path_summary_route)) or (not os.path.isdir(path_rawnav_route)): 
+        output_routes.append(analysis_route)
     else:
         print('skipping output of {}'.format(analysis_route))
 
+# New or changed files still to be searched for tags are read even if no routes are output
+if (len(output_routes) > 0) or ((rawnav_manifest is not None) and rawnav_manifest.changed.any()):
+    rawnav_inventory_filtered_valid = wr.parse_rawnav_to_parquet(
+        rawnav_inventory_filtered=rawnav_inventory_filtered,
+        analysis_routes=output_routes,
+        path_rawnav_data=path_rawnav_data,
+        path_summary_rawnav=path_summary_rawnav,
+        buffer_rows=buffer_rows,
+        overwrite=True,
+        rawnav_manifest=rawnav_manifest,
+        path_inventory=path_inventory)
+    
+    # Each buffer written adds a file to each partition; rewrite each partition as one file
+    wr.compact_rawnav_dataset(path_rawnav_data)
+    wr.compact_rawnav_dataset(path_summary_rawnav)
+
 execution_time = str(datetime.now() - begin_time).split('.')[0]
-print("Run Time Section 5 Output : {}".format(execution_time))
+print("Run Time Section 3 Load, Clean, and Output RawNav Data : {}".format(execution_time))
 end_time = datetime.now()
 print("End Time : {}".format(end_time))
 ########################################################################################################################
@@ -69,6 +69,14 @@ analysis_days = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturd
 # analysis_days = ['Friday']
 # EPSG code for WMATA-area work
 wmata_crs = 2248
+# Rawnav columns used in the merge
+rawnav_cols = ['index_loc', 'lat', 'long', 'x_ft', 'y_ft', 'heading', 'door_state', 'veh_state', 
+               'odom_ft', 'sec_past_st', 'stop_window', 'row_before_apc', 'route_pattern', 'route',
+               'pattern', 'index_run_start', 'index_run_end', 'filename', 'wday', 'start_date_time',
+               'run_id']
+# Folder on a local disk for a cache of rawnav partitions shared by scripts 02 to 04, see 
+# wr.read_cleaned_rawnav. None reads the parquet datasets directly.
+path_rawnav_cache = None
 
 # 1.3 Import User-Defined Package
 ############################################
@@ -119,9 +127,10 @@ for analysis_route in analysis_routes:
                 wr.read_cleaned_rawnav(
                    analysis_routes_ = analysis_route,
                    analysis_days_ = analysis_day,
-                   path = os.path.join(path_processed_data, "rawnav_data.parquet")
+                   path = os.path.join(path_processed_data, "rawnav_data.parquet"),
+                   cache_dir = path_rawnav_cache,
+                   columns = rawnav_cols
                 )
-                .drop(columns=['blank', 'lat_raw', 'long_raw', 'sat_cnt'])
             )
         except Exception as e:
             print(e)  # usually no data found or something similar
@@ -132,7 +141,8 @@ for analysis_route in analysis_routes:
                 wr.read_cleaned_rawnav(
                     analysis_routes_ = analysis_route,
                     analysis_days_ = analysis_day,
-                    path = os.path.join(path_processed_data, "rawnav_summary.parquet")
+                    path = os.path.join(path_processed_data, "rawnav_summary.parquet"),
+                    cache_dir = path_rawnav_cache
                 )
             )
 
@@ -145,20 +155,11 @@ for analysis_route in analysis_routes:
                                                 on=['filename', 'index_run_start'],
                                                 how='right')
 
-            rawnav_qjump_gdf = (
-                gpd.GeoDataFrame(
-                    rawnav_qjump_dat,
-                    geometry=gpd.points_from_xy(rawnav_qjump_dat.long, rawnav_qjump_dat.lat),
-                    crs='EPSG:4326'
-                )
-                .to_crs(epsg=wmata_crs)
-            )
-
         stop_summary, stop_index = (
             wr.merge_rawnav_wmata_schedule(
                 analysis_route_=analysis_route,
                 analysis_day_=analysis_day,
-                rawnav_dat_=rawnav_qjump_gdf,
+                rawnav_dat_=rawnav_qjump_dat,
                 rawnav_sum_dat_=rawnav_summary_dat,
                 wmata_schedule_dat_=wmata_schedule_gdf
             )
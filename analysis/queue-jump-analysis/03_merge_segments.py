@@ -62,6 +62,14 @@ analysis_days = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturd
 
 # EPSG code for WMATA-area work
 wmata_crs = 2248
+# Rawnav columns used in the merge
+rawnav_cols = ['index_loc', 'lat', 'long', 'x_ft', 'y_ft', 'heading', 'door_state', 'veh_state', 
+               'odom_ft', 'sec_past_st', 'stop_window', 'row_before_apc', 'route_pattern', 'route',
+               'pattern', 'index_run_start', 'index_run_end', 'filename', 'wday', 'start_date_time',
+               'run_id']
+# Folder on a local disk for a cache of rawnav partitions shared by scripts 02 to 04, see 
+# wr.read_cleaned_rawnav. None reads the parquet datasets directly.
+path_rawnav_cache = None
 # 1.3 Import User-Defined Package
 ############################################
 import wmatarawnav as wr
@@ -162,8 +170,9 @@ for analysis_route in analysis_routes:
                 wr.read_cleaned_rawnav(
                    analysis_routes_ = analysis_route,
                    analysis_days_ = analysis_day,
-                   path = os.path.join(path_processed_data, "rawnav_data.parquet"))
-                .drop(columns=['blank', 'lat_raw', 'long_raw', 'sat_cnt'])
+                   path = os.path.join(path_processed_data, "rawnav_data.parquet"),
+                   cache_dir = path_rawnav_cache,
+                   columns = rawnav_cols)
                 )
         except:
             print(f'No data on analysis route {analysis_route} for {analysis_day}')
@@ -175,7 +184,8 @@ for analysis_route in analysis_routes:
                 wr.read_cleaned_rawnav(
                     analysis_routes_ = analysis_route,
                     analysis_days_ = analysis_day,
-                    path = os.path.join(path_processed_data, "rawnav_summary.parquet")
+                    path = os.path.join(path_processed_data, "rawnav_summary.parquet"),
+                    cache_dir = path_rawnav_cache
                 )
             )
 
@@ -186,18 +196,6 @@ for analysis_route in analysis_routes:
             rawnav_qjump_dat = rawnav_dat.merge(rawnav_summary_dat[['filename', 'index_run_start']], 
                                                 on=['filename', 'index_run_start'],
                                                 how='right')
-            
-            # Address Remaining Col Format issues
-            rawnav_qjump_gdf = (
-                gpd.GeoDataFrame(
-                    rawnav_qjump_dat, 
-                    geometry = gpd.points_from_xy(
-                        rawnav_qjump_dat.long,
-                        rawnav_qjump_dat.lat
-                    ),
-                    crs='EPSG:4326')
-                .to_crs(epsg=wmata_crs)
-            )
     
             # Iterate on over Pattern-Segments Combinations Applicable to Route
             xwalk_seg_pattern_subset = xwalk_seg_pattern.query('route == @analysis_route')
@@ -209,7 +207,7 @@ for analysis_route in analysis_routes:
                 # and use the patterns_by_seg to indicate which patterns should be examined
                 index_run_segment_start_end, summary_run_segment = (
                     wr.merge_rawnav_segment(
-                        rawnav_gdf_=rawnav_qjump_gdf,
+                        rawnav_gdf_=rawnav_qjump_dat,
                         rawnav_sum_dat_=rawnav_summary_dat,
                         target_=segments.loc[segments.seg_name_id == seg],
                         patterns_by_seg_=xwalk_seg_pattern_subset.loc[xwalk_seg_pattern_subset.seg_name_id == seg]
@@ -61,6 +61,13 @@ q_jump_route_list = ['S1', 'S2', 'S4', 'S9',
 analysis_routes = q_jump_route_list
 # EPSG code for WMATA-area work
 wmata_crs = 2248
+# Rawnav columns used in decomposition
+rawnav_cols = ['index_loc', 'lat', 'long', 'heading', 'door_state', 'veh_state', 'odom_ft', 
+               'sec_past_st', 'stop_window', 'row_before_apc', 'route_pattern', 'route', 'pattern', 
+               'index_run_start', 'index_run_end', 'filename', 'wday', 'start_date_time', 'run_id']
+# Folder on a local disk for a cache of rawnav partitions shared by scripts 02 to 04, see 
+# wr.read_cleaned_rawnav. None reads the parquet datasets directly.
+path_rawnav_cache = None
      
 # 1.3 Import User-Defined Package
 #################################
@@ -148,14 +155,6 @@ for seg in list(xwalk_seg_pattern_stop.seg_name_id.drop_duplicates()): #["eleven
 
     seg_routes = list(xwalk_seg_pattern_stop_fil.route.drop_duplicates())
     
-    rawnav_dat = (
-        wr.read_cleaned_rawnav(
-           analysis_routes_ = seg_routes,
-           path = os.path.join(path_processed_data, "rawnav_data.parquet")
-        )
-        .drop(columns=['blank', 'lat_raw', 'long_raw', 'sat_cnt'])
-    )
-            
     segment_summary = (
         pq.read_table(
             source = os.path.join(path_processed_data,"segment_summary_2017_test.parquet"),
@@ -175,6 +174,17 @@ for seg in list(xwalk_seg_pattern_stop.seg_name_id.drop_duplicates()): #["eleven
         )
     )
        
+    # Only runs in the filtered segment summary are used below, so only those are read
+    rawnav_dat = (
+        wr.read_cleaned_rawnav(
+           analysis_routes_ = seg_routes,
+           path = os.path.join(path_processed_data, "rawnav_data.parquet"),
+           cache_dir = path_rawnav_cache,
+           columns = rawnav_cols,
+           runs = segment_summary_fil[['filename', 'index_run_start']]
+        )
+    )
+    
     stop_index = (
         pq.read_table(source=os.path.join(path_processed_data,"stop_index.parquet"),
                       filters=[[('route','=',route)] for route in seg_routes],
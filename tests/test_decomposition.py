@@ -225,3 +225,39 @@ def test_resum_matches_total(get_tt_decomp):
     )
 
     assert(len(runs_with_bad_secs_totals) == 0)
+
+def test_run_pushdown_matches_decomp(get_cwd, get_analysis_route, get_segment_summary, 
+                                     get_stop_index, get_stop_area_decomp):
+    # Reading only the needed columns and the runs in the segment summary should give the 
+    # same stop area decomposition as reading all rawnav data
+    rawnav_dat = (
+        wr.read_cleaned_rawnav(
+            analysis_routes_=get_analysis_route,
+            path = os.path.join(
+                get_cwd,
+                "data",
+                "00-raw",
+                "demo_data",
+                "03_notebook_data",
+                "rawnav_data.parquet"
+            ),
+            columns = ['filename', 'index_run_start', 'index_loc', 'odom_ft', 'sec_past_st',
+                       'door_state', 'veh_state', 'route', 'pattern', 'wday', 'start_date_time'],
+            runs = get_segment_summary[['filename', 'index_run_start']]
+        )
+    )
+    
+    assert(set(zip(rawnav_dat.filename, rawnav_dat.index_run_start))
+           .issubset(set(zip(get_segment_summary.filename, get_segment_summary.index_run_start))))
+    
+    stop_area_decomp = (
+        wr.decompose_stop_area(
+            rawnav_dat,
+            get_segment_summary,
+            get_stop_index
+        )
+    )
+    
+    pd.testing.assert_series_equal(
+        stop_area_decomp.stop_area_phase.reset_index(drop=True),
+        get_stop_area_decomp.stop_area_phase.reset_index(drop=True))
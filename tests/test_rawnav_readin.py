@@ -15,8 +15,13 @@ Created on Wed Jun 10 03:48:45 2020
 import pytest
 import os
 import pandas as pd
+import geopandas as gpd
 import json
 import glob
+import zipfile
+import pyarrow as pa
+import pyarrow.parquet as pq
+import shutil
 import sys
 
 sys.path.append('.')
@@ -93,6 +98,38 @@ def get_rawnav_rawnav_summary_dict(get_route_rawnav_tag_dict):
     return rawnav_data_dict, summary_data_dict
 
 
+@pytest.fixture(scope="session")
+def get_parsed_rawnav(get_rawnav_inventory, tmp_path_factory):
+    # U6 parsed once to parquet, written file by file with a small buffer. Tests that write to
+    # the output should work on a copy from copy_parsed_rawnav
+    path_parsed = tmp_path_factory.mktemp("parsed_rawnav")
+    path_rawnav_data = str(path_parsed / "rawnav_data.parquet")
+    path_summary_rawnav = str(path_parsed / "rawnav_summary.parquet")
+    wr.parse_rawnav_to_parquet(get_rawnav_inventory,
+                               ['U6'],
+                               path_rawnav_data=path_rawnav_data,
+                               path_summary_rawnav=path_summary_rawnav,
+                               buffer_rows=1)
+    return path_rawnav_data, path_summary_rawnav
+
+
+def copy_parsed_rawnav(parsed_rawnav, path_dir):
+    paths_copy = []
+    for path in parsed_rawnav:
+        path_copy = str(path_dir / os.path.basename(path))
+        shutil.copytree(path, path_copy)
+        paths_copy.append(path_copy)
+    return tuple(paths_copy)
+
+
+def read_sorted_rawnav(path, sort_cols=['filename', 'index_loc'], **kwargs):
+    return (
+        wr.read_cleaned_rawnav(path, ['U6'], **kwargs)
+        .sort_values(sort_cols)
+        .reset_index(drop=True)
+    )
+
+
 ###############################################################################
 # Readin Checks
 
@@ -171,3 +208,410 @@ def test_summary_match(get_rawnav_rawnav_summary_dict):
 
     assert found_summary_vals == expect_summary_vals
 
+
+def test_single_pass_load_matches(get_cwd, get_rawnav_inventory, get_rawnav_inv_filt_first):
+    # Finding tags and loading data in one pass should give the same inventory and raw data
+    # as find_rawnav_routes followed by load_rawnav_data
+    zipped_files_dir_parent = os.path.join(get_cwd, "data/00-raw/demo_data/01_notebook_data")
+    file_universe = glob.glob(os.path.join(zipped_files_dir_parent, 'rawnav*.zip'))
+    rawnav_inventory, rawnav_raw_data_dict = (
+        wr.find_rawnav_routes_load_data(file_universe, analysis_routes=['U6'], nmax=None, quiet=True)
+    )
+    
+    pd.testing.assert_frame_equal(rawnav_inventory, get_rawnav_inventory)
+    
+    rawnav_inv_filt_first = get_rawnav_inv_filt_first
+    assert set(rawnav_raw_data_dict.keys()) == set(rawnav_inv_filt_first.filename)
+    for index, row in rawnav_inv_filt_first.iterrows():
+        # Note that the raw data in other fixtures is modified in place during cleaning,
+        # so we reload here
+        expected = wr.load_rawnav_data(zip_folder_path=row['fullpath'], skiprows=row['line_num'])
+        pd.testing.assert_frame_equal(rawnav_raw_data_dict.get(row['filename']), expected)
+
+
+def test_parallel_inventory_matches(get_cwd, get_rawnav_inventory):
+    # Searching files for tags in worker processes should not change the inventory or its order
+    zipped_files_dir_parent = os.path.join(get_cwd, "data/00-raw/demo_data/01_notebook_data")
+    file_universe = glob.glob(os.path.join(zipped_files_dir_parent, 'rawnav*.zip'))
+    rawnav_inventory = wr.find_rawnav_routes(file_universe, nmax=None, quiet=True, n_workers=2, chunksize=1)
+    
+    pd.testing.assert_frame_equal(rawnav_inventory, get_rawnav_inventory)
+
+
+def test_valid_data_entries_match_rowwise():
+    # The vectorized check should agree with the row-wise check, including for tags and
+    # values out of range
+    test_dat = wr.tribble(
+        [0,                 1,          2,     3,      4], 
+        "38.921298", -76.969803,      "312",   "C",    "S",
+        "APC",                0,          0,  None,   None,
+        "/ 05:35:00 Buswares navigation reported end of route", 1.0, None, None, None,
+        "91.0",      -76.969803,      "312",   "C",    "S",
+        "38.921298", -76.969803,      "361",   "O",    "M",
+        "38.921298", -76.969803,       "12",   "X",    "M",
+        " 38.92 ",   -76.969803,        "0",   "O",    "M"
+    )
+    
+    expected = test_dat.apply(wr.check_valid_data_entry, axis=1).tolist()
+    found = wr.check_valid_data_entries(test_dat).tolist()
+    
+    assert found == expected
+    assert found == [True, False, False, False, False, False, True]
+
+
+def test_interval_join_left_join_semantics():
+    # Values outside any interval are kept with -1, values in overlapping intervals repeat,
+    # and intervals with missing bounds never match
+    values_pos, interval_pos = wr.interval_join_index(
+        values = [0, 5, 10, 15, 20],
+        starts = [0, 10, 12, float('nan')],
+        ends = [5, 15, 30, 20]
+    )
+    
+    assert values_pos.tolist() == [0, 1, 2, 3, 3, 4]
+    assert interval_pos.tolist() == [0, 0, 1, 1, 2, 2]
+
+
+def test_distance_latlong_matches_to_crs():
+    # The array distance should match projecting points with geopandas, and be missing where
+    # a point is missing
+    lat1 = [38.921298, 38.93, float('nan')]
+    long1 = [-76.969803, -77.01, -77.0]
+    lat2 = [38.925, 38.91, 38.9]
+    long2 = [-76.97, -77.03, -77.0]
+    points1 = gpd.GeoSeries(gpd.points_from_xy(long1[:2], lat1[:2]), crs='epsg:4326').to_crs(epsg=3310)
+    points2 = gpd.GeoSeries(gpd.points_from_xy(long2[:2], lat2[:2]), crs='epsg:4326').to_crs(epsg=3310)
+    
+    found = wr.get_distance_latlong(lat1, long1, lat2, long2)
+    
+    assert found[:2] == pytest.approx(points1.distance(points2).values)
+    assert pd.isna(found[2])
+
+
+def test_incremental_inventory_matches(get_cwd, get_rawnav_inventory, tmp_path):
+    # Updating an inventory file by file should give the same inventory as a full search,
+    # and files already in the manifest should not be searched again
+    zipped_files_dir_parent = os.path.join(get_cwd, "data/00-raw/demo_data/01_notebook_data")
+    file_universe = glob.glob(os.path.join(zipped_files_dir_parent, 'rawnav*.zip'))
+    path_inventory = str(tmp_path / "rawnav_inventory.parquet")
+    
+    wr.update_rawnav_inventory(file_universe[:1], path_inventory=path_inventory)
+    rawnav_inventory, _ = wr.update_rawnav_inventory(file_universe, path_inventory=path_inventory)
+    pd.testing.assert_frame_equal(rawnav_inventory[get_rawnav_inventory.columns],
+                                  get_rawnav_inventory.reset_index(drop=True),
+                                  check_dtype=False)
+    
+    manifest = pd.read_parquet(str(tmp_path / "rawnav_inventory_manifest.parquet"))
+    assert(set(manifest.fullpath) == set(file_universe))
+    assert(manifest.md5.notna().all())
+
+
+def test_nested_zip_inventory_matches(get_cwd, get_rawnav_inventory, tmp_path):
+    # Files read in place from a zipped directory should give the same inventory as 
+    # the same files on disk
+    zipped_files_dir_parent = os.path.join(get_cwd, "data/00-raw/demo_data/01_notebook_data")
+    file_universe = glob.glob(os.path.join(zipped_files_dir_parent, 'rawnav*.zip'))
+    path_zip_dir = str(tmp_path / "Vehicles 0-2999.zip")
+    with zipfile.ZipFile(path_zip_dir, 'w') as zip_dir:
+        for path in file_universe:
+            zip_dir.write(path, "Vehicles 0-2999/" + os.path.basename(path))
+    
+    nested_file_universe = wr.get_zipped_files_from_zip_dir(path_zip_dir)
+    assert(len(nested_file_universe) == len(file_universe))
+    rawnav_inventory = wr.find_rawnav_routes(nested_file_universe, nmax=None, quiet=True)
+    pd.testing.assert_frame_equal(rawnav_inventory.drop(columns=['fullpath']), 
+                                  get_rawnav_inventory.drop(columns=['fullpath']))
+
+
+def test_route_line_range_load_matches(get_rawnav_rawnav_summary_dict, get_rawnav_inventory, 
+                                       get_rawnav_inv_filt_first):
+    # Parsing only the lines of runs on analysis routes should give the same cleaned data and 
+    # summary for those routes as parsing the rest of the file
+    rawnav_data_dict, summary_data_dict = get_rawnav_rawnav_summary_dict
+    analysis_routes = ['U6']
+    for index, row in get_rawnav_inv_filt_first.iterrows():
+        tag_info_line_no = get_rawnav_inventory[get_rawnav_inventory['filename'] == row['filename']]
+        tag_info_line_no = tag_info_line_no.assign(line_num = lambda x: x.line_num.astype(int))
+        tag_info_line_no.loc[:, "new_line_no"] = tag_info_line_no.line_num - row['line_num'] - 1
+        line_ranges, tag_info_line_no = wr.get_rawnav_run_line_ranges(tag_info_line_no, analysis_routes)
+        raw_data = wr.load_rawnav_data_lines(zip_folder_path=row['fullpath'],
+                                             skiprows=row['line_num'],
+                                             line_ranges=line_ranges)
+        temp = wr.clean_rawnav_data({'RawData': raw_data, 'tagLineInfo': tag_info_line_no}, row['filename'])
+        
+        expected_data = rawnav_data_dict[row['filename']]
+        expected_summary = summary_data_dict[row['filename']]
+        pd.testing.assert_frame_equal(
+            temp['rawnavdata'].query("route in @analysis_routes").reset_index(drop=True),
+            expected_data.query("route in @analysis_routes").reset_index(drop=True))
+        pd.testing.assert_frame_equal(
+            temp['summary_data'].reset_index(drop=True),
+            expected_summary.query("route in @analysis_routes").reset_index(drop=True))
+
+
+def test_streaming_parse_matches(get_rawnav_rawnav_summary_dict, get_parsed_rawnav):
+    # Writing each file as it is cleaned, with a small buffer, should give the same rawnav data
+    # as cleaning all files before writing
+    rawnav_data_dict, summary_data_dict = get_rawnav_rawnav_summary_dict
+    analysis_routes = ['U6']
+    path_rawnav_data, path_summary_rawnav = get_parsed_rawnav
+
+    rawnav_data = read_sorted_rawnav(path_rawnav_data)
+    expected_data = (
+        pd.concat(rawnav_data_dict.values())
+        .query("route in @analysis_routes")
+        .sort_values(['filename', 'index_loc'])
+        .reset_index(drop=True)
+    )
+    assert(len(rawnav_data) == len(expected_data))
+    pd.testing.assert_series_equal(rawnav_data.odom_ft, expected_data.odom_ft, check_dtype=False)
+    
+    summary_rawnav = wr.read_cleaned_rawnav(path_summary_rawnav, analysis_routes)
+    expected_summary = pd.concat(summary_data_dict.values()).query("route in @analysis_routes")
+    assert(len(summary_rawnav) == len(expected_summary))
+
+
+def test_compact_schema_matches_original(get_parsed_rawnav, tmp_path):
+    # Data written with the compact schema should read back with narrow dtypes and the same
+    # values as data written with the original schema, which should also still be readable
+    path_rawnav_data, _ = get_parsed_rawnav
+    path_rawnav_data_v1 = str(tmp_path / "rawnav_data_v1.parquet")
+
+    rawnav_data = read_sorted_rawnav(path_rawnav_data)
+
+    pq.write_to_dataset(pa.Table.from_pandas(rawnav_data.astype({'door_state': 'str',
+                                                                 'veh_state': 'str',
+                                                                 'stop_window': 'str',
+                                                                 'row_before_apc': 'float64'}),
+                                             schema=wr.rawnav_data_schema(version = 1),
+                                             preserve_index=False),
+                        root_path=path_rawnav_data_v1,
+                        partition_cols=['route', 'wday'])
+    rawnav_data_v1 = read_sorted_rawnav(path_rawnav_data_v1)
+
+    assert(rawnav_data.index_loc.dtype == 'int32')
+    assert(rawnav_data.odom_ft.dtype == 'float32')
+    assert(rawnav_data.door_state.dtype.name == 'category')
+    assert(rawnav_data_v1.index_loc.dtype == 'float64')
+    pd.testing.assert_frame_equal(rawnav_data_v1,
+                                  rawnav_data[rawnav_data_v1.columns],
+                                  check_dtype=False,
+                                  check_categorical=False)
+    assert(rawnav_data.memory_usage().sum() < rawnav_data_v1.memory_usage().sum())
+
+
+def test_typed_load_matches(get_rawnav_rawnav_summary_dict, get_rawnav_inventory, 
+                            get_rawnav_inv_filt_first):
+    # Loading pings with declared types and other lines separately should give the same cleaned
+    # data as inferring types for all lines together, with state columns as categoricals
+    rawnav_data_dict, summary_data_dict = get_rawnav_rawnav_summary_dict
+    for index, row in get_rawnav_inv_filt_first.iterrows():
+        tag_info_line_no = get_rawnav_inventory[get_rawnav_inventory['filename'] == row['filename']]
+        tag_info_line_no = tag_info_line_no.assign(line_num = lambda x: x.line_num.astype(int))
+        tag_info_line_no.loc[:, "new_line_no"] = tag_info_line_no.line_num - row['line_num'] - 1
+        raw_data, event_data = wr.load_rawnav_data_typed(zip_folder_path=row['fullpath'],
+                                                         skiprows=row['line_num'])
+        assert(raw_data[0].dtype == 'float64')
+        assert(raw_data[3].dtype.name == 'category')
+        temp = wr.clean_rawnav_data({'RawData': raw_data, 
+                                     'EventData': event_data, 
+                                     'tagLineInfo': tag_info_line_no}, 
+                                    row['filename'])
+        
+        pd.testing.assert_frame_equal(
+            temp['rawnavdata'].reset_index(drop=True), 
+            rawnav_data_dict[row['filename']].reset_index(drop=True),
+            check_dtype=False,
+            check_categorical=False)
+        pd.testing.assert_frame_equal(
+            temp['summary_data'].reset_index(drop=True),
+            summary_data_dict[row['filename']].reset_index(drop=True))
+
+
+def test_read_runs_matches(get_parsed_rawnav, tmp_path):
+    # Reading runs through the run catalog should give the same data as filtering a read of the
+    # partitions, including after the catalog is rebuilt from the files
+    path_rawnav_data, _ = copy_parsed_rawnav(get_parsed_rawnav, tmp_path)
+
+    rawnav_data = read_sorted_rawnav(path_rawnav_data)
+    run_keys = rawnav_data[['filename', 'index_run_start']].drop_duplicates().iloc[::2]
+    expected_data = (
+        rawnav_data
+        .merge(run_keys, on=['filename', 'index_run_start'])
+    )
+
+    run_catalog = wr.read_run_catalog(path_rawnav_data)
+    assert(run_catalog.n_rows.sum() == len(rawnav_data))
+
+    for rebuild in [False, True]:
+        if rebuild:
+            wr.build_run_catalog(path_rawnav_data)
+        rawnav_runs = (
+            wr.read_runs(path_rawnav_data, run_keys)
+            .sort_values(['filename', 'index_loc'])
+            .reset_index(drop=True)
+        )
+        pd.testing.assert_frame_equal(rawnav_runs[expected_data.columns], expected_data)
+
+
+def test_row_groups_align_to_runs():
+    # Runs are added to a row group while it stays within the target size, and never split
+    rawnav_file = pd.DataFrame({
+        'filename': ['a'] * 5 + ['b'] * 3,
+        'index_run_start': [0, 0, 0, 3, 3, 0, 0, 2]
+    })
+    assert(wr.get_row_group_bounds(rawnav_file, 4) == [(0, 3), (3, 7), (7, 8)])
+    assert(wr.get_row_group_bounds(rawnav_file, 1) == [(0, 3), (3, 5), (5, 7), (7, 8)])
+    assert(wr.get_row_group_bounds(rawnav_file, 100) == [(0, 8)])
+
+
+def test_compaction_matches(get_rawnav_inventory, get_parsed_rawnav, tmp_path):
+    # Compacting data written twice should leave one file per partition with the same data
+    # as reading and removing duplicates
+    path_rawnav_data, path_summary_rawnav = copy_parsed_rawnav(get_parsed_rawnav, tmp_path)
+    wr.parse_rawnav_to_parquet(get_rawnav_inventory,
+                               ['U6'],
+                               path_rawnav_data=path_rawnav_data,
+                               path_summary_rawnav=path_summary_rawnav)
+
+    for path, sort_cols in [(path_rawnav_data, ['filename', 'index_loc']),
+                            (path_summary_rawnav, ['filename', 'index_run_start'])]:
+        expected = read_sorted_rawnav(path, sort_cols)
+        wr.compact_rawnav_dataset(path)
+        compacted = read_sorted_rawnav(path, sort_cols)
+        for partition_dir in glob.glob(os.path.join(path, 'route=*', 'wday=*')):
+            assert(len(glob.glob(os.path.join(partition_dir, '*.parquet'))) == 1)
+        pd.testing.assert_frame_equal(compacted, expected)
+    
+    run_catalog = wr.read_run_catalog(path_rawnav_data)
+    assert(not run_catalog.duplicated(['filename', 'index_run_start']).any())
+
+
+def test_partition_overwrite_matches(get_rawnav_inventory, get_parsed_rawnav, tmp_path):
+    # Parsing twice with overwrite should leave one generation in each partition, so reads skip
+    # removing duplicates, and the same data as parsing twice and removing duplicates on read.
+    # Partitions of the route that the second parse does not write are removed as well.
+    rawnav_data = {}
+    for overwrite in [False, True]:
+        path_dir = tmp_path / "overwrite_{}".format(overwrite)
+        path_dir.mkdir()
+        path_rawnav_data, path_summary_rawnav = copy_parsed_rawnav(get_parsed_rawnav, path_dir)
+        wr.write_rawnav_data(read_sorted_rawnav(path_rawnav_data).head(10).assign(wday = 'Holiday'),
+                             path_rawnav_data)
+        wr.parse_rawnav_to_parquet(get_rawnav_inventory,
+                                   ['U6'],
+                                   path_rawnav_data=path_rawnav_data,
+                                   path_summary_rawnav=path_summary_rawnav,
+                                   overwrite=overwrite)
+        partition_files = wr.list_partition_files(path_rawnav_data)
+        partitions_dup = wr.get_partitions_with_duplicates(partition_files)
+        assert((len(partitions_dup) == 0) == overwrite)
+        assert(('Holiday' in partition_files.wday.tolist()) != overwrite)
+        rawnav_data[overwrite] = read_sorted_rawnav(path_rawnav_data)
+    
+    pd.testing.assert_frame_equal(rawnav_data[True], rawnav_data[False])
+
+
+def test_cached_read_matches(get_rawnav_inventory, get_parsed_rawnav, tmp_path):
+    # Reads through the local cache should match reads of the parquet dataset, and reuse cached
+    # partitions until the partitions are written again
+    path_rawnav_data, path_summary_rawnav = copy_parsed_rawnav(get_parsed_rawnav, tmp_path)
+    cache_dir = str(tmp_path / "rawnav_cache")
+
+    rawnav_data = read_sorted_rawnav(path_rawnav_data)
+    for _ in range(2):
+        rawnav_data_cached = read_sorted_rawnav(path_rawnav_data, cache_dir=cache_dir)
+        pd.testing.assert_frame_equal(rawnav_data_cached, rawnav_data, check_categorical=False)
+
+    n_partitions = len(wr.list_partition_files(path_rawnav_data)[['route', 'wday']].drop_duplicates())
+    assert(len(glob.glob(os.path.join(cache_dir, '*.arrow'))) == n_partitions)
+
+    wr.parse_rawnav_to_parquet(get_rawnav_inventory,
+                               ['U6'],
+                               path_rawnav_data=path_rawnav_data,
+                               path_summary_rawnav=path_summary_rawnav,
+                               overwrite=True)
+    wr.read_cleaned_rawnav(path_rawnav_data, ['U6'], cache_dir=cache_dir)
+    assert(len(glob.glob(os.path.join(cache_dir, '*.arrow'))) == 2 * n_partitions)
+
+
+def test_batch_iterator_matches(get_parsed_rawnav):
+    # Batches by run, file or number of rows should together give the data read at once
+    path_rawnav_data, _ = get_parsed_rawnav
+
+    rawnav_data = read_sorted_rawnav(path_rawnav_data)
+    for by, n_keys in [('run', 2), ('file', 1), ('rows', None)]:
+        batches = list(wr.iter_rawnav_batches(path_rawnav_data, ['U6'], by=by, batch_rows=50))
+        if n_keys is not None:
+            key_cols = ['filename', 'index_run_start'][:n_keys]
+            assert(all(len(batch[key_cols].drop_duplicates()) == 1 for batch in batches))
+        else:
+            assert(all(len(batch) <= 50 for batch in batches))
+        rawnav_batches = (
+            pd.concat(batches, ignore_index=True)
+            .sort_values(['filename', 'index_loc'])
+            .reset_index(drop=True)
+        )
+        pd.testing.assert_frame_equal(rawnav_batches[rawnav_data.columns], 
+                                      rawnav_data, 
+                                      check_categorical=False)
+
+
+def test_run_id_matches_runs(get_parsed_rawnav):
+    # run_id should be stored in rawnav data and summaries, be the same for the same run in each
+    # and map back to filename and index_run_start
+    analysis_routes = ['U6']
+    path_rawnav_data, path_summary_rawnav = get_parsed_rawnav
+
+    rawnav_data = wr.read_cleaned_rawnav(path_rawnav_data, analysis_routes)
+    summary_rawnav = wr.read_cleaned_rawnav(path_summary_rawnav, analysis_routes)
+    
+    assert(rawnav_data.run_id.dtype == 'int64')
+    for file_path in wr.list_partition_files(path_rawnav_data).file_path:
+        assert('run_id' in pq.read_schema(os.path.join(path_rawnav_data, file_path)).names)
+    
+    run_keys = rawnav_data[['run_id', 'filename', 'index_run_start']].drop_duplicates()
+    assert(run_keys.run_id.is_unique)
+    assert(set(run_keys.run_id) == set(summary_rawnav.run_id))
+    pd.testing.assert_frame_equal(wr.get_run_keys(run_keys.run_id),
+                                  run_keys.reset_index(drop=True),
+                                  check_dtype=False)
+    
+    run_keys_fil = run_keys.iloc[::2]
+    rawnav_runs = wr.read_runs(path_rawnav_data, run_keys_fil[['run_id']])
+    assert(set(rawnav_runs.run_id) == set(run_keys_fil.run_id))
+    assert(len(rawnav_runs) == rawnav_data.run_id.isin(run_keys_fil.run_id).sum())
+
+
+def test_tag_without_pings_dropped(get_rawnav_inventory, get_parsed_rawnav, tmp_path, capsys):
+    # A file ending in a tag with no pings after it should parse, with that run dropped and
+    # printed, and the same data as the file without the last tag
+    tag_last = get_rawnav_inventory[get_rawnav_inventory.route == 'U6'].iloc[-1]
+    with zipfile.ZipFile(tag_last.fullpath) as zip_file:
+        rawnav_text = zip_file.read(tag_last.filename).decode('utf-8')
+    path_zip = str(tmp_path / (tag_last.filename + '.zip'))
+    with zipfile.ZipFile(path_zip, 'w') as zip_file:
+        zip_file.writestr(tag_last.filename,
+                          rawnav_text.rstrip('\r\n') + '\n' + tag_last.taglist.split(',', 1)[1] + '\n')
+
+    rawnav_inventory = wr.find_rawnav_routes([path_zip], nmax=None, quiet=True)
+    path_rawnav_data = str(tmp_path / "rawnav_data.parquet")
+    path_summary_rawnav = str(tmp_path / "rawnav_summary.parquet")
+    wr.parse_rawnav_to_parquet(rawnav_inventory,
+                               ['U6'],
+                               path_rawnav_data=path_rawnav_data,
+                               path_summary_rawnav=path_summary_rawnav)
+    assert("Dropping 1 run(s) without pings" in capsys.readouterr().out)
+
+    for path, path_expected, sort_cols in [
+            (path_rawnav_data, get_parsed_rawnav[0], ['filename', 'index_loc']),
+            (path_summary_rawnav, get_parsed_rawnav[1], ['filename', 'index_run_start'])]:
+        expected = (
+            read_sorted_rawnav(path_expected, sort_cols)
+            .query("filename == @tag_last.filename")
+            .drop(columns=['fullpath'], errors='ignore')
+            .reset_index(drop=True)
+        )
+        pd.testing.assert_frame_equal(read_sorted_rawnav(path, sort_cols)[expected.columns],
+                                      expected,
+                                      check_categorical=False)
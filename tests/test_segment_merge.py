@@ -218,6 +218,96 @@ def test_explode(get_segments):
     assert test_last.all()
     # note that these endpoints were also manually verified on map    
     
+def test_summarize_run_windows():
+    # Pings between boundaries are summarized per window, ignoring pings outside of the 
+    # window and windows on runs with no pings
+    rawnav_dat = wr.tribble(
+        ['run_id', 'index_loc', 'odom_ft', 'sec_past_st'],
+        1, 12, 130.0, 7,
+        1, 10, 100.0, 5,
+        1, 11, 110.0, 6,
+        1, 13, 150.0, 9,
+        2, 11, 20.0, 3,
+        2, 12, 25.0, 4
+    )
+    window_dat = wr.tribble(
+        ['run_id', 'index_loc_first_stop', 'index_loc_last_stop'],
+        1, 11, 12,
+        2, 10, 20,
+        3, 1, 5
+    )
+    
+    window_summary = wr.summarize_run_windows(
+        rawnav_dat, 
+        window_dat,
+        {'odom_ft_range': ('odom_ft', 'range'),
+         'odom_ft_first': ('odom_ft', 'first'),
+         'sec_past_st_last': ('sec_past_st', 'last'),
+         'sec_past_st_sum': ('sec_past_st', 'sum')}
+    )
+    
+    assert(window_summary.run_id.tolist() == [1, 2])
+    assert(window_summary.odom_ft_range.tolist() == [20.0, 5.0])
+    assert(window_summary.odom_ft_first.tolist() == [110.0, 20.0])
+    assert(window_summary.sec_past_st_last.tolist() == [7, 4])
+    assert(window_summary.sec_past_st_sum.tolist() == [13, 7])
+    
+def test_segment_pattern_dist_out_and_back():
+    # On an out-and-back pattern, GPS drift on the way back puts the pings on the way out 
+    # nearer the boundaries of a segment on the way back. Nearest matching then lands on the 
+    # wrong pass, while matching along the pattern stays on the way back.
+    from shapely.geometry import LineString
+    
+    pattern = gpd.GeoDataFrame(
+        {'route': ['X1'], 'pattern': [1]},
+        geometry = [LineString([(0, 0), (5000, 0), (5000, 40), (0, 40)])],
+        crs = 2248)
+    segment = gpd.GeoDataFrame(
+        {'seg_name_id': ['back_stub']},
+        geometry = [LineString([(3000, 40), (2000, 40)])],
+        crs = 2248)
+    patterns_by_seg = pd.DataFrame({'route': ['X1'], 'pattern': [1], 'seg_name_id': ['back_stub']})
+    
+    odom_ft = np.arange(0, 10000, 50.0)
+    rawnav_dat = pd.DataFrame({
+        'filename': 'rawnav00001191007.txt',
+        'index_run_start': 0,
+        'index_loc': np.arange(len(odom_ft)),
+        'odom_ft': odom_ft,
+        'sec_past_st': np.arange(len(odom_ft)) * 5,
+        'x_ft': np.where(odom_ft <= 5000, odom_ft, 10000 - odom_ft),
+        'y_ft': np.where(odom_ft <= 5000, 0.0, 90.0),
+        'route': 'X1',
+        'pattern': 1})
+    rawnav_dat = rawnav_dat.assign(lat = rawnav_dat.y_ft, long = rawnav_dat.x_ft)
+    summary_dat = pd.DataFrame({
+        'filename': ['rawnav00001191007.txt'],
+        'index_run_start': [0],
+        'route': ['X1'],
+        'pattern': [1],
+        'wday': ['Monday'],
+        'start_date_time': [pd.Timestamp('2019-10-07 06:00:00')]})
+    
+    index_nearest, summary_nearest = wr.merge_rawnav_segment(
+        rawnav_gdf_ = rawnav_dat,
+        rawnav_sum_dat_ = summary_dat,
+        target_ = segment,
+        patterns_by_seg_ = patterns_by_seg)
+    index_pattern, summary_pattern = wr.merge_rawnav_segment(
+        rawnav_gdf_ = rawnav_dat,
+        rawnav_sum_dat_ = summary_dat,
+        target_ = segment,
+        patterns_by_seg_ = patterns_by_seg,
+        match_method_ = "pattern_dist",
+        pattern_shape_dat_ = wr.make_pattern_shape(pattern))
+    
+    assert(index_nearest.sort_values('location').index_loc.tolist() == [60, 40])
+    assert(index_nearest.flag_wrong_order.any())
+    assert(index_pattern.sort_values('location').index_loc.tolist() == [140, 160])
+    assert(not index_pattern.flag_wrong_order.any())
+    assert(summary_pattern.start_index_loc_segment.tolist() == [140])
+    assert(summary_pattern.end_index_loc_segment.tolist() == [160])
+    
 # Note: determination of point nearest to start and end of segment uses same matching function
 # as the schedule stop merge, so no additional checks performed here.
 # The schedule stop merge functions were largely validated using review of interactive maps 
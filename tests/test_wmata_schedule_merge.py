@@ -14,6 +14,8 @@ Created on Mon Jun 22 10:18 2020
 import pytest
 import os
 import sys
+import itertools
+import numpy as np
 import pandas as pd
 import geopandas as gpd
 sys.path.append('.')
@@ -178,3 +180,201 @@ def test_nearest_point(get_stops_results):
     assert(nearest_long_match)
 
     
+
+def test_plain_rawnav_matches_geometry(get_rawnav_data, get_rawnav_summary_dat, 
+                                       get_wmata_schedule_data, get_stops_results):
+    # Rawnav data without geometry is matched on x_ft and y_ft, projected from lat and long 
+    # when not already in the data, and should find the same nearest points
+    stop_summary, stop_index = get_stops_results
+    
+    rawnav_dat = wr.drop_geometry(get_rawnav_data)
+    _, stop_index_plain = (
+        wr.merge_rawnav_wmata_schedule(
+            analysis_route_=["H8"],
+            analysis_day_=["Sunday"],
+            rawnav_dat_=rawnav_dat,
+            rawnav_sum_dat_=get_rawnav_summary_dat,
+            wmata_schedule_dat_=get_wmata_schedule_data
+        )
+    )
+    
+    pd.testing.assert_frame_equal(
+        wr.drop_geometry(stop_index_plain)[['filename', 'index_run_start', 'stop_id', 'index_loc']]
+        .reset_index(drop=True),
+        wr.drop_geometry(stop_index)[['filename', 'index_run_start', 'stop_id', 'index_loc']]
+        .reset_index(drop=True))
+
+def test_batched_nearest_matches_per_run(get_rawnav_data, get_wmata_schedule_data):
+    # All runs of a route and pattern are matched in one pass; this should agree with 
+    # building a tree for each run
+    rawnav_dat = wr.add_run_id(get_rawnav_data)
+    nearest_batched = wr.merge_rawnav_target(get_wmata_schedule_data, rawnav_dat)
+    
+    target_groups = get_wmata_schedule_data.groupby(['route', 'pattern'])
+    nearest_per_run = pd.concat(
+        [wr.ckdnearest(target_groups.get_group((name[0], name[1])).copy(), rawnav_group.copy())
+         for name, rawnav_group in rawnav_dat.groupby(['route', 'pattern', 'run_id'])
+         if (name[0], name[1]) in target_groups.groups],
+        ignore_index=True)
+    
+    cols = ['run_id', 'stop_id', 'index_loc', 'dist_to_nearest_point']
+    pd.testing.assert_frame_equal(nearest_batched[cols], nearest_per_run[cols])
+
+def test_stop_order_keeps_most_stops():
+    # A stop snapped out of order should cost only that stop, not every stop after it
+    stop_dat = wr.tribble(
+        ['filename', 'index_run_start', 'stop_sort_order', 'index_loc'],
+        "rawnav00001191007.txt", 0, 1, 10,
+        "rawnav00001191007.txt", 0, 2, 50,
+        "rawnav00001191007.txt", 0, 3, 20,
+        "rawnav00001191007.txt", 0, 4, 30,
+        "rawnav00001191007.txt", 0, 5, 40,
+        "rawnav00001191007.txt", 100, 1, 110,
+        "rawnav00001191007.txt", 100, 2, 105,
+        "rawnav00001191007.txt", 100, 3, 120
+    )
+    
+    stop_dat_clean = wr.assert_clean_stop_order_increase_with_odom(stop_dat)
+    
+    assert(stop_dat_clean.index_loc.tolist() == [10, 20, 30, 40, 110, 120])
+
+def test_longest_nondecreasing_mask_matches_search():
+    # Each group should keep its longest non-decreasing subsequence, the earliest one where
+    # several are equally long, as found by trying every subsequence from longest down
+    rng = np.random.RandomState(0)
+    counts = rng.randint(1, 9, 200)
+    groups = np.repeat(np.arange(len(counts)), counts)
+    values = rng.randint(0, 6, len(groups))
+    
+    expected = np.zeros(len(values), dtype=bool)
+    for start, count in zip(np.r_[0, np.cumsum(counts)[:-1]], counts):
+        group_values = values[start:start + count]
+        for size in range(count, 0, -1):
+            kept = next((pos for pos in itertools.combinations(range(count), size) 
+                         if all(np.diff(group_values[list(pos)]) >= 0)), None)
+            if kept is not None:
+                expected[start + np.array(kept)] = True
+                break
+    
+    keep = wr.longest_nondecreasing_mask(groups, values, group_chunk=7)
+    
+    assert(keep.tolist() == expected.tolist())
+
+def test_ordered_match_keeps_stops_in_order(get_rawnav_data, get_rawnav_summary_dat, 
+                                            get_wmata_schedule_data, get_stops_results):
+    # Matching the stops of each run together should keep at least as many stops as 
+    # matching each stop to its nearest point and then dropping stops out of order
+    stop_summary, stop_index = get_stops_results
+    
+    _, stop_index_ordered = (
+        wr.merge_rawnav_wmata_schedule(
+            analysis_route_=["H8"],
+            analysis_day_=["Sunday"],
+            rawnav_dat_=get_rawnav_data,
+            rawnav_sum_dat_=get_rawnav_summary_dat,
+            wmata_schedule_dat_=get_wmata_schedule_data,
+            match_method_="ordered"
+        )
+    )
+    
+    assert(len(stop_index_ordered) >= len(stop_index))
+    assert(all(stop_index_ordered.dist_to_nearest_point < 100))
+    assert(all(stop_index_ordered.groupby(['run_id']).index_loc.diff().dropna() >= 0))
+
+def test_pattern_dist_follows_stop_order(get_rawnav_data, get_rawnav_summary_dat, 
+                                         get_wmata_schedule_data):
+    # Stops lie on the pattern shape drawn through them, so their distance along it should
+    # increase with stop order, and stops matched by this distance should be close by
+    pattern_shape = wr.make_pattern_shape(get_wmata_schedule_data)
+    stop_dat = (
+        wr.add_pattern_dist(get_wmata_schedule_data, pattern_shape)
+        .dropna(subset=['pattern_dist_ft'])
+        .sort_values(['route', 'pattern', 'stop_sort_order'])
+    )
+    
+    assert(all(stop_dat.groupby(['route', 'pattern']).pattern_dist_ft.diff().dropna() >= 0))
+    assert(all(stop_dat.pattern_offset_ft < 1))
+    
+    _, stop_index_pattern = (
+        wr.merge_rawnav_wmata_schedule(
+            analysis_route_=["H8"],
+            analysis_day_=["Sunday"],
+            rawnav_dat_=get_rawnav_data,
+            rawnav_sum_dat_=get_rawnav_summary_dat,
+            wmata_schedule_dat_=get_wmata_schedule_data,
+            match_method_="pattern_dist"
+        )
+    )
+    
+    assert(len(stop_index_pattern) > 0)
+    assert(all(stop_index_pattern.dist_to_nearest_point < 100))
+
+def test_pattern_dist_on_loop():
+    # On a loop the last stop is where the first stop is. A stray ping at the terminal that
+    # is closest to the closing leg should not make the run skip the rest of the loop.
+    def around_square(dist_ft, side_ft=2000):
+        leg, along = np.divmod(np.asarray(dist_ft, dtype='float64'), side_ft)
+        leg = leg % 4
+        x = np.select([leg == 0, leg == 1, leg == 2], [along, side_ft, side_ft - along], 0)
+        y = np.select([leg == 0, leg == 1, leg == 2], [0, along, side_ft], side_ft - along)
+        return x, y
+    
+    stop_x, stop_y = around_square(np.arange(9) * 1000)
+    stop_dat = pd.DataFrame({'route': 'U6', 'pattern': 1, 'stop_id': np.arange(9), 
+                             'stop_sort_order': np.arange(9), 'x_ft': stop_x, 'y_ft': stop_y})
+    
+    odom_ft = np.r_[np.zeros(5), np.arange(0, 8000, 30), np.full(5, 8000)]
+    ping_x, ping_y = around_square(odom_ft)
+    ping_x[2], ping_y[2] = -30, 100
+    rawnav_dat = wr.add_run_id(
+        pd.DataFrame({'filename': "rawnav00001191007.txt", 'index_run_start': 0, 
+                      'index_loc': np.arange(len(odom_ft)), 'route': 'U6', 'pattern': 1, 
+                      'odom_ft': odom_ft, 'sec_past_st': np.arange(len(odom_ft)), 
+                      'lat': np.nan, 'long': np.nan, 'x_ft': ping_x, 'y_ft': ping_y}))
+    
+    pattern_shape = wr.make_pattern_shape(stop_dat)
+    stop_dat = wr.add_pattern_dist(stop_dat, pattern_shape, order_cols=['stop_sort_order'])
+    rawnav_dat = wr.add_pattern_dist(rawnav_dat, pattern_shape, 
+                                     order_cols=['filename', 'index_run_start', 'index_loc'],
+                                     run_cols=['filename', 'index_run_start'],
+                                     max_ahead_ft=300)
+    
+    assert(stop_dat.pattern_dist_ft.tolist() == list(np.arange(9) * 1000.))
+    assert(all(rawnav_dat.pattern_dist_ft.diff().dropna() >= 0))
+    
+    stop_index = wr.merge_rawnav_target(stop_dat, rawnav_dat, method="pattern_dist")
+    
+    assert(stop_index.stop_id.tolist() == list(range(9)))
+    assert(all(stop_index.index_loc.diff().dropna() > 0))
+    assert(all(stop_index.dist_to_nearest_point < 100))
+
+def test_pattern_dist_mid_pattern_start():
+    # A run that joins the pattern part way along should match the same stops as the nearest
+    # ping to each stop, including the last stop where its last ping falls just short of it
+    stop_dat = pd.DataFrame({'route': 'U6', 'pattern': 1, 'stop_id': np.arange(11), 
+                             'stop_sort_order': np.arange(11), 'x_ft': np.arange(11) * 1000., 
+                             'y_ft': 0.})
+    odom_ft = np.arange(0, 7000, 30.)
+    rawnav_dat = wr.add_run_id(
+        pd.DataFrame({'filename': "rawnav00001191007.txt", 'index_run_start': 0, 
+                      'index_loc': np.arange(len(odom_ft)), 'route': 'U6', 'pattern': 1, 
+                      'odom_ft': odom_ft, 'sec_past_st': np.arange(len(odom_ft)), 
+                      'lat': np.nan, 'long': np.nan, 'x_ft': 3000 + odom_ft, 'y_ft': 5.}))
+    
+    pattern_shape = wr.make_pattern_shape(stop_dat)
+    stop_index_nearest = wr.remove_stops_with_dist_over_100ft(
+        wr.merge_rawnav_target(stop_dat, rawnav_dat, method="nearest"))
+    rawnav_dat = wr.add_pattern_dist(rawnav_dat, pattern_shape, 
+                                     order_cols=['filename', 'index_run_start', 'index_loc'],
+                                     run_cols=['filename', 'index_run_start'],
+                                     max_ahead_ft=300)
+    stop_index = wr.remove_stops_with_dist_over_100ft(
+        wr.merge_rawnav_target(wr.add_pattern_dist(stop_dat, pattern_shape, 
+                                                   order_cols=['stop_sort_order']), 
+                               rawnav_dat, 
+                               method="pattern_dist"))
+    
+    assert(rawnav_dat.pattern_dist_ft.iloc[0] == pytest.approx(3000))
+    assert(stop_index_nearest.stop_id.tolist() == list(range(3, 11)))
+    assert(stop_index.stop_id.tolist() == stop_index_nearest.stop_id.tolist())
+    assert(stop_index.index_loc.tolist() == stop_index_nearest.index_loc.tolist())
@@ -59,10 +59,12 @@ def decompose_traveltime(
     travel_time_decomp: pd.DataFrame, decomposition of travel time in a segment. 
     """
     
+    segment_summary_ = ll.add_run_id(segment_summary_)
+    
     basic_decomp_agg = (
-        stop_area_decomp
+        ll.add_run_id(stop_area_decomp)
         # Note that we drop any stop_id grouping here, since this method just needs us to sum t_stop1s
-        .groupby(['filename','index_run_start','stop_area_phase'])
+        .groupby(['run_id','stop_area_phase'])
         # While we can sum marginal values for t_stop1, if we do so for the accel phase, we'll
         # include a value outside of the segment. Instead, we subtract the min from the max value
         # to find the difference
@@ -80,9 +82,9 @@ def decompose_traveltime(
     t_stop1_by_run = (
         basic_decomp_agg
         .loc[lambda x: x.stop_area_phase.isin(["t_stop1","t_stop",'t_l_initial','t_l_addl'])]
-        .filter(items = ['filename','index_run_start','stop_area_phase','secs_marg_sum'])
+        .filter(items = ['run_id','stop_area_phase','secs_marg_sum'])
         .pivot_table(
-            index = ['filename','index_run_start'], 
+            index = ['run_id'], 
             columns = ['stop_area_phase'], 
             values = 'secs_marg_sum'
         )
@@ -102,7 +104,7 @@ def decompose_traveltime(
     basic_decomp_agg_fil = (
         basic_decomp_agg[
             basic_decomp_agg
-            .groupby(['filename','index_run_start'])['stop_area_phase']
+            .groupby(['run_id'])['stop_area_phase']
             .transform(lambda x: x.isin(['t_stop','t_stop1']).any())
         ]
     )
@@ -153,7 +155,7 @@ def decompose_traveltime(
 
     totals = (
         rawnav_fil_seg
-        .groupby(['filename','index_run_start'])
+        .groupby(['run_id'])
         .agg({"odom_ft": [lambda x: max(x) - min(x)],
               "sec_past_st" : [lambda x: max(x) - min(x)]})
         .pipe(ll.reset_col_names)
@@ -167,12 +169,12 @@ def decompose_traveltime(
         segment_summary_
         .merge(
             t_stop1_by_run,
-            on = ['filename','index_run_start'],
+            on = ['run_id'],
             how = "left"
         )
         .merge(
             totals,
-            on = ['filename','index_run_start'],
+            on = ['run_id'],
             how = "left"
         )
         .assign(
@@ -274,8 +276,9 @@ def decompose_stop_area(rawnav,
         rawnav_fil_1
         .merge(
             stop_index_fil
-            .filter(items = ['filename','index_run_start','odom_ft_qj_stop','stop_id']),
-            on = ['filename','index_run_start'],
+            .pipe(ll.add_run_id)
+            .filter(items = ['run_id','odom_ft_qj_stop','stop_id']),
+            on = ['run_id'],
             how = "left"
         )
     )
@@ -285,7 +288,7 @@ def decompose_stop_area(rawnav,
     # Add Additional Metrics to Rawnav Data 
     # Downstream calculations will require certain values like the speed over the next interval
     rawnav_fil = calc_rolling_vals(rawnav_fil,
-                                   groupvars = ['filename','index_run_start','stop_id'])
+                                   groupvars = ['run_id','stop_id'])
    
     # Filter to Stop Area
     rawnav_fil_stop_area_1 = (
@@ -299,7 +302,7 @@ def decompose_stop_area(rawnav,
     rawnav_fil_stop_area_1 = (
         rawnav_fil_stop_area_1
         .loc[
-            ~rawnav_fil_stop_area_1.duplicated(['filename','index_run_start','index_loc'], keep = "last")
+            ~rawnav_fil_stop_area_1.duplicated(['run_id','index_loc'], keep = "last")
         ]
     )
     
@@ -318,7 +321,7 @@ def decompose_stop_area(rawnav,
     # Add a sequential numbering that increments each time door changes in a run/segment combination   
     rawnav_fil_stop_area_2['door_state_changes'] = (
         rawnav_fil_stop_area_2
-        .groupby(['filename','index_run_start','stop_id'])['door_state_closed']
+        .groupby(['run_id','stop_id'])['door_state_closed']
         .transform(lambda x: x.diff().ne(0).cumsum())
     )
     
@@ -335,13 +338,13 @@ def decompose_stop_area(rawnav,
     # stop, however, briefly.
     veh_state = (
         rawnav_fil_stop_area_2
-        .filter(items = ['filename','index_run_start','stop_id','index_loc','veh_state_moving'])
+        .filter(items = ['run_id','stop_id','index_loc','veh_state_moving'])
         .loc[~rawnav_fil_stop_area_2.fps_next.isnull()]
     )
     
     veh_state['veh_state_changes'] = (
             veh_state
-            .groupby(['filename','index_run_start','stop_id'])['veh_state_moving']
+            .groupby(['run_id','stop_id'])['veh_state_moving']
             .transform(lambda x: x.diff().ne(0).cumsum())
     )
 
@@ -350,7 +353,7 @@ def decompose_stop_area(rawnav,
         .merge(
             veh_state
             .drop(columns = ['veh_state_moving']),
-            on = ['filename','index_run_start','stop_id','index_loc'],
+            on = ['run_id','stop_id','index_loc'],
             how = 'left'
         )
     )
@@ -360,7 +363,7 @@ def decompose_stop_area(rawnav,
     # these values anyhow.
     rawnav_fil_stop_area_3['veh_state_changes'] = (
         rawnav_fil_stop_area_3
-        .groupby(['filename','index_run_start','stop_id'])['veh_state_changes']
+        .groupby(['run_id','stop_id'])['veh_state_changes']
         .transform(lambda x: x.ffill())
         .transform(lambda x: x.bfill())
     )
@@ -374,7 +377,8 @@ def decompose_stop_area(rawnav,
     door_open_cases = (
         rawnav_fil_stop_area_3
         .loc[rawnav_fil_stop_area_3.door_state == "O"]
-        .groupby(['filename','index_run_start','stop_id','door_state'])
+        # door_state may be categorical, in which case unobserved states are left out
+        .groupby(['run_id','stop_id','door_state'], observed = True)
         .agg({"door_state_changes" : ['min','max']})
         .pipe(ll.reset_col_names)
         .drop(columns = ['door_state'])
@@ -388,11 +392,10 @@ def decompose_stop_area(rawnav,
     veh_stop_cases = (
         rawnav_fil_stop_area_3
         .loc[(~rawnav_fil_stop_area_3.veh_state_moving & rawnav_fil_stop_area_3.fps_next.notnull())]
-        .groupby(['filename','index_run_start','stop_id','veh_state_moving'])
+        .groupby(['run_id','stop_id','veh_state_moving'])
         .agg({"veh_state_changes" : ['min','max']})
         .pipe(ll.reset_col_names)
-        .rename(columns = {"filename_" : "filename",
-                          "index_run_start_": "index_run_start",
+        .rename(columns = {"run_id_" : "run_id",
                           "stop_id_":"stop_id",
                           "veh_state_changes_min": "veh_stopped_min",
                           "veh_state_changes_max": "veh_stopped_max"})
@@ -406,12 +409,12 @@ def decompose_stop_area(rawnav,
         rawnav_fil_stop_area_3
         .merge(
             door_open_cases,
-            on = ['filename','index_run_start','stop_id'],
+            on = ['run_id','stop_id'],
             how = 'left'
         )
         .merge(
             veh_stop_cases,
-            on = ['filename','index_run_start','stop_id'],
+            on = ['run_id','stop_id'],
             how = 'left'
         )
     )
@@ -421,7 +424,7 @@ def decompose_stop_area(rawnav,
     # Similar approach for door open but directly applied
     rawnav_fil_stop_area_4['any_door_open'] = (
         rawnav_fil_stop_area_4
-        .groupby(['filename','index_run_start','stop_id'])['door_state_closed']
+        .groupby(['run_id','stop_id'])['door_state_closed']
         .transform(lambda x: any(~x))       
     )
     
@@ -434,7 +437,7 @@ def decompose_stop_area(rawnav,
     
     veh_state_any_move['any_veh_stopped'] = (
         veh_state_any_move
-        .groupby(['filename','index_run_start','stop_id'])['veh_state_moving']
+        .groupby(['run_id','stop_id'])['veh_state_moving']
         .transform(lambda x: any(~x))
     )
 
@@ -443,7 +446,7 @@ def decompose_stop_area(rawnav,
         .merge(
             veh_state_any_move
             .drop(columns = ['veh_state_moving']),
-            on = ['filename','index_run_start','stop_id','index_loc'],
+            on = ['run_id','stop_id','index_loc'],
             how = "left"
         )
         # some NA's may appear after join. We'll usually fill to address these (see below),
@@ -451,7 +454,7 @@ def decompose_stop_area(rawnav,
     
     rawnav_fil_stop_area_4['any_veh_stopped'] = (
         rawnav_fil_stop_area_4
-        .groupby(['filename','index_run_start','stop_id'])['any_veh_stopped']
+        .groupby(['run_id','stop_id'])['any_veh_stopped']
         .transform(lambda x: x.ffill())
         .transform(lambda x: x.bfill())
     )
@@ -521,7 +524,7 @@ def decompose_stop_area(rawnav,
     # the vehicle never appears to stop, but our logic downstream will be unaffected.
     rawnav_fil_stop_area_5['at_stop']= (
         rawnav_fil_stop_area_5
-        .groupby(['filename','index_run_start','stop_id','veh_state_changes'])['rough_phase_by_door']
+        .groupby(['run_id','stop_id','veh_state_changes'])['rough_phase_by_door']
         .transform(lambda var: var.isin(['t_stop1']).any())
     )
     
@@ -614,18 +617,17 @@ def filter_to_segment(rawnav,
     -----
     Note that our segment_summary is already filtered to patterns that are in the correct 
     direction for our segments. This join then filters our rawnav data to those relevant 
-    runs. 
+    runs. Runs are joined on run_id, which is added to either input if missing.
     Note also that this includes the last value at end_odom_ft_segment (<=), rather than
     being right closed. This improves the ease of certain min/max calculations, but note that
     the last marginal value of speeds or odometer values should be discarded before summing.
     """
     rawnav_seg_fil = (
-        rawnav
-        .merge(summary[["filename",
-                        "index_run_start",
-                        "start_index_loc_segment",
-                        "end_index_loc_segment"]],
-               on = ["filename","index_run_start"],
+        ll.add_run_id(rawnav)
+        .merge(ll.add_run_id(summary)[["run_id",
+                                       "start_index_loc_segment",
+                                       "end_index_loc_segment"]],
+               on = ["run_id"],
                how = "right")        
         .query('index_loc >= start_index_loc_segment & index_loc <= end_index_loc_segment')
         .drop(['start_index_loc_segment','end_index_loc_segment'], axis = 1)
@@ -635,7 +637,7 @@ def filter_to_segment(rawnav,
     
 
 def calc_rolling_vals(rawnav,
-                      groupvars = ['filename','index_run_start']):
+                      groupvars = ['run_id']):
     """
     Parameters
     ----------
@@ -652,8 +654,10 @@ def calc_rolling_vals(rawnav,
     multiple stops in it (e.g., Georgia & Irving)
     
     By default calculations are grouped by run, but in certain phases of data processing, it
-    can be appropriate to group by run and stop.
+    can be appropriate to group by run and stop. run_id is added if grouped on but missing.
     """
+    if 'run_id' in groupvars:
+        rawnav = ll.add_run_id(rawnav)
     
     rawnav[['odom_ft_next','sec_past_st_next']] = (
         rawnav
@@ -9,6 +9,9 @@ import geopandas as gpd
 from shapely.geometry import Point
 from scipy.spatial import cKDTree
 import numpy as np
+import re
+from functools import lru_cache
+from pyproj import Transformer
 
 
 def tribble(columns, *data):
@@ -127,14 +130,21 @@ def explode_first_last(gdf):
     
     return(line_first_last)
 
+# Rawnav columns kept for the matched ping in the output of ckdnearest, nearest_point_by_run, 
+# ordered_point_by_run and pattern_dist_point_by_run
+MATCH_RAWNAV_COLS = ['run_id', 'filename', 'index_run_start', 'index_loc', 'odom_ft', 
+                     'sec_past_st', 'lat', 'long']
+
+
 def ckdnearest(gdA, gdB):
     """
     # https://gis.stackexchange.com/questions/222315/geopandas-find-nearest-point-in-other-dataframe
     Parameters
     ----------
-    gdA : gpd.GeoDataFrame
-        typically wmata schedule data for the correct route and direction.
-    gdB : gpd.GeoDataFrame
+    gdA : gpd.GeoDataFrame or pd.DataFrame
+        typically wmata schedule data for the correct route and direction. See 
+        get_point_coords for the coordinates used.
+    gdB : gpd.GeoDataFrame or pd.DataFrame
         rawnav data: only nearest points to gdA are kept in the output.
     Returns
     -------
@@ -144,18 +154,820 @@ def ckdnearest(gdA, gdB):
     
     gdA.reset_index(inplace=True, drop=True);
     gdB.reset_index(inplace=True, drop=True)
-    nA = np.array(list(zip(gdA.geometry.x, gdA.geometry.y)))
-    nB = np.array(list(zip(gdB.geometry.x, gdB.geometry.y)))
+    nA = get_point_coords(gdA)
+    nB = get_point_coords(gdB)
     btree = cKDTree(nB)
     dist, idx = btree.query(nA, k=1)
+    # run_id is carried along where present
+    gdB_cols = [
+        col for col in MATCH_RAWNAV_COLS if (col != 'run_id') or (col in gdB.columns)
+    ]
     gdf = pd.concat(
         [gdA.reset_index(drop=True),
-         gdB.loc[idx, ['filename', 'index_run_start', 'index_loc', 'odom_ft', 'sec_past_st', 'lat', 'long']].reset_index(
-             drop=True),
+         gdB.loc[idx, gdB_cols].reset_index(drop=True),
          pd.Series(dist, name='dist_to_nearest_point')], axis=1)
     return gdf
 
 
+def nearest_point_by_run(gdA, gdB):
+    """
+    Parameters
+    ----------
+    gdA : gpd.GeoDataFrame or pd.DataFrame
+        target points for a single route and pattern, e.g. wmata schedule stops. See 
+        get_point_coords for the coordinates used.
+    gdB : gpd.GeoDataFrame or pd.DataFrame
+        rawnav data for any number of runs on that route and pattern, with column run_id.
+    Returns
+    -------
+    gdf : gpd.GeoDataFrame or pd.DataFrame
+        the same table as ckdnearest applied to each run in turn: one row per run and target
+        point with the closest rawnav point of that run, runs in run_id order and target points
+        in their input order. Where several pings are equally close, the first in the run is
+        kept. Runs without a valid nearest point for each target point are dropped.
+    Notes
+    -----
+    Pings are sorted by run once, and the squared distance from each target point to every
+    ping is reduced per run with np.minimum.reduceat over the run offsets, so all runs are
+    handled together rather than building a tree per run.
+    """
+    gdA = gdA.reset_index(drop=True)
+    run_id = gdB['run_id'].to_numpy()
+    order = np.argsort(run_id, kind='mergesort')
+    run_sorted = run_id[order]
+    starts = np.flatnonzero(np.r_[True, run_sorted[1:] != run_sorted[:-1]])
+    counts = np.diff(np.r_[starts, len(run_sorted)])
+    
+    nA = get_point_coords(gdA)
+    nB = get_point_coords(gdB)[order]
+    positions = np.arange(len(nB))
+    
+    nearest_pos = np.empty((len(starts), len(nA)), dtype='int64')
+    dist = np.empty((len(starts), len(nA)), dtype='float64')
+    for j in range(len(nA)):
+        dist_sq = (nB[:, 0] - nA[j, 0]) ** 2 + (nB[:, 1] - nA[j, 1]) ** 2
+        min_dist_sq = np.fmin.reduceat(dist_sq, starts)
+        # First ping in each run at the minimum distance; missing coordinates never match
+        is_min = dist_sq == np.repeat(min_dist_sq, counts)
+        nearest_pos[:, j] = np.minimum.reduceat(np.where(is_min, positions, len(nB)), starts)
+        dist[:, j] = np.sqrt(min_dist_sq)
+    
+    keep_run = (nearest_pos < len(nB)).all(axis=1)
+    nearest_idx = order[nearest_pos[keep_run].ravel()]
+    
+    gdf = pd.concat(
+        [gdA.iloc[np.tile(np.arange(len(gdA)), keep_run.sum())].reset_index(drop=True),
+         gdB[MATCH_RAWNAV_COLS].iloc[nearest_idx].reset_index(drop=True),
+         pd.Series(dist[keep_run].ravel(), name='dist_to_nearest_point')], axis=1)
+    return gdf
+
+
+def ordered_point_by_run(gdA, gdB, max_dist=100, run_chunk=256):
+    """
+    Parameters
+    ----------
+    gdA : gpd.GeoDataFrame or pd.DataFrame
+        target points for a single route and pattern in the order a bus passes them, e.g. 
+        wmata schedule stops sorted by stop_sort_order. See get_point_coords for the 
+        coordinates used.
+    gdB : gpd.GeoDataFrame or pd.DataFrame
+        rawnav data for any number of runs on that route and pattern, with column run_id.
+    max_dist : float
+        only pings closer than this to a target point (in feet) are candidates for it.
+    run_chunk : int
+        number of runs matched together, limiting memory use.
+    Returns
+    -------
+    gdf : gpd.GeoDataFrame or pd.DataFrame
+        same columns as nearest_point_by_run, with one row per run and matched target point. 
+        Within each run, matched points are in target order and index_loc never decreases.
+    Notes
+    -----
+    Rather than taking the nearest ping to each target point on its own, target points are 
+    matched together by dynamic programming: the most target points possible are matched 
+    to pings within max_dist in order, and among those matches the total distance is the 
+    smallest. Target points with no ping in range, or that cannot be matched in order, are 
+    left out. Target points are handled one at a time, with each step computed over all 
+    pings of a chunk of runs at once.
+    """
+    gdA = gdA.reset_index(drop=True)
+    index_loc = gdB['index_loc'].to_numpy(dtype='float64')
+    run_id = gdB['run_id'].to_numpy()
+    order = np.lexsort((index_loc, run_id))
+    run_sorted = run_id[order]
+    starts = np.flatnonzero(np.r_[True, run_sorted[1:] != run_sorted[:-1]])
+    counts = np.diff(np.r_[starts, len(run_sorted)])
+    
+    nA = get_point_coords(gdA)
+    nB = get_point_coords(gdB)[order]
+    # Matching one more target point always outweighs the distance of all other matches
+    match_reward = max_dist * len(nA) + 1
+    
+    target_pos_list = []
+    rawnav_pos_list = []
+    dist_list = []
+    for chunk_start in range(0, len(starts), run_chunk):
+        chunk_starts = starts[chunk_start:chunk_start + run_chunk]
+        chunk_counts = counts[chunk_start:chunk_start + run_chunk]
+        n_runs = len(chunk_starts)
+        n_pings = chunk_counts.max()
+        
+        # Pings in a runs x pings grid, padded with missing coordinates
+        grid_pos = np.full((n_runs, n_pings), -1, dtype='int64')
+        cols = np.arange(n_pings)
+        is_ping = cols[np.newaxis, :] < chunk_counts[:, np.newaxis]
+        grid_pos[is_ping] = np.concatenate(
+            [np.arange(start, start + count) for start, count in zip(chunk_starts, chunk_counts)])
+        grid_x = np.where(is_ping, nB[grid_pos, 0], np.nan)
+        grid_y = np.where(is_ping, nB[grid_pos, 1], np.nan)
+        
+        # Best score of matches ending exactly at each ping, and the match it ends with
+        best_score = np.full((n_runs, n_pings), np.inf)
+        best_match = np.full((n_runs, n_pings), -1, dtype='int64')
+        match_run, match_col, match_target, match_dist, match_prev = [], [], [], [], []
+        n_match = 0
+        
+        for j in range(len(nA)):
+            # Best earlier match at or before each ping, and where it is
+            prefix_score = np.minimum.accumulate(best_score, axis=1)
+            prefix_col = np.maximum.accumulate(
+                np.where(np.isfinite(best_score) & (best_score == prefix_score), cols, -1), axis=1)
+            
+            with np.errstate(invalid='ignore'):
+                dist = np.sqrt((grid_x - nA[j, 0]) ** 2 + (grid_y - nA[j, 1]) ** 2)
+                cand_run, cand_col = np.nonzero(dist < max_dist)
+            cand_dist = dist[cand_run, cand_col]
+            prev_col = prefix_col[cand_run, cand_col]
+            prev_match = np.where(prev_col >= 0, best_match[cand_run, np.maximum(prev_col, 0)], -1)
+            cand_score = (
+                cand_dist - match_reward 
+                + np.where(prev_col >= 0, prefix_score[cand_run, cand_col], 0)
+            )
+            
+            cand_id = np.arange(n_match, n_match + len(cand_run))
+            n_match += len(cand_run)
+            match_run.append(cand_run)
+            match_col.append(cand_col)
+            match_target.append(np.full(len(cand_run), j))
+            match_dist.append(cand_dist)
+            match_prev.append(prev_match)
+            
+            improves = cand_score < best_score[cand_run, cand_col]
+            best_score[cand_run[improves], cand_col[improves]] = cand_score[improves]
+            best_match[cand_run[improves], cand_col[improves]] = cand_id[improves]
+        
+        if n_match == 0:
+            continue
+        match_run = np.concatenate(match_run)
+        match_col = np.concatenate(match_col)
+        match_target = np.concatenate(match_target)
+        match_dist = np.concatenate(match_dist)
+        match_prev = np.concatenate(match_prev)
+        
+        # Trace back from the best final match of each run
+        end_col = np.argmin(best_score, axis=1)
+        current = best_match[np.arange(n_runs), end_col]
+        kept = []
+        while (current >= 0).any():
+            kept.append(current[current >= 0])
+            current = np.where(current >= 0, match_prev[np.maximum(current, 0)], -1)
+        if len(kept) == 0:
+            continue
+        kept = np.concatenate(kept)
+        kept = kept[np.lexsort((match_target[kept], match_run[kept]))]
+        
+        target_pos_list.append(match_target[kept])
+        rawnav_pos_list.append(grid_pos[match_run[kept], match_col[kept]])
+        dist_list.append(match_dist[kept])
+    
+    if len(target_pos_list) == 0:
+        target_pos, rawnav_idx, dist = np.zeros(0, dtype='int64'), np.zeros(0, dtype='int64'), []
+    else:
+        target_pos = np.concatenate(target_pos_list)
+        rawnav_idx = order[np.concatenate(rawnav_pos_list)]
+        dist = np.concatenate(dist_list)
+    
+    gdf = pd.concat(
+        [gdA.iloc[target_pos].reset_index(drop=True),
+         gdB[MATCH_RAWNAV_COLS].iloc[rawnav_idx].reset_index(drop=True),
+         pd.Series(dist, name='dist_to_nearest_point', dtype='float64')], axis=1)
+    return gdf
+
+
+def pattern_dist_point_by_run(gdA, gdB):
+    """
+    Parameters
+    ----------
+    gdA : gpd.GeoDataFrame or pd.DataFrame
+        target points for a single route and pattern with column pattern_dist_ft, e.g. wmata 
+        schedule stops passed through add_pattern_dist. See get_point_coords for the 
+        coordinates used.
+    gdB : gpd.GeoDataFrame or pd.DataFrame
+        rawnav data for any number of runs on that route and pattern, with columns run_id and
+        pattern_dist_ft. Where a pattern passes the same place twice, pattern_dist_ft should 
+        come from add_pattern_dist with order_cols, so it does not decrease within a run.
+    Returns
+    -------
+    gdf : gpd.GeoDataFrame or pd.DataFrame
+        same columns as nearest_point_by_run, with one row per run and target point. The ping
+        matched is the closest of the pings on either side of where the run first reaches the
+        target point along the pattern, or the last ping of runs that never reach it. As with
+        nearest_point_by_run, matches far from the target point are left for the caller to
+        remove, e.g. with remove_stops_with_dist_over_100ft.
+    Notes
+    -----
+    Pings are sorted by run and index_loc, and the running maximum of pattern_dist_ft in 
+    each run is offset by run so that it increases across all runs. Each target point is then
+    found in every run with a single np.searchsorted call rather than a spatial search.
+    """
+    # Target points off the pattern, e.g. without coordinates, are not matched
+    gdA = gdA[gdA['pattern_dist_ft'].notna()].reset_index(drop=True)
+    run_id = gdB['run_id'].to_numpy()
+    order = np.lexsort((gdB['index_loc'].to_numpy(), run_id))
+    run_sorted = run_id[order]
+    new_run = np.r_[True, run_sorted[1:] != run_sorted[:-1]]
+    starts = np.flatnonzero(new_run)
+    ends = np.r_[starts[1:], len(run_sorted)]
+    run_rank = np.cumsum(new_run) - 1
+    
+    ping_dist = gdB['pattern_dist_ft'].to_numpy(dtype='float64')[order]
+    target_dist = gdA['pattern_dist_ft'].to_numpy(dtype='float64')
+    
+    # Missing distances never count as reaching a target point
+    dist_min = np.nanmin(np.r_[ping_dist, target_dist])
+    dist_range = np.nanmax(np.r_[ping_dist, target_dist]) - dist_min + 1
+    reached = np.where(np.isnan(ping_dist), dist_min, ping_dist) - dist_min
+    reached = np.maximum.accumulate(reached + run_rank * dist_range)
+    
+    run_grid = np.repeat(np.arange(len(starts)), len(gdA))
+    target_pos = np.tile(np.arange(len(gdA)), len(starts))
+    target_reached = target_dist[target_pos] - dist_min + run_grid * dist_range
+    first_reach = np.searchsorted(reached, target_reached, side='left')
+    last_before = np.searchsorted(reached, target_reached, side='right') - 1
+    
+    # Pings on either side of where the run reaches the target point are candidates. These
+    # can be far apart where pings share a distance, e.g. before the start of the pattern. 
+    # Where a run never reaches the target point, e.g. its last ping is just short of the end
+    # of the pattern, only its last ping is a candidate.
+    cand = np.column_stack([first_reach - 1, first_reach, last_before, last_before + 1])
+    cand_valid = (cand >= starts[run_grid][:, np.newaxis]) & (cand < ends[run_grid][:, np.newaxis])
+    cand_idx = order[np.where(cand_valid, cand, 
+                              np.minimum(first_reach, ends[run_grid] - 1)[:, np.newaxis])]
+    
+    nA = get_point_coords(gdA)
+    nB = get_point_coords(gdB)
+    cand_dist = np.sqrt(
+        (nB[cand_idx, 0] - nA[target_pos, 0][:, np.newaxis]) ** 2 +
+        (nB[cand_idx, 1] - nA[target_pos, 1][:, np.newaxis]) ** 2
+    )
+    best_cand = np.argmin(np.where(cand_valid & ~np.isnan(cand_dist), cand_dist, np.inf), axis=1)
+    rows = np.arange(len(best_cand))
+    rawnav_idx = cand_idx[rows, best_cand]
+    dist = cand_dist[rows, best_cand]
+    
+    # Target points with no candidate ping with coordinates are left out
+    has_dist = ~np.isnan(dist)
+    target_pos, rawnav_idx, dist = target_pos[has_dist], rawnav_idx[has_dist], dist[has_dist]
+    
+    gdf = pd.concat(
+        [gdA.iloc[target_pos].reset_index(drop=True),
+         gdB[MATCH_RAWNAV_COLS].iloc[rawnav_idx].reset_index(drop=True),
+         pd.Series(dist, name='dist_to_nearest_point', dtype='float64')], axis=1)
+    return gdf
+
+
+def project_to_line(points, vertices, max_cells=4000000):
+    """
+    Parameters
+    ----------
+    points: np.array
+        n x 2 array of x and y coordinates to project
+    vertices: np.array
+        k x 2 array of x and y coordinates of the line, k >= 2, in the same units as points
+    max_cells: int
+        points are projected in chunks of at most this many point and line segment pairs, 
+        limiting memory use.
+    Returns
+    -------
+    dist_along: np.array
+        distance along the line from its first vertex to the nearest location on the line
+        to each point, NaN for points with missing coordinates.
+    offset: np.array
+        distance from each point to that nearest location.
+    Notes
+    -----
+    Every point is projected onto every line segment at once, with the nearest segment 
+    kept. Where the line passes the same place more than once, the earliest pass is used.
+    """
+    points = np.asarray(points, dtype='float64')
+    vertices = np.asarray(vertices, dtype='float64')
+    assert (len(vertices) >= 2), print("Need at least two vertices for a line")
+    
+    seg_start = vertices[:-1]
+    seg_vec = vertices[1:] - seg_start
+    seg_len_sq = (seg_vec ** 2).sum(axis=1)
+    seg_len = np.sqrt(seg_len_sq)
+    seg_cum_dist = np.r_[0, np.cumsum(seg_len)[:-1]]
+    # Zero length segments project every point onto their start
+    seg_len_sq_safe = np.where(seg_len_sq > 0, seg_len_sq, 1)
+    
+    dist_along = np.full(len(points), np.nan)
+    offset = np.full(len(points), np.nan)
+    chunk_size = max(1, max_cells // len(seg_start))
+    for chunk_start in range(0, len(points), chunk_size):
+        chunk = slice(chunk_start, chunk_start + chunk_size)
+        px = points[chunk, 0][:, np.newaxis] - seg_start[:, 0]
+        py = points[chunk, 1][:, np.newaxis] - seg_start[:, 1]
+        t = np.clip((px * seg_vec[:, 0] + py * seg_vec[:, 1]) / seg_len_sq_safe, 0, 1)
+        dist_sq = (px - t * seg_vec[:, 0]) ** 2 + (py - t * seg_vec[:, 1]) ** 2
+        
+        is_valid = ~np.isnan(points[chunk]).any(axis=1)
+        nearest_seg = np.argmin(np.where(is_valid[:, np.newaxis], dist_sq, 0), axis=1)
+        rows = np.arange(len(nearest_seg))
+        dist_along[chunk] = np.where(
+            is_valid, seg_cum_dist[nearest_seg] + t[rows, nearest_seg] * seg_len[nearest_seg], np.nan)
+        offset[chunk] = np.where(is_valid, np.sqrt(dist_sq[rows, nearest_seg]), np.nan)
+    
+    return dist_along, offset
+
+
+def project_to_line_in_order(points, run_id, vertices, max_ahead=np.inf, odom=None):
+    """
+    Parameters
+    ----------
+    points: np.array
+        n x 2 array of x and y coordinates to project, in the order they are passed within 
+        each run.
+    run_id: np.array
+        run of each point.
+    vertices: np.array
+        k x 2 array of x and y coordinates of the line, k >= 2, in the same units as points
+    max_ahead: float
+        each point after the first of its run is projected no further along the line than 
+        this past the point before it.
+    odom: np.array, optional
+        odometer reading of each point. Where given, the distance travelled since the point 
+        before is added to max_ahead.
+    Returns
+    -------
+    dist_along: np.array
+        distance along the line from its first vertex to the nearest location on the line
+        to each point that is not before the previous point of the run, NaN for points with
+        missing coordinates. This never decreases within a run.
+    offset: np.array
+        distance from each point to that location.
+    Notes
+    -----
+    Unlike project_to_line, points on a line that passes the same place more than once, 
+    e.g. a loop or out-and-back pattern, are kept on the pass the run has reached, and 
+    max_ahead keeps a single stray point from jumping to a later pass. The first point of 
+    each run is projected onto the whole line as in project_to_line, so runs can join the 
+    line part way along. Where the start of the line is within max_ahead of being as close,
+    the start is used instead, so a run beginning at the terminal of a loop is not placed at
+    its end. Runs are handled together one point at a time, with each later point compared 
+    only to the line segments between the previous point of its run and max_ahead past it.
+    """
+    points = np.asarray(points, dtype='float64')
+    vertices = np.asarray(vertices, dtype='float64')
+    run_id = np.asarray(run_id)
+    assert (len(vertices) >= 2), print("Need at least two vertices for a line")
+    if odom is None:
+        odom = np.zeros(len(points))
+    odom = np.asarray(odom, dtype='float64')
+    
+    seg_start = vertices[:-1]
+    seg_vec = vertices[1:] - seg_start
+    seg_len_sq = (seg_vec ** 2).sum(axis=1)
+    seg_len = np.sqrt(seg_len_sq)
+    seg_cum_dist = np.r_[0, np.cumsum(seg_len)[:-1]]
+    seg_len_safe = np.where(seg_len > 0, seg_len, 1)
+    n_seg = len(seg_start)
+    
+    # Points grouped by run, keeping their order within the run
+    order = np.argsort(run_id, kind='mergesort')
+    run_sorted = run_id[order]
+    starts = np.flatnonzero(np.r_[True, run_sorted[1:] != run_sorted[:-1]])
+    counts = np.diff(np.r_[starts, len(run_sorted)])
+    
+    dist_along = np.full(len(points), np.nan)
+    offset = np.full(len(points), np.nan)
+    prev_dist = np.zeros(len(starts))
+    prev_odom = np.full(len(starts), np.nan)
+    started = np.zeros(len(starts), dtype=bool)
+    for k in range(counts.max() if len(counts) > 0 else 0):
+        active = np.flatnonzero(counts > k)
+        pos = order[starts[active] + k]
+        is_valid = ~np.isnan(points[pos]).any(axis=1)
+        active, pos = active[is_valid], pos[is_valid]
+        if len(pos) == 0:
+            continue
+        
+        travelled = np.nan_to_num(odom[pos] - prev_odom[active])
+        lo = prev_dist[active]
+        hi = lo + max_ahead + np.maximum(travelled, 0)
+        seg_lo = np.searchsorted(seg_cum_dist, lo, side='right') - 1
+        seg_hi = np.searchsorted(seg_cum_dist, hi, side='right') - 1
+        segs = seg_lo[:, np.newaxis] + np.arange((seg_hi - seg_lo).max() + 1)
+        in_window = segs <= seg_hi[:, np.newaxis]
+        segs = np.minimum(segs, n_seg - 1)
+        
+        px = points[pos, 0][:, np.newaxis] - seg_start[segs, 0]
+        py = points[pos, 1][:, np.newaxis] - seg_start[segs, 1]
+        t = (px * seg_vec[segs, 0] + py * seg_vec[segs, 1]) / seg_len_safe[segs] ** 2
+        # Only the part of each segment within the window is a candidate
+        t_min = np.clip((lo[:, np.newaxis] - seg_cum_dist[segs]) / seg_len_safe[segs], 0, 1)
+        t_max = np.clip((hi[:, np.newaxis] - seg_cum_dist[segs]) / seg_len_safe[segs], 0, 1)
+        t = np.minimum(np.maximum(t, t_min), t_max)
+        dist_sq = (px - t * seg_vec[segs, 0]) ** 2 + (py - t * seg_vec[segs, 1]) ** 2
+        
+        nearest = np.argmin(np.where(in_window, dist_sq, np.inf), axis=1)
+        rows = np.arange(len(pos))
+        nearest_seg = segs[rows, nearest]
+        point_dist = np.clip(
+            seg_cum_dist[nearest_seg] + t[rows, nearest] * seg_len[nearest_seg], lo, hi)
+        point_offset = np.sqrt(dist_sq[rows, nearest])
+        
+        # The first point of a run is placed anywhere on the line, unless it is within 
+        # max_ahead of being as close to the start
+        first = np.flatnonzero(~started[active])
+        if len(first) > 0:
+            seed_dist, seed_offset = project_to_line(points[pos[first]], vertices)
+            use_seed = seed_offset + max_ahead < point_offset[first]
+            point_dist[first[use_seed]] = seed_dist[use_seed]
+            point_offset[first[use_seed]] = seed_offset[use_seed]
+        
+        dist_along[pos] = point_dist
+        offset[pos] = point_offset
+        prev_dist[active] = point_dist
+        prev_odom[active] = odom[pos]
+        started[active] = True
+    
+    return dist_along, offset
+
+
+def get_point_coords(dat):
+    """
+    Parameters
+    ----------
+    dat : gpd.GeoDataFrame or pd.DataFrame
+        points, either with projected coordinates in columns x_ft and y_ft or with point geometry.
+    Returns
+    -------
+    coords: np.array
+        n x 2 array of x and y coordinates. Columns x_ft and y_ft are used where present, 
+        otherwise the x and y of the geometry.
+    """
+    if {'x_ft', 'y_ft'}.issubset(dat.columns):
+        return dat[['x_ft', 'y_ft']].to_numpy(dtype='float64')
+    return np.column_stack([dat.geometry.x.to_numpy(), dat.geometry.y.to_numpy()])
+
+
+def interval_join_index(values, starts, ends):
+    """
+    Parameters
+    ----------
+    values: np.array
+        values to place into intervals, e.g. index_loc of rawnav pings
+    starts: np.array
+        start of each interval (inclusive), e.g. index_run_start
+    ends: np.array
+        end of each interval (inclusive), same length as starts
+    Returns
+    -------
+    values_pos: np.array
+        positions in values
+    interval_pos: np.array
+        position in starts/ends of the interval containing values[values_pos], or -1 where 
+        the value is in no interval
+    Notes
+    -----
+    Works like a SQL left join of values to intervals on 'value BETWEEN start AND end', 
+    including repeating values that fall in more than one interval and never matching 
+    intervals with missing bounds. Output is ordered by position in values, then by interval.
+    Rather than comparing every value against every interval, values are sorted once and 
+    each interval is located with a binary search (np.searchsorted).
+    """
+    values = np.asarray(values, dtype='float64')
+    starts = np.asarray(starts, dtype='float64')
+    ends = np.asarray(ends, dtype='float64')
+    
+    order = np.argsort(values, kind='mergesort')
+    sorted_values = values[order]
+    
+    # Each interval covers a contiguous range of sorted values; NaN sorts to the end and
+    # so falls outside of any interval
+    first = np.searchsorted(sorted_values, starts, side='left')
+    last = np.searchsorted(sorted_values, ends, side='right')
+    counts = np.where(np.isnan(starts) | np.isnan(ends), 0, np.clip(last - first, 0, None))
+    
+    interval_pos = np.repeat(np.arange(len(starts)), counts)
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    values_pos = order[np.repeat(first, counts) + offsets]
+    
+    # Keep values without an interval, as in a left join
+    matched = np.zeros(len(values), dtype=bool)
+    matched[values_pos] = True
+    unmatched_pos = np.flatnonzero(~matched)
+    values_pos = np.concatenate([values_pos, unmatched_pos])
+    interval_pos = np.concatenate([interval_pos, np.full(len(unmatched_pos), -1)])
+    
+    out_order = np.lexsort((interval_pos, values_pos))
+    
+    return values_pos[out_order], interval_pos[out_order]
+
+
+def get_run_windows(run_id, index_loc, window_run_id, window_start, window_end):
+    """
+    Parameters
+    ----------
+    run_id: np.array
+        run_id of each rawnav ping
+    index_loc: np.array
+        index_loc of each rawnav ping
+    window_run_id: np.array
+        run_id of each window, e.g. a run between its first and last stop
+    window_start: np.array
+        first index_loc in each window (inclusive)
+    window_end: np.array
+        last index_loc in each window (inclusive)
+    Returns
+    -------
+    order: np.array
+        positions of pings sorting them by run_id and index_loc
+    win_first: np.array
+        position in the sorted pings of the first ping in each window
+    win_end: np.array
+        position in the sorted pings just past the last ping in each window, equal to 
+        win_first for windows without pings
+    Notes
+    -----
+    index_loc is offset by run so that it increases across all runs once sorted, and windows
+    are then found with np.searchsorted rather than by joining pings to windows.
+    """
+    run_id = np.asarray(run_id)
+    index_loc = np.asarray(index_loc, dtype='float64')
+    window_run_id = np.asarray(window_run_id)
+    window_start = np.asarray(window_start, dtype='float64')
+    window_end = np.asarray(window_end, dtype='float64')
+    
+    order = np.lexsort((index_loc, run_id))
+    run_sorted = run_id[order]
+    new_run = np.r_[True, run_sorted[1:] != run_sorted[:-1]][:len(order)]
+    run_rank = np.cumsum(new_run) - 1
+    runs = run_sorted[new_run]
+    
+    win_rank = np.searchsorted(runs, window_run_id)
+    if len(runs) > 0:
+        win_has_run = runs[np.minimum(win_rank, len(runs) - 1)] == window_run_id
+    else:
+        win_has_run = np.zeros(len(window_run_id), dtype=bool)
+    
+    all_loc = np.r_[index_loc, window_start, window_end]
+    all_loc = all_loc[~np.isnan(all_loc)]
+    loc_min = all_loc.min() if len(all_loc) > 0 else 0
+    loc_span = (all_loc.max() - loc_min + 1) if len(all_loc) > 0 else 1
+    ping_key = (index_loc[order] - loc_min) + run_rank * loc_span
+    
+    win_first = np.searchsorted(ping_key, (window_start - loc_min) + win_rank * loc_span, side='left')
+    win_end = np.searchsorted(ping_key, (window_end - loc_min) + win_rank * loc_span, side='right')
+    
+    # Windows on runs without pings or with missing bounds are empty
+    win_empty = ~win_has_run | np.isnan(window_start) | np.isnan(window_end) | (win_end < win_first)
+    win_end = np.where(win_empty, win_first, win_end)
+    
+    return order, win_first, win_end
+
+
+def reduce_windows(values, win_first, win_end, how):
+    """
+    Parameters
+    ----------
+    values: np.array
+        values of pings sorted as returned by get_run_windows
+    win_first: np.array
+        position of the first value in each window, from get_run_windows
+    win_end: np.array
+        position just past the last value in each window, from get_run_windows. Every window
+        must hold at least one value.
+    how: str
+        one of 'min', 'max', 'range' (max - min), 'sum', 'first' or 'last'. As in pandas, 
+        missing values are skipped.
+    Returns
+    -------
+    result: np.array
+        one value per window
+    Notes
+    -----
+    Window bounds are interleaved and passed to np.ufunc.reduceat, keeping every other 
+    result, so windows may overlap and come in any order.
+    """
+    values = np.asarray(values)
+    assert (how in ['min', 'max', 'range', 'sum', 'first', 'last']), print("Unknown how")
+    assert (np.all(win_end > win_first)), print("Windows must not be empty")
+    
+    if len(win_first) == 0:
+        return values[:0]
+    
+    is_float = values.dtype.kind == 'f'
+    bounds = np.column_stack([win_first, win_end]).ravel()
+    
+    def reduce(ufunc, vals):
+        # A trailing value keeps bounds at the end of the values valid for reduceat
+        return ufunc.reduceat(np.r_[vals, vals[:1]], bounds)[::2]
+    
+    if how in ['first', 'last']:
+        pos = np.arange(len(values))
+        if how == 'first':
+            valid_pos = np.where(np.isnan(values), len(values), pos) if is_float else pos
+            take_pos = np.minimum(reduce(np.minimum, valid_pos), win_end - 1)
+        else:
+            valid_pos = np.where(np.isnan(values), -1, pos) if is_float else pos
+            take_pos = np.maximum(reduce(np.maximum, valid_pos), win_first)
+        return values[take_pos]
+    if how == 'sum':
+        return reduce(np.add, np.where(np.isnan(values), 0, values) if is_float else values)
+    if how == 'min':
+        return reduce(np.fmin, values)
+    if how == 'max':
+        return reduce(np.fmax, values)
+    return reduce(np.fmax, values) - reduce(np.fmin, values)
+
+
+def summarize_run_windows(rawnav_dat, window_dat, agg_dict, 
+                          start_col='index_loc_first_stop', end_col='index_loc_last_stop'):
+    """
+    Parameters
+    ----------
+    rawnav_dat: pd.DataFrame
+        rawnav data with run_id, index_loc and the columns in agg_dict
+    window_dat: pd.DataFrame
+        one row per window with run_id, start_col and end_col, e.g. the first and last stop 
+        of each run from get_first_last_stop_rawnav
+    agg_dict: dict
+        new column name: (rawnav column, how), see reduce_windows for the options for how
+    start_col: str
+        column in window_dat with the first index_loc of each window (inclusive)
+    end_col: str
+        column in window_dat with the last index_loc of each window (inclusive)
+    Returns
+    -------
+    window_summary: pd.DataFrame
+        rows of window_dat with at least one rawnav ping in the window, with the columns
+        of agg_dict added.
+    """
+    order, win_first, win_end = get_run_windows(
+        rawnav_dat.run_id.to_numpy(), 
+        rawnav_dat.index_loc.to_numpy(),
+        window_dat.run_id.to_numpy(),
+        window_dat[start_col].to_numpy(),
+        window_dat[end_col].to_numpy()
+    )
+    has_pings = win_end > win_first
+    win_first, win_end = win_first[has_pings], win_end[has_pings]
+    
+    window_summary = window_dat[has_pings].reset_index(drop=True)
+    for new_col, (col, how) in agg_dict.items():
+        window_summary[new_col] = reduce_windows(
+            rawnav_dat[col].to_numpy()[order], win_first, win_end, how)
+    
+    return window_summary
+
+
+def longest_nondecreasing_mask(groups, values, group_chunk=10000):
+    """
+    Parameters
+    ----------
+    groups: np.array
+        group of each value, e.g. run_id, with the rows of each group contiguous
+    values: np.array
+        values in the order they should be non-decreasing within each group, e.g. index_loc 
+        of stops sorted by stop_sort_order
+    group_chunk: int
+        number of groups handled together, limiting memory use.
+    Returns
+    -------
+    keep: np.array
+        boolean array, True for the values in the longest non-decreasing subsequence of 
+        each group. Where several subsequences are equally long, the one keeping the earliest
+        values is used, so a single out of order value is dropped rather than its predecessor.
+    Notes
+    -----
+    Groups are laid out as rows of a groups x values grid, padded to the largest group. A 
+    backward pass finds the length of the longest non-decreasing subsequence starting at 
+    each value from the values after it, and a forward pass then keeps each value that can 
+    still start a subsequence of the remaining length. Each pass steps through the positions 
+    of the grid with every step computed over all groups of a chunk at once, so the cost is
+    O(n * m) for m values in the largest group. Groups are the stops of one run, typically 
+    tens and at most a few hundred values.
+    """
+    groups = np.asarray(groups)
+    values = np.asarray(values, dtype='float64')
+    assert (not np.isnan(values).any()), print("Values must not be missing")
+    
+    n = len(values)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+    starts = np.flatnonzero(np.r_[True, groups[1:] != groups[:-1]])
+    counts = np.diff(np.r_[starts, n])
+    
+    for chunk_start in range(0, len(starts), group_chunk):
+        chunk_starts = starts[chunk_start:chunk_start + group_chunk]
+        chunk_counts = counts[chunk_start:chunk_start + group_chunk]
+        n_groups = len(chunk_starts)
+        n_values = chunk_counts.max()
+        
+        # Values in a groups x values grid, padded with values that are never kept
+        cols = np.arange(n_values)
+        is_value = cols[np.newaxis, :] < chunk_counts[:, np.newaxis]
+        grid_pos = np.where(is_value, chunk_starts[:, np.newaxis] + cols[np.newaxis, :], 0)
+        grid_values = np.where(is_value, values[grid_pos], np.inf)
+        
+        # Backward pass
+        len_from = np.zeros((n_groups, n_values), dtype='int64')
+        for j in range(n_values - 1, -1, -1):
+            follows = is_value[:, j + 1:] & (grid_values[:, j + 1:] >= grid_values[:, [j]])
+            len_after = np.max(np.where(follows, len_from[:, j + 1:], 0), axis=1, initial=0)
+            len_from[:, j] = np.where(is_value[:, j], len_after + 1, 0)
+        
+        # Forward pass
+        remaining = len_from.max(axis=1)
+        last_value = np.full(n_groups, -np.inf)
+        grid_keep = np.zeros((n_groups, n_values), dtype=bool)
+        for j in range(n_values):
+            grid_keep[:, j] = (
+                (remaining > 0) & (len_from[:, j] == remaining) & (grid_values[:, j] >= last_value)
+            )
+            remaining = remaining - grid_keep[:, j]
+            last_value = np.where(grid_keep[:, j], grid_values[:, j], last_value)
+        
+        keep[grid_pos[is_value]] = grid_keep[is_value]
+    
+    return keep
+
+
+@lru_cache(maxsize=None)
+def get_transformer(crs_from, crs_to):
+    """
+    Parameters
+    ----------
+    crs_from: str or int
+        crs of input coordinates, e.g. 4326
+    crs_to: str or int
+        crs of output coordinates
+    Returns
+    -------
+    pyproj.Transformer, with x/y (long/lat) axis order. Created once per pair of crs 
+    and then reused.
+    """
+    return Transformer.from_crs(crs_from, crs_to, always_xy=True)
+
+
+def get_projected_xy(lat, long, crs=2248):
+    """
+    Parameters
+    ----------
+    lat, long: np.array
+        points in degrees (EPSG 4326)
+    crs: int, optional
+        projected crs of the output. The default is 2248 (Maryland State Plane, US survey feet), 
+        used for WMATA-area work.
+    Returns
+    -------
+    x, y: np.array
+        projected coordinates of each point, missing where the point is missing.
+    """
+    transformer = get_transformer(4326, crs)
+    x, y = transformer.transform(np.asarray(long, dtype='float64'), np.asarray(lat, dtype='float64'))
+    return x, y
+
+
+def get_distance_latlong(lat1, long1, lat2, long2, crs=3310):
+    """
+    Parameters
+    ----------
+    lat1, long1: np.array
+        first set of points, in degrees (EPSG 4326)
+    lat2, long2: np.array
+        second set of points, same length as lat1
+    crs: int, optional
+        projected crs in which distance is measured. The default is 3310, in meters.
+    Returns
+    -------
+    distance: np.array
+        straight line distance between each pair of points in the units of crs. Missing where
+        either point is missing.
+    Notes
+    -----
+    Gives the same distances as projecting shapely Points with GeoDataFrame.to_crs and using 
+    GeoSeries.distance, but projects all points as arrays rather than one geometry at a time.
+    """
+    x1, y1 = get_projected_xy(lat1, long1, crs)
+    x2, y2 = get_projected_xy(lat2, long2, crs)
+    distance = np.sqrt((x2 - x1) ** 2 + (y2 - y1) ** 2)
+    return distance
+
+
 def reset_col_names(df):
     """
     # https://gis.stackexchange.com/questions/222315/geopandas-find-nearest-point-in-other-dataframe
@@ -176,4 +988,130 @@ def reset_col_names(df):
     df.columns = ["_".join(x) for x in df.columns.ravel()]
     df = df.reset_index()
     df.columns = df.columns.str.replace(pat = "_$",repl = "", regex = True)
-    return(df)
\ No newline at end of file
+    return(df)
+
+# run_id is the file id (the digits in rawnav<file_id>.txt) followed by index_run_start 
+# padded to this many digits. File ids are 11 digits (bus id and date), so run_ids stay 
+# well within int64.
+RUN_ID_START_DIGITS = 7
+
+
+def get_run_id(filename, index_run_start):
+    """
+    Parameters
+    ----------
+    filename: pd.Series or array-like
+        rawnav filenames, e.g. rawnav06544171027.txt
+    index_run_start: pd.Series or array-like
+        index_run_start of each run, same length as filename
+    Returns
+    -------
+    run_id: np.array
+        int64 key for each run
+    Notes
+    -----
+    The run_id is built from the filename and index_run_start rather than numbered as runs 
+    are parsed, so the same run gets the same run_id whichever batch or generation it was 
+    written in, and run_ids can be derived for data written before they were stored. Use
+    get_run_keys to go back to filename and index_run_start. Filenames are parsed once per 
+    unique value.
+    """
+    file_codes, file_uniques = pd.factorize(np.asarray(filename))
+    assert (not (file_codes == -1).any()), print("filename should not be missing")
+    file_ids = [re.search(r'rawnav(\d+)\.txt', str(file)) for file in file_uniques]
+    assert (all(file_id is not None for file_id in file_ids)), \
+        print("filenames should be of the form rawnav<digits>.txt")
+    file_ids = [file_id.group(1) for file_id in file_ids]
+    assert (all(len(file_id) == 11 for file_id in file_ids)), \
+        print("file ids (the digits in rawnav<file_id>.txt) should be 11 digits")
+    
+    index_run_start = np.asarray(index_run_start, dtype='float64')
+    if np.isnan(index_run_start).any():
+        raise ValueError("index_run_start should not be missing; runs without pings should be "
+                         "dropped first (see drop_runs_without_pings)")
+    assert ((index_run_start >= 0) & (index_run_start < 10 ** RUN_ID_START_DIGITS)).all(), \
+        print("index_run_start should be less than {}".format(10 ** RUN_ID_START_DIGITS))
+    
+    run_id = (
+        np.array(file_ids, dtype='int64')[file_codes] * 10 ** RUN_ID_START_DIGITS
+        + index_run_start.astype('int64')
+    )
+    
+    return run_id
+
+
+def get_run_keys(run_id):
+    """
+    Parameters
+    ----------
+    run_id: pd.Series or array-like
+        run_ids, as from get_run_id
+    Returns
+    -------
+    run_keys: pd.DataFrame
+        run_id with the filename and index_run_start of each run
+    """
+    run_id = np.asarray(run_id, dtype='int64')
+    file_ids, index_run_start = np.divmod(run_id, 10 ** RUN_ID_START_DIGITS)
+    
+    run_keys = pd.DataFrame({
+        'run_id': run_id,
+        'filename': ['rawnav{:011d}.txt'.format(file_id) for file_id in file_ids],
+        'index_run_start': index_run_start.astype('int32')
+    })
+    
+    return run_keys
+
+
+def drop_runs_without_pings(dat):
+    """
+    Parameters
+    ----------
+    dat: pd.DataFrame
+        run summary data with columns filename and index_run_start, such as the output of
+        clean_rawnav_data
+    Returns
+    -------
+    dat: pd.DataFrame
+        the same, less runs with a missing index_run_start
+    Notes
+    -----
+    A tag with no pings after it, such as a tag on the last line of a file, gives a run with no
+    index_run_start. These runs have no rows in the rawnav data and cannot be given a run_id,
+    so they are dropped and printed rather than stopping the parse.
+    """
+    no_pings = dat.index_run_start.isna()
+    if no_pings.any():
+        print("Dropping {} run(s) without pings: {}".format(
+            no_pings.sum(),
+            dat.loc[no_pings, [col for col in ['filename', 'taglist'] if col in dat.columns]]
+            .to_dict('records')))
+    return dat[~no_pings]
+
+
+def add_run_id(dat):
+    """
+    Parameters
+    ----------
+    dat: pd.DataFrame
+        data with columns filename and index_run_start, such as rawnav data, rawnav summary 
+        data or outputs of later steps
+    Returns
+    -------
+    dat: pd.DataFrame
+        the same, with run_id added. Where run_id is already present and complete, it is kept.
+    Notes
+    -----
+    run_id is derived again if any values are missing (e.g., data read from files written 
+    both before and after run_id was stored), as integers with missing values are read in as
+    floats, which cannot hold every run_id exactly.
+    """
+    if ('run_id' in dat.columns) and pd.api.types.is_int64_dtype(dat.run_id):
+        return dat
+    
+    assert (set(['filename', 'index_run_start']).issubset(dat.columns)), \
+        print("dat should have columns filename and index_run_start")
+    
+    dat = dat.assign(run_id=get_run_id(dat.filename, dat.index_run_start))
+    
+    return dat
@@ -9,6 +9,7 @@ import inflection
 import pandas as pd
 import pyodbc
 import geopandas as gpd
+import pyproj
 from shapely.geometry import Point
 from shapely.geometry import LineString
 import numpy as np
@@ -132,7 +133,9 @@ def merge_rawnav_wmata_schedule(analysis_route_,
                                 analysis_day_,
                                 rawnav_dat_,
                                 rawnav_sum_dat_,
-                                wmata_schedule_dat_):
+                                wmata_schedule_dat_,
+                                match_method_="nearest",
+                                max_ahead_ft_=300):
     """
     Parameters
     ----------
@@ -146,6 +149,14 @@ def merge_rawnav_wmata_schedule(analysis_route_,
     rawnav_dat_: pd.DataFrame, rawnav data
     rawnav_sum_dat_: pd.DataFrame, rawnav summary data
     wmata_schedule_dat_: pd.DataFrame, wmata schedule data
+    match_method_: str, 
+        "nearest" (default) to match each stop to its nearest rawnav point, then remove stops 
+        out of order; "ordered" to match all stops of a run in order at once, which keeps more 
+        stops on loop and out-and-back patterns; "pattern_dist" to match stops and rawnav points
+        by distance along a pattern shape drawn through the stops. See merge_rawnav_target.
+    max_ahead_ft_: float,
+        with "pattern_dist", the furthest a ping is placed along the pattern past the ping 
+        before it, beyond the distance travelled on the odometer. See add_pattern_dist.
     Returns
     -------
     wmata_schedule_based_sum_dat: pd.DataFrame
@@ -164,11 +175,25 @@ def merge_rawnav_wmata_schedule(analysis_route_,
     if (rawnav_sum_subset_dat.shape[0] == 0): return None, None
 
     # Find rawnav point nearest each stop
-    nearest_rawnav_point_to_wmata_schedule_dat = (
-        merge_rawnav_target(
-            target_dat=wmata_schedule_dat_,
-            rawnav_dat=rawnav_subset_dat)
-    )
+    if match_method_ == "pattern_dist":
+        pattern_shape_dat = make_pattern_shape(wmata_schedule_dat_)
+        nearest_rawnav_point_to_wmata_schedule_dat = (
+            merge_rawnav_target(
+                target_dat=add_pattern_dist(wmata_schedule_dat_, pattern_shape_dat,
+                                            order_cols=['stop_sort_order']),
+                rawnav_dat=add_pattern_dist(rawnav_subset_dat, pattern_shape_dat,
+                                            order_cols=['filename', 'index_run_start', 'index_loc'],
+                                            run_cols=['filename', 'index_run_start'],
+                                            max_ahead_ft=max_ahead_ft_),
+                method=match_method_)
+        )
+    else:
+        nearest_rawnav_point_to_wmata_schedule_dat = (
+            merge_rawnav_target(
+                target_dat=wmata_schedule_dat_,
+                rawnav_dat=rawnav_subset_dat,
+                method=match_method_)
+        )
     
     # Trialing resetting index as suggested by Benjamin Malnor
     # In general indices past the initial read-in don't matter much, so this seems like a safe
@@ -211,8 +236,8 @@ def add_num_missing_stops_to_sum(rawnav_wmata_schedule_dat,
                                  wmata_schedule_based_sum_dat_):
 
     rawnav_wmata_schedule_num_stops = (
-        rawnav_wmata_schedule_dat
-        .groupby(['filename', 'index_run_start'])
+        ll.add_run_id(rawnav_wmata_schedule_dat)
+        .groupby(['run_id'])
         .agg(
             route=('route','first'),
             pattern=('pattern','first'),
@@ -242,56 +267,108 @@ def add_num_missing_stops_to_sum(rawnav_wmata_schedule_dat,
     )
     
     wmata_schedule_based_sum_dat_with_missing_stop = (
-        wmata_schedule_based_sum_dat_.merge(rawnav_wmata_schedule_num_stops,
-                                            on=['filename',
-                                                'index_run_start',
-                                                'route',
-                                                'pattern'],
-                                            how='left')
+        ll.add_run_id(wmata_schedule_based_sum_dat_)
+        .merge(rawnav_wmata_schedule_num_stops,
+               on=['run_id',
+                   'route',
+                   'pattern'],
+               how='left')
     )
     
     return wmata_schedule_based_sum_dat_with_missing_stop
 
 
-def merge_rawnav_target(target_dat, rawnav_dat, quiet=True):
+def merge_rawnav_target(target_dat, rawnav_dat, quiet=True, method="nearest", max_dist=100):
     """
     Parameters
     ----------
-    target_dat : gpd.GeoDataFrame
+    target_dat : gpd.GeoDataFrame or pd.DataFrame
         wmata schedule data with unique stops per route and info on short/long and direction.
-    rawnav_dat :gpd.GeoDataFrame
-        rawnav data.
+        Either point geometry in a CRS with feet as units or columns x_ft and y_ft in EPSG 2248.
+    rawnav_dat : pd.DataFrame or gpd.GeoDataFrame
+        rawnav data. Columns x_ft and y_ft (EPSG 2248) from clean_rawnav_data are used if 
+        present, and are otherwise added from lat and long unless point geometry is given.
+    quiet : bool
+        if False, print route and patterns in rawnav data with no target geometry.
+    method : str
+        "nearest" finds the nearest ping of each run to each target point on its own. 
+        "ordered" matches the target points of a run together, in stop_sort_order (or row 
+        order if absent), to pings within max_dist whose index_loc does not decrease, see
+        ll.ordered_point_by_run. Target points without such a match are left out.
+        "pattern_dist" looks up the ping where each run reaches each target point along the 
+        pattern, see ll.pattern_dist_point_by_run. Both target_dat and rawnav_dat need column 
+        pattern_dist_ft from add_pattern_dist, with order_cols on loop and out-and-back 
+        patterns.
+    max_dist : float
+        distance in feet beyond which pings are not matched, used with method "ordered".
     Returns
     -------
     nearest_rawnav_point_to_target_data : gpd.GeoDataFrame
         A geopandas dataframe with nearest rawnav point to each of the wmata 
         schedule stops on that route.
     """
-
-    assert (bool(re.search("US survey foot", target_dat.crs.to_wkt()))),\
-        print('Need a CRS with feet as units')
-    assert (bool(re.search("US survey foot", rawnav_dat.crs.to_wkt()))),\
-        print('Need a CRS with feet as units')
-    assert (target_dat.crs == rawnav_dat.crs), print("CRS must match between objects")
-
-    # Iterate over groups of routes and patterns in rawnav data and target object
-    target_groups = target_dat.groupby(['route', 'pattern'])
-    rawnav_groups = rawnav_dat.groupby(
-        ['route', 'pattern', 'filename', 'index_run_start'])
-
-    nearest_rawnav_point_to_target_dat = pd.DataFrame()
-    
-    for name, rawnav_group in rawnav_groups:
-        try:
-            target_dat_relevant = \
-                target_groups.get_group(
-                    (name[0], name[1]))
-            nearest_rawnav_point_to_target_dat = \
-                pd.concat([nearest_rawnav_point_to_target_dat,
-                           ll.ckdnearest(target_dat_relevant, rawnav_group)])
-        except:
+    assert (method in ["nearest", "ordered", "pattern_dist"]), \
+        print("method must be 'nearest', 'ordered' or 'pattern_dist'")
+    if method == "pattern_dist":
+        assert ('pattern_dist_ft' in target_dat.columns) and \
+            ('pattern_dist_ft' in rawnav_dat.columns), \
+            print("Need pattern_dist_ft in target and rawnav data, see add_pattern_dist")
+    
+    # Rawnav data parsed before x_ft and y_ft were kept
+    if (not {'x_ft', 'y_ft'}.issubset(rawnav_dat.columns)) and \
+        (not isinstance(rawnav_dat, gpd.GeoDataFrame)):
+        x_ft, y_ft = ll.get_projected_xy(rawnav_dat.lat, rawnav_dat.long)
+        rawnav_dat = rawnav_dat.assign(x_ft=x_ft, y_ft=y_ft)
+    
+    rawnav_dat = ll.add_run_id(rawnav_dat)
+    
+    # Points given as geometry need a CRS in feet, matching the other object
+    crs_list = []
+    for dat in [target_dat, rawnav_dat]:
+        if {'x_ft', 'y_ft'}.issubset(dat.columns):
+            crs_list.append(pyproj.CRS.from_epsg(2248))
+        else:
+            assert (bool(re.search("US survey foot", dat.crs.to_wkt()))),\
+                print('Need a CRS with feet as units')
+            crs_list.append(pyproj.CRS(dat.crs))
+    assert (crs_list[0] == crs_list[1]), print("CRS must match between objects")
+
+    # Find nearest points for all runs of each route and pattern in rawnav data at once
+    target_groups = target_dat.groupby(['route', 'pattern']).indices
+    rawnav_groups = rawnav_dat.groupby(['route', 'pattern']).indices
+
+    nearest_rawnav_point_to_target_list = []
+    
+    for name in sorted(rawnav_groups):
+        if name not in target_groups:
             if (quiet == False):
                 print("No target geometry found for {} - {}".format(name[0],name[1]))
+            continue
+        target_dat_relevant = target_dat.iloc[target_groups[name]]
+        if method == "ordered":
+            if 'stop_sort_order' in target_dat_relevant.columns:
+                target_dat_relevant = \
+                    target_dat_relevant.sort_values('stop_sort_order', kind='mergesort')
+            nearest_rawnav_point_to_target_list.append(
+                ll.ordered_point_by_run(target_dat_relevant, 
+                                        rawnav_dat.iloc[rawnav_groups[name]],
+                                        max_dist=max_dist)
+            )
+        elif method == "pattern_dist":
+            nearest_rawnav_point_to_target_list.append(
+                ll.pattern_dist_point_by_run(target_dat_relevant, 
+                                             rawnav_dat.iloc[rawnav_groups[name]])
+            )
+        else:
+            nearest_rawnav_point_to_target_list.append(
+                ll.nearest_point_by_run(target_dat_relevant, 
+                                        rawnav_dat.iloc[rawnav_groups[name]])
+            )
+    
+    if (len(nearest_rawnav_point_to_target_list) == 0):
+        return pd.DataFrame()
+    
+    nearest_rawnav_point_to_target_dat = pd.concat(nearest_rawnav_point_to_target_list, ignore_index=True)
     
     nearest_rawnav_point_to_target_dat = (
         ll.reorder_first_cols(nearest_rawnav_point_to_target_dat,
@@ -301,6 +378,133 @@ def merge_rawnav_target(target_dat, rawnav_dat, quiet=True):
     return nearest_rawnav_point_to_target_dat
 
 
+def make_pattern_shape(pattern_dat):
+    """
+    Parameters
+    ----------
+    pattern_dat : gpd.GeoDataFrame or pd.DataFrame
+        route and pattern with either
+            - one LineString per route and pattern in geometry, e.g. from GTFS shapes, in a 
+              CRS with feet as units, or
+            - stops with stop_sort_order, e.g. from read_sched_db_patterns, with columns x_ft 
+              and y_ft (EPSG 2248) or point geometry. Stops with missing coordinates are 
+              skipped.
+    Returns
+    -------
+    pattern_shape_dat : pd.DataFrame
+        one row per vertex of each pattern's polyline with columns route, pattern, 
+        vertex_order, x_ft, y_ft and pattern_dist_ft, the distance along the pattern from its 
+        first vertex.
+    """
+    if isinstance(pattern_dat, gpd.GeoDataFrame) and \
+        (pattern_dat.geom_type == "LineString").all():
+        vertex_list = []
+        for row in pattern_dat.itertuples():
+            coords = np.array(row.geometry.coords)[:, :2]
+            vertex_list.append(
+                pd.DataFrame({'route': row.route,
+                              'pattern': row.pattern,
+                              'x_ft': coords[:, 0],
+                              'y_ft': coords[:, 1]})
+            )
+        pattern_shape_dat = pd.concat(vertex_list, ignore_index=True)
+    else:
+        coords = ll.get_point_coords(pattern_dat)
+        pattern_shape_dat = (
+            pd.DataFrame({'route': pattern_dat.route.to_numpy(),
+                          'pattern': pattern_dat.pattern.to_numpy(),
+                          'stop_sort_order': pattern_dat.stop_sort_order.to_numpy(),
+                          'x_ft': coords[:, 0],
+                          'y_ft': coords[:, 1]})
+            .dropna(subset=['x_ft', 'y_ft'])
+            .sort_values(['route', 'pattern', 'stop_sort_order'])
+            .drop(columns=['stop_sort_order'])
+            .reset_index(drop=True)
+        )
+    
+    pattern_groups = pattern_shape_dat.groupby(['route', 'pattern'], sort=False)
+    step_ft = np.sqrt(pattern_groups.x_ft.diff() ** 2 + pattern_groups.y_ft.diff() ** 2).fillna(0)
+    pattern_shape_dat = (
+        pattern_shape_dat
+        .assign(vertex_order=pattern_groups.cumcount(),
+                pattern_dist_ft=step_ft.groupby([pattern_shape_dat.route, 
+                                                 pattern_shape_dat.pattern]).cumsum())
+        .filter(items=['route', 'pattern', 'vertex_order', 'x_ft', 'y_ft', 'pattern_dist_ft'])
+    )
+    
+    return pattern_shape_dat
+
+
+def add_pattern_dist(dat, pattern_shape_dat, order_cols=None, run_cols=None, 
+                     max_ahead_ft=np.inf):
+    """
+    Parameters
+    ----------
+    dat : pd.DataFrame or gpd.GeoDataFrame
+        points with route and pattern, e.g. rawnav data, wmata schedule stops or segment ends.
+        Columns x_ft and y_ft (EPSG 2248) are used if present, then point geometry, then 
+        lat and long. 
+    pattern_shape_dat : pd.DataFrame
+        pattern polylines from make_pattern_shape, in the same CRS as dat.
+    order_cols : list of str, optional
+        if given, points are projected in this order, each no earlier along the pattern than 
+        the point before it, e.g. ['stop_sort_order'] for stops. This keeps points on the right
+        pass of loop and out-and-back patterns. Otherwise each point is projected on its own,
+        and the first pass is used.
+    run_cols : list of str, optional
+        with order_cols, columns identifying separate trips along the pattern, e.g. 
+        ['filename', 'index_run_start'] for rawnav data.
+    max_ahead_ft : float, optional
+        with order_cols, points after the first of each run are also projected no further 
+        than this past the point before, plus the distance travelled since it on the odometer
+        where dat has odom_ft. See ll.project_to_line_in_order.
+    Returns
+    -------
+    dat : pd.DataFrame or gpd.GeoDataFrame
+        input data with columns pattern_dist_ft, the distance along the pattern to the 
+        nearest location on the pattern to each point, and pattern_offset_ft, the distance 
+        from that location to the point. Both are missing for route and patterns without a 
+        shape.
+    """
+    if ({'x_ft', 'y_ft'}.issubset(dat.columns)) or isinstance(dat, gpd.GeoDataFrame):
+        coords = ll.get_point_coords(dat)
+    else:
+        coords = np.column_stack(ll.get_projected_xy(dat.lat, dat.long))
+    
+    pattern_dist_ft = np.full(len(dat), np.nan)
+    pattern_offset_ft = np.full(len(dat), np.nan)
+    
+    dat_groups = dat.groupby(['route', 'pattern']).indices
+    shape_groups = pattern_shape_dat.groupby(['route', 'pattern']).indices
+    for name, rows in dat_groups.items():
+        if name not in shape_groups:
+            continue
+        vertices = (
+            pattern_shape_dat
+            .iloc[shape_groups[name]]
+            .sort_values('vertex_order')
+            .loc[:, ['x_ft', 'y_ft']]
+            .to_numpy(dtype='float64')
+        )
+        if order_cols is None:
+            pattern_dist_ft[rows], pattern_offset_ft[rows] = \
+                ll.project_to_line(coords[rows], vertices)
+            continue
+        group_dat = dat.iloc[rows]
+        rows = rows[np.lexsort([group_dat[col].to_numpy() for col in order_cols[::-1]])]
+        if run_cols is None:
+            run_id = np.zeros(len(rows))
+        else:
+            run_id = dat.iloc[rows].groupby(run_cols, sort=False).ngroup().to_numpy()
+        odom = dat.odom_ft.to_numpy()[rows] if 'odom_ft' in dat.columns else None
+        pattern_dist_ft[rows], pattern_offset_ft[rows] = \
+            ll.project_to_line_in_order(coords[rows], run_id, vertices, max_ahead_ft, odom)
+    
+    dat = dat.assign(pattern_dist_ft=pattern_dist_ft, pattern_offset_ft=pattern_offset_ft)
+    
+    return dat
+
+
 def remove_stops_with_dist_over_100ft(nearest_rawnav_point_to_wmata_schedule_data_):
     """
     Parameters
@@ -342,44 +546,48 @@ def assert_clean_stop_order_increase_with_odom(nearest_rawnav_point_to_wmata_sch
         cleaned data on nearest rawnav point to wmata schedule data where
             - stops whose ordering does not correspond to the index_loc/ time/ odometer are removed 
               i.e. stops are removed if  order does not increase with index_loc or time or distance.
+              The fewest stops needed are removed, keeping the longest run of stops in order.
             - where all stops with closest rawnav point > 100 ft. are removed.
     """
     row_before = nearest_rawnav_point_to_wmata_schedule_data_.shape[0]
+    nearest_rawnav_point_to_wmata_schedule_data_ = \
+        ll.add_run_id(nearest_rawnav_point_to_wmata_schedule_data_)
     nearest_rawnav_point_to_wmata_schedule_data_. \
-        sort_values(['filename', 'index_run_start', 'stop_sort_order'], inplace=True)
+        sort_values(['run_id', 'stop_sort_order'], inplace=True)
     assert (nearest_rawnav_point_to_wmata_schedule_data_.duplicated(
-        ['filename', 'index_run_start', 'stop_sort_order']).sum() == 0)
-    while (sum(nearest_rawnav_point_to_wmata_schedule_data_.
-                       groupby(['filename', 'index_run_start']).index_loc.diff().dropna() < 0) != 0):
-        nearest_rawnav_point_to_wmata_schedule_data_ = \
-            delete_rows_with_incorrect_stop_order(nearest_rawnav_point_to_wmata_schedule_data_)
+        ['run_id', 'stop_sort_order']).sum() == 0)
+    runs_before = nearest_rawnav_point_to_wmata_schedule_data_.run_id.value_counts()
+    nearest_rawnav_point_to_wmata_schedule_data_ = \
+        delete_rows_with_incorrect_stop_order(nearest_rawnav_point_to_wmata_schedule_data_)
     row_after = nearest_rawnav_point_to_wmata_schedule_data_.shape[0]
     row_diff = row_before - row_after
-    print('deleted {} of {} stops with incorrect order from index table'.format(row_diff,row_before))
+    runs_after = nearest_rawnav_point_to_wmata_schedule_data_.run_id.value_counts()
+    runs_diff = runs_before.sub(runs_after, fill_value=0).gt(0).sum()
+    print('deleted {} of {} stops with incorrect order in {} runs from index table'
+          .format(row_diff,row_before,runs_diff))
     return nearest_rawnav_point_to_wmata_schedule_data_
 
 
 def delete_rows_with_incorrect_stop_order(nearest_rawnav_point_to_wmata_schedule_data_):
     """
-    delete stop where the index location does not increase with stop order
+    delete stops where the index location does not increase with stop order
     Parameters
     ----------
     nearest_rawnav_point_to_wmata_schedule_data_: gpd.GeoDataFrame
+        sorted by run_id and stop_sort_order
     Returns
     -------
     nearest_rawnav_point_to_wmata_schedule_data_: gpd.GeoDataFrame
-        input data with the offending row deleted.
+        input data keeping the largest set of stops in each run whose index_loc does not 
+        decrease with stop order.
     """
-
-    nearest_rawnav_point_to_wmata_schedule_data_.loc[:, 'diff_index'] = \
-        nearest_rawnav_point_to_wmata_schedule_data_.groupby(['filename', 'index_run_start']). \
-            index_loc.diff().fillna(0)
-                        
-    wrong_snapping_dat = nearest_rawnav_point_to_wmata_schedule_data_.query('diff_index<0')
+    keep_stop = ll.longest_nondecreasing_mask(
+        nearest_rawnav_point_to_wmata_schedule_data_.run_id.to_numpy(),
+        nearest_rawnav_point_to_wmata_schedule_data_.index_loc.to_numpy()
+    )
+    
     nearest_rawnav_point_to_wmata_schedule_data_ = (
-        nearest_rawnav_point_to_wmata_schedule_data_
-        .query('diff_index>=0')
-        .drop(columns = ['diff_index'])
+        nearest_rawnav_point_to_wmata_schedule_data_[keep_stop]
     )
     return nearest_rawnav_point_to_wmata_schedule_data_
 
@@ -400,79 +608,55 @@ def include_wmata_schedule_based_summary(rawnav_q_dat, rawnav_sum_dat, nearest_s
     rawnav_q_stop_sum_dat: pd.DataFrame
         trip summary data with additional information from wmata schedule data
     '''
-    first_last_stop_dat = get_first_last_stop_rawnav(nearest_stop_dat)
-    
-    rawnav_q_stop_dat = (
-        rawnav_q_dat
-        .merge(first_last_stop_dat
-               .drop(['odom_ft','sec_past_st'], axis = 1),
-               on=['filename', 'index_run_start'], 
-               how='right')
-    )
-    
-    rawnav_q_stop_dat = (
-        rawnav_q_stop_dat
-        .query('index_loc >= index_loc_first_stop & index_loc <= index_loc_last_stop')
-    )
-    
-    rawnav_q_stop_dat = (
-        rawnav_q_stop_dat[
-            ['filename', 
-             'index_run_start', 
-             'lat', 
-             'long',
-             'heading', 
-             'odom_ft', 
-             'sec_past_st',
-             'first_stop_dist_nearest_point', 
-             'trip_length', 
-             'route_text',
-             'pattern_name', 
-             'direction',
-             'pattern_destination', 
-             'direction_id']
-        ]    
-    )
-        
-    Map1 = lambda x: max(x) - min(x)
-    
-    rawnav_q_stop_sum_dat = (
-        rawnav_q_stop_dat
-        .groupby(['filename', 'index_run_start'])
-        .agg({'odom_ft': ['min', 'max', Map1],
-              'sec_past_st': ['min', 'max', Map1],
-              'lat': ['first', 'last'],
-              'long': ['first', 'last'],
-              'first_stop_dist_nearest_point': ['first'],
-              'trip_length': ['first'],
-              'route_text': ['first'],
-              'pattern_name': ['first'],
-              'direction': ['first'],
-              'pattern_destination': ['first'],
-              'direction_id': ['first']})
+    # A tie for the first or last stop gives more than one row for a run
+    first_last_stop_dat = (
+        get_first_last_stop_rawnav(nearest_stop_dat)
+        .drop_duplicates(subset=['run_id'])
     )
     
-    rawnav_q_stop_sum_dat.columns = ["_".join(x) for x in rawnav_q_stop_sum_dat.columns.ravel()]
-
     rawnav_q_stop_sum_dat = (
-        rawnav_q_stop_sum_dat
-        .rename(columns = {'odom_ft_min':'start_odom_ft_wmata_schedule',
-                           'odom_ft_max':'end_odom_ft_wmata_schedule',
-                           'odom_ft_<lambda_0>':'run_dist_mi_odom_wmata_schedule', 
-                           'sec_past_st_min':'start_sec_wmata_schedule',
-                           'sec_past_st_max':'end_sec_wmata_schedule', 
-                           'sec_past_st_<lambda_0>':'run_dur_sec_wmata_schedule',
-                           'lat_first':'start_lat_wmata_schedule', 
-                           'lat_last':'end_lat_wmata_schedule',
-                           'long_first':'start_long_wmata_schedule', 
-                           'long_last': 'end_long_wmata_schedule',
-                           'first_stop_dist_nearest_point_first':'dist_first_stop_wmata_schedule', 
-                           'trip_length_first':'trip_dist_mi_direct_wmata_schedule',
-                           'route_text_first':'route_text_wmata_schedule', 
-                           'pattern_name_first':'pattern_name_wmata_schedule',
-                           'direction_first':'direction_wmata_schedule', 
-                           'pattern_destination_first':'pattern_destination_wmata_schedule',
-                           'direction_id_first':'direction_id_wmata_schedule'})
+        ll.summarize_run_windows(
+            rawnav_dat=ll.add_run_id(rawnav_q_dat),
+            window_dat=first_last_stop_dat,
+            agg_dict={'start_odom_ft_wmata_schedule': ('odom_ft', 'min'),
+                      'end_odom_ft_wmata_schedule': ('odom_ft', 'max'),
+                      'run_dist_mi_odom_wmata_schedule': ('odom_ft', 'range'),
+                      'start_sec_wmata_schedule': ('sec_past_st', 'min'),
+                      'end_sec_wmata_schedule': ('sec_past_st', 'max'),
+                      'run_dur_sec_wmata_schedule': ('sec_past_st', 'range'),
+                      'start_lat_wmata_schedule': ('lat', 'first'),
+                      'end_lat_wmata_schedule': ('lat', 'last'),
+                      'start_long_wmata_schedule': ('long', 'first'),
+                      'end_long_wmata_schedule': ('long', 'last')}
+        )
+        .rename(columns = {'first_stop_dist_nearest_point':'dist_first_stop_wmata_schedule', 
+                           'trip_length':'trip_dist_mi_direct_wmata_schedule',
+                           'route_text':'route_text_wmata_schedule', 
+                           'pattern_name':'pattern_name_wmata_schedule',
+                           'direction':'direction_wmata_schedule', 
+                           'pattern_destination':'pattern_destination_wmata_schedule',
+                           'direction_id':'direction_id_wmata_schedule'})
+        .filter(items=['run_id',
+                       'filename',
+                       'index_run_start',
+                       'start_odom_ft_wmata_schedule',
+                       'end_odom_ft_wmata_schedule',
+                       'run_dist_mi_odom_wmata_schedule',
+                       'start_sec_wmata_schedule',
+                       'end_sec_wmata_schedule',
+                       'run_dur_sec_wmata_schedule',
+                       'start_lat_wmata_schedule',
+                       'end_lat_wmata_schedule',
+                       'start_long_wmata_schedule',
+                       'end_long_wmata_schedule',
+                       'dist_first_stop_wmata_schedule',
+                       'trip_dist_mi_direct_wmata_schedule',
+                       'route_text_wmata_schedule',
+                       'pattern_name_wmata_schedule',
+                       'direction_wmata_schedule',
+                       'pattern_destination_wmata_schedule',
+                       'direction_id_wmata_schedule'])
+        .sort_values(['run_id'], kind='mergesort')
     )
         
     # Mutate columns and add original summary information
@@ -488,7 +672,9 @@ def include_wmata_schedule_based_summary(rawnav_q_dat, rawnav_sum_dat, nearest_s
                 x.run_dur_sec_wmata_schedule, 
                 2)
         )
-        .merge(rawnav_sum_dat, on=['filename', 'index_run_start'], how='left')
+        .merge(ll.add_run_id(rawnav_sum_dat).drop(columns=['filename', 'index_run_start']), 
+               on=['run_id'], 
+               how='left')
     )
 
     return rawnav_q_stop_sum_dat
@@ -509,11 +695,13 @@ def get_first_last_stop_rawnav(nearest_rawnav_stop_dat):
     first_last_stop_dat: pd.DataFrame
         first and last stop information for a trip.
     '''
+    nearest_rawnav_stop_dat = ll.add_run_id(nearest_rawnav_stop_dat)
+    
     last_stop_dat = nearest_rawnav_stop_dat.copy()
     
     last_stop_dat.loc[:, "tempCol"] = (
         last_stop_dat
-        .groupby(['filename', 'index_run_start'])
+        .groupby(['run_id'])
         .index_loc
         .transform(max)
     )
@@ -522,7 +710,7 @@ def get_first_last_stop_rawnav(nearest_rawnav_stop_dat):
         last_stop_dat
         .query('index_loc==tempCol')
         .reset_index(drop=True)
-        .filter(items=['filename', 'index_run_start', 'index_loc', 'dist_to_nearest_point'])
+        .filter(items=['run_id', 'index_loc', 'dist_to_nearest_point'])
         .rename(columns={'index_loc': 'index_loc_last_stop',
                          'dist_to_nearest_point': 'last_stop_dist_nearest_point'})
     )
@@ -531,7 +719,7 @@ def get_first_last_stop_rawnav(nearest_rawnav_stop_dat):
     
     first_stop_dat.loc[:, "tempCol"] = ( 
         first_stop_dat
-        .groupby(['filename', 'index_run_start'])
+        .groupby(['run_id'])
         .index_loc
         .transform(min)
     )
@@ -546,17 +734,18 @@ def get_first_last_stop_rawnav(nearest_rawnav_stop_dat):
                      'dist_to_nearest_point': 'first_stop_dist_nearest_point'
             }
         )
-        .sort_values(['filename', 'index_run_start'])
+        .sort_values(['run_id'], kind='mergesort')
     )
     
     first_last_stop_dat = (
         first_stop_dat
         .merge(
             last_stop_dat, 
-            on=['filename', 'index_run_start'],
+            on=['run_id'],
             how='left'
         )
-        .drop(columns=['geometry', 'lat', 'long', 'pattern', 'route'])
+        # targets may have been given as x_ft and y_ft rather than geometry
+        .drop(columns=['geometry', 'x_ft', 'y_ft', 'lat', 'long', 'pattern', 'route'], errors='ignore')
     )
         
     return first_last_stop_dat
@@ -13,14 +13,23 @@ import pyarrow.parquet as pq
 def merge_rawnav_segment(rawnav_gdf_, 
                          rawnav_sum_dat_,
                          target_,
-                         patterns_by_seg_):
+                         patterns_by_seg_,
+                         match_method_="nearest",
+                         pattern_shape_dat_=None,
+                         max_ahead_ft_=300):
     """
     Parameters
     ----------
-    rawnav_gdf_: gpd.GeoDataFrame, rawnav data
+    rawnav_gdf_: pd.DataFrame or gpd.GeoDataFrame, rawnav data, see merge_rawnav_target
     rawnav_sum_dat_: pd.DataFrame, rawnav summary data
     target_:geopandas.geodataframe.GeoDataFrame, segments with geom for first last vertex
     patterns_by_seg_: pd.DataFrame, crosswalk of route and pattern to seg_name_id
+    match_method_: str, method used to match rawnav pings to the segment start and end, 
+        see merge_rawnav_target. With "pattern_dist", the segment ends and rawnav data are 
+        projected onto the route patterns with add_pattern_dist.
+    pattern_shape_dat_: pd.DataFrame, pattern polylines from make_pattern_shape, in the same
+        CRS as target_. Required with match_method_ "pattern_dist".
+    max_ahead_ft_: float, with match_method_ "pattern_dist", see add_pattern_dist.
     Returns
     -------
     summary_run_segment: pd.DataFrame
@@ -53,12 +62,37 @@ def merge_rawnav_segment(rawnav_gdf_,
     
     # Prepare segment shape for merge    
     seg_pattern_first_last = ll.explode_first_last(seg_pattern_shape)
+    
+    if match_method_ == "pattern_dist":
+        assert(pattern_shape_dat_ is not None), \
+            print("Need pattern_shape_dat_ from make_pattern_shape for method 'pattern_dist'")
+        # Project the segment end no earlier along the pattern than the start, so that 
+        # segments on loop and out-and-back patterns are placed on the right pass
+        seg_pattern_first_last = (
+            ws.add_pattern_dist(
+                seg_pattern_first_last.assign(location_order = lambda x: x.location.map({'first': 0, 'last': 1})),
+                pattern_shape_dat_,
+                order_cols = ['location_order'],
+                run_cols = ['seg_name_id'])
+            .drop(columns = ['location_order'])
+        )
+        rawnav_gdf_match = (
+            ws.add_pattern_dist(
+                rawnav_gdf_,
+                pattern_shape_dat_,
+                order_cols = ['filename', 'index_run_start', 'index_loc'],
+                run_cols = ['filename', 'index_run_start'],
+                max_ahead_ft = max_ahead_ft_)
+        )
+    else:
+        rawnav_gdf_match = rawnav_gdf_
            
     # Find rawnav point nearest each segment
     index_run_segment_start_end_1 = (
         ws.merge_rawnav_target(
             target_dat = seg_pattern_first_last,
-            rawnav_dat = rawnav_gdf_
+            rawnav_dat = rawnav_gdf_match,
+            method = match_method_
         )
     )
      
@@ -80,7 +114,7 @@ def merge_rawnav_segment(rawnav_gdf_,
         .assign(
             flag_wrong_order = lambda x: 
                 x
-                .groupby(['filename','index_run_start'], sort = False)
+                .groupby(['run_id'], sort = False)
                 .index_loc
                 .diff()
                 .fillna(0)
@@ -122,87 +156,52 @@ def include_segment_summary(rawnav_q_dat,
         run summary data with additional information from segment data
     Notes
     -----
-    This function is largely copied and slimmed down from the schedule merge
-    implementation. Making this function more flexible to accommodate both cases would be a significant
-    investment given the variety of columns and aggregations that need to be applied in each case.     
+    Rawnav pings between the segment boundaries are summarized with ll.summarize_run_windows,
+    as in the schedule merge.
     """
-    seg_boundary_dat = ws.get_first_last_stop_rawnav(nearest_seg_boundary_dat)
-    rawnav_q_target_dat = (
-        rawnav_q_dat
-        .merge(seg_boundary_dat
-               .drop(['odom_ft','sec_past_st'], axis = 1),
-               on=['filename', 'index_run_start'], 
-               how='right'
-        )
+    # A tie for the first or last boundary gives more than one row for a run and segment
+    seg_boundary_dat = (
+        ws.get_first_last_stop_rawnav(nearest_seg_boundary_dat)
+        .drop_duplicates(subset=['run_id', 'seg_name_id'])
     )
     
-    rawnav_q_target_dat = (
-        rawnav_q_target_dat
-        .query('index_loc>=index_loc_first_stop & index_loc<=index_loc_last_stop')
-    )
-
-    rawnav_q_target_dat = (
-        rawnav_q_target_dat
-        .filter(
-            items = 
-                ['filename',
-                 'index_run_start', 
-                 'seg_name_id', 
-                 'index_loc',
-                 'lat', 
-                 'long', 
-                 'heading', 
-                 'odom_ft', 
-                 'sec_past_st', 
-                 'first_stop_dist_nearest_point'
-                ]
-        )
-    )
-    
-    # We'll add some additional calcs to check on the odometer values within the segment
-    rawnav_q_target_dat[['odom_ft_next','sec_past_st_next']] = (
-        rawnav_q_target_dat
-        .groupby(['filename','index_run_start','seg_name_id'], sort = False)[['odom_ft','sec_past_st']]
-        .shift(-1)
-    )
-        
-    rawnav_q_target_dat = (
-        rawnav_q_target_dat
-        .assign(
-            secs_marg=lambda x: x.sec_past_st_next - x.sec_past_st,
-            odom_ft_marg=lambda x: x.odom_ft_next - x.odom_ft
-        )
-    )
-    
-    Map1 = lambda x: max(x) - min(x)
     rawnav_q_segment_summary = (
-        rawnav_q_target_dat
-        .groupby(['filename', 'index_run_start', 'seg_name_id'])
-        .agg(
-            {'odom_ft': ['min', 'max', Map1, 'sum'],
-             'sec_past_st': ['min', 'max', Map1, 'sum'],
-             'lat': ['first', 'last'],
-             'long': ['first', 'last'],
-             'first_stop_dist_nearest_point': ['first'],
-             'index_loc' : ['first','last']}
+        ll.summarize_run_windows(
+            rawnav_dat=ll.add_run_id(rawnav_q_dat),
+            window_dat=seg_boundary_dat,
+            agg_dict={'start_odom_ft_segment': ('odom_ft', 'min'),
+                      'end_odom_ft_segment': ('odom_ft', 'max'),
+                      'trip_dist_ft_segment': ('odom_ft', 'range'),
+                      'start_sec_segment': ('sec_past_st', 'min'),
+                      'end_sec_segment': ('sec_past_st', 'max'),
+                      'trip_dur_sec_segment': ('sec_past_st', 'range'),
+                      'start_lat_segment': ('lat', 'first'),
+                      'end_lat_segment': ('lat', 'last'),
+                      'start_long_segment': ('long', 'first'),
+                      'end_long_segment': ('long', 'last'),
+                      'start_index_loc_segment': ('index_loc', 'first'),
+                      'end_index_loc_segment': ('index_loc', 'last')}
         )
+        .rename(columns={'first_stop_dist_nearest_point': 'dist_first_stop_segment'})
+        .filter(items=['run_id',
+                       'seg_name_id',
+                       'filename',
+                       'index_run_start',
+                       'start_odom_ft_segment', 
+                       'end_odom_ft_segment',
+                       'trip_dist_ft_segment', 
+                       'start_sec_segment',
+                       'end_sec_segment', 
+                       'trip_dur_sec_segment',
+                       'start_lat_segment', 
+                       'end_lat_segment',
+                       'start_long_segment', 
+                       'end_long_segment',
+                       'dist_first_stop_segment',
+                       'start_index_loc_segment',
+                       'end_index_loc_segment'])
+        .sort_values(['run_id', 'seg_name_id'], kind='mergesort')
     )
-
-    rawnav_q_segment_summary.columns = ['start_odom_ft_segment', 
-                                     'end_odom_ft_segment',
-                                     'trip_dist_ft_segment', 
-                                     'odom_ft_marg_sum',
-                                     'start_sec_segment',
-                                     'end_sec_segment', 
-                                     'trip_dur_sec_segment',
-                                     'secs_marg_sum',
-                                     'start_lat_segment', 
-                                     'end_lat_segment',
-                                     'start_long_segment', 
-                                     'end_long_segment',
-                                     'dist_first_stop_segment',
-                                     'start_index_loc_segment',
-                                     'end_index_loc_segment'] 
     
     rawnav_q_segment_summary = (
         rawnav_q_segment_summary
@@ -215,7 +214,7 @@ def include_segment_summary(rawnav_q_dat,
             trip_dist_mi_odom_and_segment = lambda x: round(x.trip_dist_mi_odom_and_segment, 2),
             dist_first_stop_segment = lambda x: round(x.dist_first_stop_segment, 2)
         )
-        .reset_index()
+        .reset_index(drop=True)
     )
     
     # Add flags at summary level
@@ -239,8 +238,6 @@ def include_segment_summary(rawnav_q_dat,
         )
         .drop(
             columns = [
-                'secs_marg_sum',
-                'odom_ft_marg_sum',
                 'secs_total_mismatch',
                 'odom_total_mismatch',
                 'trip_dist_ft_segment'
@@ -249,8 +246,8 @@ def include_segment_summary(rawnav_q_dat,
     )
     # Summarize index-level flags
     flags = (
-        nearest_seg_boundary_dat
-        .groupby(['filename','index_run_start'])
+        ll.add_run_id(nearest_seg_boundary_dat)
+        .groupby(['run_id'])
         .agg({'flag_too_far':['any'],
               'flag_wrong_order':['any']})
         .pipe(ll.reset_col_names)
@@ -260,13 +257,14 @@ def include_segment_summary(rawnav_q_dat,
     rawnav_q_segment_summary = (
         rawnav_q_segment_summary
         .merge(
-            rawnav_sum_dat, # we start with the original summary to not silently drop runs
-            on=['filename', 'index_run_start'], 
+            # we start with the original summary to not silently drop runs
+            ll.add_run_id(rawnav_sum_dat).drop(columns=['filename', 'index_run_start']), 
+            on=['run_id'], 
             how='left'
         )
         .merge(
             flags,
-            on=['filename', 'index_run_start'], 
+            on=['run_id'], 
             how='left'
         )
         .pipe(
@@ -5,33 +5,40 @@ Created on Thu Mar 26 10:09:45 2020
 Purpose: Functions for processing rawnav data
 """
 
-import zipfile, re, numpy as np, pandas as pd, io, os, shutil, glob
-import pandasql as ps
+import zipfile, re, numpy as np, pandas as pd, io, os, shutil, glob, hashlib, fnmatch, time
 from zipfile import BadZipfile
-import geopandas as gpd
-from shapely.geometry import Point
 from pandas.io.parsers import ParserError
+from concurrent.futures import ProcessPoolExecutor
+from functools import partial
+from contextlib import contextmanager
+from . import low_level_fns as ll
+from . import rawnav_read_write as rw
+import pyarrow as pa
+import pyarrow.parquet as pq
 
 # FIXME : Change all functions below to snake_case---refactor code
 # Parent Functions
 ########################################################################################################################
 
-def get_zipped_files_from_zip_dir(zip_dir_list, zipped_files_dir_parent, glob_search="*.zip"):
+def get_zipped_files_from_zip_dir(zip_dir_list, zipped_files_dir_parent=None, glob_search="*.zip", extract=False):
     '''
-    Get the list of files to read from Zipped folder. Also Unzip the parent folder.
-    Will Unzip only once. Can also pass a list of paths to unzipped folders
+    Get the list of files to read from Zipped folder. By default, files are listed inside the 
+    parent zipped folder without unzipping it. Can also pass a list of paths to unzipped folders
     to achieve the same result.
     Parameters
     ----------
     zip_dir_list : List or str,
         List of zipped directories with Rawnav data
         or a single zipped directory with Rawnav data.
-    zipped_files_dir_parent: str
-        Parent folder where list of zipped directories with Rawnav data is kept.
-        List of zipped directories with Rawnav data would be unzipped to this parent folder.
+    zipped_files_dir_parent: str, optional
+        Parent folder where list of zipped directories with Rawnav data is kept. Only used if
+        extract is True, in which case the zipped directories are unzipped to this parent folder.
     glob_search: str
         Default value of "*.zip" will search for all .zip files. Can specify a pariticular file
         name pattern for debugging. 
+    extract: bool, optional
+        If True, unzip each zipped directory once and search the unzipped folder, as in earlier
+        versions. The default is False.
     Raises
     ------
     IOError
@@ -39,7 +46,15 @@ def get_zipped_files_from_zip_dir(zip_dir_list, zipped_files_dir_parent, glob_se
         handle tuples.
     Returns
     -------
-    List of Trip files (zipped) that need to be read.
+    List of Trip files (zipped) that need to be read. Files inside a zipped directory are returned
+    as the path to the zipped directory followed by the path within it, 
+    ala 'Vehicles 0-2999.zip/Vehicles 0-2999/rawnav00001191007.txt.zip'. These paths can be passed
+    to find_rawnav_routes and load_rawnav_data like any other path.
+    Notes
+    -----
+    Files are matched at any depth within the zipped directory, so both the October 2019 
+    (Vehicles 0-2999.zip-->Vehicles 0-2999-->Rawnav Files) and July 2020 
+    (July 2020 Rawnav-->Vehicles-->Rawnav Files) folder structures are handled.
     '''
     if isinstance(zip_dir_list, list):
         'do nothing'
@@ -47,25 +62,28 @@ def get_zipped_files_from_zip_dir(zip_dir_list, zipped_files_dir_parent, glob_se
         zip_dir_list = [zip_dir_list]
     else:
         raise IOError("zip_dir_list should be a string or a List of directory")
+    assert((not extract) or (zipped_files_dir_parent is not None)), \
+        print("zipped_files_dir_parent must be provided to extract zipped directories")
     file_universe = []
     for ZipDir in zip_dir_list:
-        if not os.path.exists(ZipDir.split('.zip')[0]):
+        if os.path.isdir(ZipDir) or extract:
+            if not os.path.exists(ZipDir.split('.zip')[0]):
+                with zipfile.ZipFile(ZipDir, 'r') as zip:
+                    zip.extractall(zipped_files_dir_parent)
+            zip_dir1 = ZipDir.split('.zip')[0]  # Will work even for Unzipped folders
+            list_files = glob.glob(os.path.join(zip_dir1, glob_search))
+        else:
             with zipfile.ZipFile(ZipDir, 'r') as zip:
-                zip.extractall(zipped_files_dir_parent)
-                #Fixme: causes issue with the July 7th data format. We need to define the folder/ file structure of
-                # the input. Maybe ask the user to unzip the files like Vehicles 0-2999.zip
-                # July 7th data is in the following format:
-                # #July 2020 Rawnav-->Vehicles-->Rawnav Files
-                # #October 2019 data is in the following format:
-                # #October 2019 Rawnav-->Vehicle0-2999.zip-->Vehicle0-2999-->Rawnav Files
-                # This code doesn't handle July 2020 Rawnav folder structure
-        zip_dir1 = ZipDir.split('.zip')[0]  # Will work even for Unzipped folders
-        list_files = glob.glob(os.path.join(zip_dir1, glob_search))
+                list_files = [
+                    os.path.join(ZipDir, *member.split('/'))
+                    for member in zip.namelist()
+                    if fnmatch.fnmatch(member.split('/')[-1], glob_search)
+                ]
         file_universe.extend(list_files)
     return file_universe
 
 
-def find_rawnav_routes(file_universe, nmax=None, quiet=True):
+def find_rawnav_routes(file_universe, nmax=None, quiet=True, n_workers=None, chunksize=None):
     '''   
     Parameters
     ----------
@@ -79,69 +97,323 @@ def find_rawnav_routes(file_universe, nmax=None, quiet=True):
         limit files to read to this number. If None, all zip files read.
     quiet : boolean, optional
         Whether to print status. The default is True.
+    n_workers : int, optional
+        Number of processes used to search files for tags. If None or 1, files are 
+        searched serially in the current process.
+    chunksize : int, optional
+        Number of files sent to a worker process at a time. If None, a chunksize giving 
+        each worker a few chunks is used. Ignored when files are searched serially.
 
     Returns
     -------
     ReturnDict.
+    Notes
+    -----
+    The inventory is the same whether files are searched serially or in parallel. On Windows,
+    scripts calling this function with n_workers > 1 outside of an interactive session should
+    do so under an `if __name__ == "__main__":` guard.
     '''
-    assert(len(file_universe)>0), print("No files present in file universe")
-    assert((nmax == None) or (nmax > 0)), print("nmax must be greater than 0 or None")
-    file_universe_set = file_universe[0:nmax]
-    # Setup dataframe for iteration
-    file_universe_df = pd.DataFrame({'fullpath': file_universe_set})
-
-    file_universe_df['filename'] = file_universe_df['fullpath'].str.extract('(rawnav\d+.txt)')
-    file_universe_df['file_busid'] = file_universe_df['fullpath'].str.extract('rawnav(\d{5})\S+.txt')
-    file_universe_df['file_id'] = file_universe_df['fullpath'].str.extract('rawnav(\d+).txt')
-    file_universe_df['file_busid'] = pd.to_numeric(file_universe_df['file_busid'])
+    file_universe_df = get_file_universe_df(file_universe, nmax)
     
     # Get Tags and Reformat
-    file_universe_df['taglist'] = [find_all_tags(path, quiet=quiet) for path in file_universe_df['fullpath']]
-    file_universe_df = file_universe_df.explode('taglist')
-    file_universe_df[['line_num', 'route_pattern', 'tag_busid', 'tag_date', 'tag_time', 'Unk1', 'mi_to_ft']] = \
-        file_universe_df['taglist'].str.split(',', expand=True)
-    file_universe_df[['route', 'pattern']] = \
-        file_universe_df['route_pattern'].str.extract('^(?:\s*)(?:(?!PO))(?:(?!PI))(?:(?!DH))(\S+)(\d{2})$')
+    file_universe_df['taglist'] = map_over_files(partial(find_all_tags, quiet=quiet), 
+                                                 file_universe_df['fullpath'],
+                                                 n_workers=n_workers,
+                                                 chunksize=chunksize)
     
-    # Convert Column Types and Create new ones
-    # Note that we leave some cols as text, as integer values don't support
-    # NAs in Pandas. Some of this conversion will occur later once 'empty' tags are removed
-    file_universe_df['tag_busid'] = pd.to_numeric(file_universe_df['tag_busid'])
-    file_universe_df['tag_datetime'] = file_universe_df['tag_date'] + ' ' + file_universe_df['tag_time']
-    file_universe_df['tag_datetime'] = pd.to_datetime(file_universe_df['tag_datetime'],
-                                                      infer_datetime_format=True, errors='coerce')
-    file_universe_df['tag_starthour'] = file_universe_df['tag_time'].str.extract('^(?:\s*)(\d{2}):')
-    file_universe_df['tag_starthour'] = pd.to_numeric(file_universe_df['tag_starthour'])
-    # Note that this will put some late Friday trips after 12AM into the "Saturday" bucket
-    #   should probably revisit at a later date to adjust trips before 4 AM to day before.
-    file_universe_df['tag_date'] = pd.to_datetime(file_universe_df['tag_date'], infer_datetime_format=True)
-    file_universe_df['wday'] = file_universe_df['tag_date'].dt.day_name()
-    file_universe_df['line_num_next'] =\
-        file_universe_df.groupby(['filename'], sort = False)['line_num'].shift(-1)
+    return format_rawnav_inventory(file_universe_df)
+
+
+def find_rawnav_routes_load_data(file_universe, analysis_routes, nmax=None, quiet=True,
+                                 n_workers=None, chunksize=None):
+    '''
+    Parameters
+    ----------
+    file_universe : list
+        Paths to zipped folders with rawnav text files, as in find_rawnav_routes.
+    analysis_routes : list or str
+        Routes of interest. Rawnav data is only retained for files with at least one tag 
+        on one of these routes.
+    nmax : int, optional
+        limit files to read to this number. If None, all zip files read.
+    quiet : boolean, optional
+        Whether to print status. The default is True.
+    n_workers : int, optional
+        Number of processes used to read files. If None or 1, files are read serially.
+    chunksize : int, optional
+        Number of files sent to a worker process at a time, see find_rawnav_routes.
+    Returns
+    -------
+    rawnav_inventory : pd.DataFrame
+        Same inventory as returned by find_rawnav_routes.
+    rawnav_data_dict : dict
+        Raw data for each file containing an analysis route, keyed by filename. Each entry
+        matches the output of load_rawnav_data with skiprows set to the first tag in the file.
+    Notes
+    -----
+    Single pass alternative to calling find_rawnav_routes and then load_rawnav_data on the 
+    same files: each zipped file is decompressed and read only once, with the tags and the 
+    rawnav data both taken from the same text.
+    '''
+    analysis_routes = ll.check_convert_list(analysis_routes)
+    file_universe_df = get_file_universe_df(file_universe, nmax)
     
-    #Reorder Cols
-    column_nm_map = ['fullpath', 
-                     'filename', 
-                     'file_id', 
-                     'file_busid', 
-                     'taglist',
-                     'line_num',
-                     'line_num_next',
-                     'route_pattern',
-                     'route', 
-                     'pattern', 
-                     'tag_busid', 
-                     'tag_date', 
-                     'tag_time', 
-                     'tag_datetime', 
-                     'tag_starthour',
-                     'wday',
-                     'Unk1',
-                     'mi_to_ft']
+    file_results = map_over_files(partial(find_tags_load_rawnav_data, 
+                                          analysis_routes=analysis_routes,
+                                          quiet=quiet),
+                                  file_universe_df['fullpath'],
+                                  n_workers=n_workers,
+                                  chunksize=chunksize)
     
-    file_universe_df = file_universe_df.reindex(columns = column_nm_map, copy = False)
+    file_universe_df['taglist'] = [tag_line_elements for tag_line_elements, raw_data in file_results]
+    rawnav_data_dict = {filename: raw_data 
+                        for filename, (tag_line_elements, raw_data) 
+                        in zip(file_universe_df['filename'], file_results)
+                        if raw_data is not None}
+    
+    rawnav_inventory = format_rawnav_inventory(file_universe_df)
+    
+    return rawnav_inventory, rawnav_data_dict
+
+
+def update_rawnav_inventory(file_universe, 
+                            path_inventory, 
+                            path_manifest=None,
+                            analysis_routes=None,
+                            nmax=None, 
+                            quiet=True, 
+                            n_workers=None, 
+                            chunksize=None):
+    '''
+    Parameters
+    ----------
+    file_universe : list
+        Paths to zipped folders with rawnav text files, as in find_rawnav_routes.
+    path_inventory : str
+        Path to the saved inventory, a parquet dataset partitioned by filename. Created if
+        it does not exist.
+    path_manifest : str, optional
+        Path to the manifest parquet file recording the path, size, modified time and md5 hash
+        of each file in the saved inventory. By default, saved next to path_inventory, ala
+        'rawnav_inventory_manifest.parquet'.
+    analysis_routes : list or str, optional
+        If provided, new or changed files are searched with find_rawnav_routes_load_data and 
+        their rawnav data is returned for files containing these routes.
+    nmax : int, optional
+        limit files to read to this number. If None, all zip files read.
+    quiet : boolean, optional
+        Whether to print status. The default is True.
+    n_workers, chunksize : int, optional
+        Passed on to find_rawnav_routes when searching new or changed files.
+    Returns
+    -------
+    rawnav_inventory : pd.DataFrame
+        Inventory of all files in file_universe, same columns as find_rawnav_routes.
+    rawnav_data_dict : dict
+        Raw data for new or changed files containing an analysis route, keyed by filename. Empty if 
+        analysis_routes is None. Data for unchanged files should be loaded with load_rawnav_data.
+    Notes
+    -----
+    Files whose size and modified time match the manifest are not read again; their tags are
+    taken from the saved inventory. If the size or modified time differ, the file's md5 hash is
+    checked against the manifest before searching the file again. Only partitions of new or changed
+    files are rewritten, and entries for files outside of file_universe are left as-is.
+    '''
+    rawnav_inventory_unchanged, rawnav_manifest = get_changed_rawnav_files(file_universe,
+                                                                           path_inventory,
+                                                                           path_manifest,
+                                                                           nmax)
+    changed_files = rawnav_manifest.loc[rawnav_manifest.changed, 'fullpath'].tolist()
+    if quiet != True:
+        print("{} new or changed files of {} files to search".format(len(changed_files), len(rawnav_manifest)))
+    
+    rawnav_data_dict = {}
+    rawnav_inventory_changed = None
+    if len(changed_files) > 0:
+        if analysis_routes is None:
+            rawnav_inventory_changed = find_rawnav_routes(changed_files, 
+                                                          quiet=quiet, 
+                                                          n_workers=n_workers,
+                                                          chunksize=chunksize)
+        else:
+            rawnav_inventory_changed, rawnav_data_dict = find_rawnav_routes_load_data(changed_files,
+                                                                                      analysis_routes=analysis_routes,
+                                                                                      quiet=quiet,
+                                                                                      n_workers=n_workers,
+                                                                                      chunksize=chunksize)
+    save_rawnav_inventory(rawnav_inventory_changed, rawnav_manifest, path_inventory, path_manifest)
+    
+    inventory_parts = [part for part in [rawnav_inventory_changed, rawnav_inventory_unchanged]
+                       if (part is not None) and (len(part) > 0)]
+    rawnav_inventory = sort_rawnav_inventory(pd.concat(inventory_parts, sort=False), 
+                                             rawnav_manifest.fullpath)
         
-    return file_universe_df
+    return rawnav_inventory, rawnav_data_dict
+
+
+def get_changed_rawnav_files(file_universe, path_inventory, path_manifest=None, nmax=None):
+    '''
+    Parameters
+    ----------
+    file_universe : list
+        Paths to zipped folders with rawnav text files, as in find_rawnav_routes.
+    path_inventory : str
+        Path to the saved inventory, see update_rawnav_inventory.
+    path_manifest : str, optional
+        Path to the manifest of the saved inventory, see update_rawnav_inventory.
+    nmax : int, optional
+        limit files to check to this number. If None, all zip files checked.
+    Returns
+    -------
+    rawnav_inventory_unchanged : pd.DataFrame
+        Saved inventory of the files in file_universe that are unchanged, in the order of 
+        file_universe. Empty if there is no saved inventory.
+    rawnav_manifest : pd.DataFrame
+        Manifest entries of the files in file_universe, in the same order, with column changed
+        marking new or changed files. These need to be searched for tags (e.g., with 
+        find_rawnav_routes) and saved with save_rawnav_inventory.
+    Notes
+    -----
+    Files whose size and modified time match the manifest are not read; their tags are taken
+    from the saved inventory. If the size or modified time differ, the file's md5 hash is 
+    checked against the manifest.
+    '''
+    if path_manifest is None:
+        path_manifest = get_inventory_manifest_path(path_inventory)
+        
+    file_universe_df = get_file_universe_df(file_universe, nmax)
+    manifest_new = get_file_manifest(file_universe_df)
+    
+    if os.path.isdir(path_inventory) and os.path.isfile(path_manifest):
+        manifest_old = pd.read_parquet(path_manifest)
+        rawnav_inventory_old = (
+            pd.read_parquet(path_inventory)
+            .assign(filename = lambda x: x.filename.astype(str)) #returned as categorical
+        )
+    else:
+        manifest_old = manifest_new.iloc[0:0]
+        rawnav_inventory_old = None
+            
+    manifest_check = (
+        manifest_new
+        .merge(manifest_old, 
+               on=['fullpath', 'filename'], 
+               how='left', 
+               suffixes=('', '_old'))
+    )
+    if rawnav_inventory_old is not None:
+        manifest_check = manifest_check.assign(
+            in_inventory = lambda x: x.filename.isin(rawnav_inventory_old.filename))
+    else:
+        manifest_check = manifest_check.assign(in_inventory = False)
+    
+    # Only hash files whose size or modified time changed
+    stat_match = (
+        manifest_check.in_inventory
+        & (manifest_check['size'] == manifest_check['size_old'])
+        & (manifest_check['mtime'] == manifest_check['mtime_old'])
+    )
+    stat_match = stat_match.to_numpy()
+    manifest_check.loc[stat_match, 'md5'] = manifest_check.loc[stat_match, 'md5_old']
+    manifest_check.loc[~stat_match, 'md5'] = \
+        map_by_outer_zip(hash_file, manifest_check.loc[~stat_match, 'fullpath'])
+    unchanged = manifest_check.in_inventory & (manifest_check.md5 == manifest_check.md5_old)
+    
+    rawnav_manifest = manifest_check[manifest_new.columns].assign(changed = ~unchanged.to_numpy())
+    
+    if rawnav_inventory_old is not None:
+        rawnav_inventory_unchanged = sort_rawnav_inventory(
+            rawnav_inventory_old[rawnav_inventory_old.fullpath.isin(manifest_check.fullpath[unchanged])],
+            rawnav_manifest.fullpath)
+    else:
+        rawnav_inventory_unchanged = rw.rawnav_inventory_schema().empty_table().to_pandas()
+    
+    return rawnav_inventory_unchanged, rawnav_manifest
+
+
+def save_rawnav_inventory(rawnav_inventory_changed, rawnav_manifest, path_inventory, path_manifest=None):
+    '''
+    Parameters
+    ----------
+    rawnav_inventory_changed : pd.DataFrame or None
+        Inventory of the new or changed files in rawnav_manifest, as from find_rawnav_routes.
+    rawnav_manifest : pd.DataFrame
+        Output of get_changed_rawnav_files.
+    path_inventory : str
+        Path to the saved inventory, see update_rawnav_inventory. Created if it does not exist.
+    path_manifest : str, optional
+        Path to the manifest of the saved inventory, see update_rawnav_inventory.
+    Returns
+    -------
+    None. Partitions of the files in rawnav_inventory_changed are replaced, and the manifest 
+    is updated for all files in rawnav_manifest. Entries for other files are left as-is.
+    '''
+    if path_manifest is None:
+        path_manifest = get_inventory_manifest_path(path_inventory)
+    os.makedirs(path_inventory, exist_ok=True)
+    
+    if (rawnav_inventory_changed is not None) and (len(rawnav_inventory_changed) > 0):
+        # Note: partitioning required, using filename avoids resorting of values, filename column
+        # will be sorted to end on reload however.
+        for filename in rawnav_inventory_changed.filename.unique():
+            shutil.rmtree(os.path.join(path_inventory, "filename={}".format(filename)), ignore_errors=True)
+        pq.write_to_dataset(
+            pa.Table.from_pandas(rawnav_inventory_changed, 
+                                 schema = rw.rawnav_inventory_schema(),
+                                 preserve_index = False),
+            root_path = path_inventory,
+            partition_cols = ['filename']
+        )
+    
+    # Update manifest, keeping any entries for files outside of rawnav_manifest
+    rawnav_manifest = rawnav_manifest.drop(columns=['changed'])
+    if os.path.isfile(path_manifest):
+        manifest_old = pd.read_parquet(path_manifest)
+        rawnav_manifest = pd.concat(
+            [manifest_old[~manifest_old.fullpath.isin(rawnav_manifest.fullpath)], rawnav_manifest],
+            ignore_index=True)
+    rawnav_manifest.to_parquet(path_manifest, index=False)
+
+
+def get_inventory_manifest_path(path_inventory):
+    '''
+    Parameters
+    ----------
+    path_inventory : str
+        Path to the saved inventory, see update_rawnav_inventory.
+    Returns
+    -------
+    str, default path of the inventory's manifest, ala 'rawnav_inventory_manifest.parquet'.
+    '''
+    return os.path.splitext(os.path.normpath(path_inventory))[0] + "_manifest.parquet"
+
+
+def sort_rawnav_inventory(rawnav_inventory, file_order):
+    '''
+    Parameters
+    ----------
+    rawnav_inventory : pd.DataFrame
+        Rawnav inventory, as from find_rawnav_routes or the saved inventory.
+    file_order : list-like
+        fullpath of each file in the order wanted.
+    Returns
+    -------
+    rawnav_inventory : pd.DataFrame
+        Inventory sorted by file in the order of file_order, then by line number, with columns
+        fullpath and filename first.
+    '''
+    file_order = pd.Series(np.arange(len(file_order)), index=list(file_order))
+    rawnav_inventory = (
+        rawnav_inventory
+        .assign(file_order = lambda x: x.fullpath.map(file_order),
+                line_order = lambda x: pd.to_numeric(x.line_num, errors='coerce'))
+        .sort_values(['file_order', 'line_order'], kind='mergesort')
+        .drop(columns=['file_order', 'line_order'])
+        # filename is moved to the end of the saved inventory on reload
+        .pipe(ll.reorder_first_cols, ['fullpath', 'filename'])
+        .reset_index(drop=True)
+    )
+    return rawnav_inventory
 
 
 def load_rawnav_data(zip_folder_path, skiprows):
@@ -160,12 +432,10 @@ def load_rawnav_data(zip_folder_path, skiprows):
     -------
     pd.DataFrame with the file info.
     '''
-    zf = zipfile.ZipFile(zip_folder_path)
-    # Get Filename
-    namepat = re.compile('(rawnav\d+\.txt)')
-    zip_file_name = namepat.search(zip_folder_path).group(1)
+    zip_file_name = re.search(r'(rawnav\d+\.txt)', zip_folder_path).group(1)
     try:
-        raw_data = pd.read_csv(zf.open(zip_file_name), skiprows=skiprows, header=None)
+        with open_rawnav_file(zip_folder_path) as input_file:
+            raw_data = pd.read_csv(input_file, skiprows=skiprows, header=None)
     except ParserError as parseerr:
         print("*" * 100)
         print("More number of ',' in a file {}. pandas has issue with tokenizing data. Error: {}".format(zip_file_name,parseerr))
@@ -174,13 +444,133 @@ def load_rawnav_data(zip_folder_path, skiprows):
     return raw_data
 
 
+def load_rawnav_data_lines(zip_folder_path, skiprows, line_ranges):
+    '''
+    Parameters
+    ----------
+    zip_folder_path: str
+        Path to zipped folder with rawnav text file, as in load_rawnav_data.
+    skiprows : int
+        Number of rows with metadata, as in load_rawnav_data. Rows are indexed as if the file were
+        read with load_rawnav_data using the same skiprows.
+    line_ranges : list of tuples
+        (first line, last line) of each span of the file to parse, with line numbers starting at 1 
+        as in the rawnav inventory. The last line is inclusive, and np.inf reads to the end of the
+        file. See get_rawnav_run_line_ranges.
+    Raises
+    ------
+    ParserError
+        More number of , in a file. pandas has issue with tokenizing data.   
+    Returns
+    -------
+    pd.DataFrame with the file info for lines in line_ranges. 
+    Notes
+    -----
+    Lines outside of line_ranges are skipped over as text and never parsed. Rows are indexed by 
+    line number less skiprows less 1, matching the new_line_no of tags in the inventory. This is 
+    the same index as load_rawnav_data, except in files with blank lines, which load_rawnav_data 
+    drops without counting. As in load_rawnav_data, the number of columns is set by the first 
+    line after skiprows.
+    '''
+    zip_file_name = re.search(r'(rawnav\d+\.txt)', zip_folder_path).group(1)
+    rawnav_bytes, line_bounds, is_selected, n_fields = read_rawnav_lines(zip_folder_path, 
+                                                                         skiprows, 
+                                                                         line_ranges)
+    if not is_selected.any():
+        return None
+    try:
+        raw_data = parse_rawnav_lines(join_rawnav_lines(rawnav_bytes, line_bounds, is_selected), 
+                                      np.flatnonzero(is_selected) - skiprows, 
+                                      n_fields)
+    except ParserError as parseerr:
+        print("*" * 100)
+        print("More number of ',' in a file {}. pandas has issue with tokenizing data. Error: {}".format(zip_file_name,parseerr))
+        print("*" * 100)
+        return None
+    return raw_data
+
+
+def load_rawnav_data_typed(zip_folder_path, skiprows, line_ranges=None, rawnav_bytes=None):
+    '''
+    Parameters
+    ----------
+    zip_folder_path: str
+        Path to zipped folder with rawnav text file, as in load_rawnav_data.
+    skiprows : int
+        Number of rows with metadata, as in load_rawnav_data.
+    line_ranges : list of tuples, optional
+        Spans of the file to parse, as in load_rawnav_data_lines. If None, the rest of the file 
+        after skiprows is parsed.
+    rawnav_bytes : bytes, optional
+        Contents of the rawnav text file, if already read (see find_tags_read_rawnav_bytes). 
+        By default, the file is read from zip_folder_path.
+    Returns
+    -------
+    raw_data : pd.DataFrame or None
+        Rows of the file with valid looking pings, with numeric columns as float64 and door state,
+        vehicle state, and stop window as categoricals. Indexed as in load_rawnav_data_lines.
+    event_data : pd.DataFrame or None
+        All other rows of the file (tags, APC and CAL labels, end of route messages), with all 
+        columns as strings. 
+    Notes
+    -----
+    Lines are classified up front, so that pings can be parsed with declared types rather than
+    as object columns mixed with tag lines. Both outputs can be passed to clean_rawnav_data as
+    RawData and EventData. If a ping can't be converted to the declared types, pings are parsed
+    with inferred types instead, as in load_rawnav_data. Both outputs are None if the file
+    can't be parsed.
+    '''
+    zip_file_name = re.search(r'(rawnav\d+\.txt)', zip_folder_path).group(1)
+    if line_ranges is None:
+        line_ranges = [(skiprows + 1, np.inf)]
+    rawnav_bytes, line_bounds, is_selected, n_fields = read_rawnav_lines(zip_folder_path, 
+                                                                         skiprows, 
+                                                                         line_ranges,
+                                                                         rawnav_bytes)
+    if not is_selected.any():
+        return None, None
+    
+    # lat, long, heading, door state, vehicle state. Lines that don't match aren't valid pings 
+    # (see check_valid_data_entries) and are few, so are found instead
+    numpat = rb'[ \t]*-?\d+(?:\.\d*)?[ \t]*'
+    eventpat = rb'(?!' + numpat + b',' + numpat + b',' + numpat + rb',[OC],[MS](?:,|[ \t\r]*$))'
+    is_event = np.zeros(len(line_bounds), dtype=bool)
+    is_event[find_matching_lines(rawnav_bytes, line_bounds, eventpat)] = True
+    is_ping = is_selected & ~is_event
+    is_event = is_selected & is_event
+    
+    try:
+        event_data = parse_rawnav_lines(join_rawnav_lines(rawnav_bytes, line_bounds, is_event), 
+                                        np.flatnonzero(is_event) - skiprows, 
+                                        n_fields, 
+                                        dtype=str)
+        ping_lines = join_rawnav_lines(rawnav_bytes, line_bounds, is_ping)
+        rawnav_bytes = None
+        try:
+            raw_data = parse_rawnav_lines(ping_lines, 
+                                          np.flatnonzero(is_ping) - skiprows, 
+                                          n_fields, 
+                                          dtype=rawnav_ping_dtypes())
+        except ParserError:
+            raise
+        except ValueError:
+            raw_data = parse_rawnav_lines(ping_lines, np.flatnonzero(is_ping) - skiprows, n_fields)
+    except ParserError as parseerr:
+        print("*" * 100)
+        print("More number of ',' in a file {}. pandas has issue with tokenizing data. Error: {}".format(zip_file_name,parseerr))
+        print("*" * 100)
+        return None, None
+    return raw_data, event_data
+
+
 def clean_rawnav_data(data_dict, filename):
     '''
     Parameters
     ----------
     filename: rawnav file name
     data_dict : dict
-        dict of raw data and the data on tag lines.
+        dict of raw data and the data on tag lines. If raw data was loaded with 
+        load_rawnav_data_typed, the rows other than pings are included as EventData.
     Returns
     -------
     Cleaned data without any tags.
@@ -188,6 +578,10 @@ def clean_rawnav_data(data_dict, filename):
     
     rawnavdata = data_dict['RawData']
     tagline_data = data_dict['tagLineInfo']
+    # Tags, APC and CAL labels, and end of route messages are found in the raw data unless
+    # loaded separately
+    events_separate = data_dict.get('EventData') is not None
+    event_data = data_dict['EventData'] if events_separate else rawnavdata
 
     # Check the location of taglines from tagline_data data match the locations in rawnavdata
     try:
@@ -196,35 +590,49 @@ def clean_rawnav_data(data_dict, filename):
         # Essentially, we reconstitute the tags in the file from the separated columns in rawnavdata and 
         #   make sure that they all match the separate tag data that came from the rawnav_inventory
         if (len(tag_indices)) != 0:
-            check_tag_line_data = rawnavdata.loc[tag_indices, :]
+            check_tag_line_data = event_data.loc[tag_indices, :]
             check_tag_line_data[[1, 4, 5]] = check_tag_line_data[[1, 4, 5]].astype(int)
             check_tag_line_data.loc[:, 'taglist'] = \
                 (check_tag_line_data[[0, 1, 2, 3, 4, 5]].astype(str) + ',').sum(axis=1).str.rsplit(",", 1, expand=True)[
                     0]
             check_tag_line_data.loc[:, 'taglist'] = check_tag_line_data.loc[:, 'taglist'].str.strip()
-            infopat = '^\s*(\S+),(\d{1,5}),(\d{2}\/\d{2}\/\d{2}),(\d{2}:\d{2}:\d{2}),(\S+),(\S+)'
+            infopat = r'^\s*(\S+),(\d{1,5}),(\d{2}\/\d{2}\/\d{2}),(\d{2}:\d{2}:\d{2}),(\S+),(\S+)'
             assert ((~check_tag_line_data.taglist.str.match(infopat, re.S)).sum() == 0)
     except:
         print("TagLists Did not match in file {}".format(filename))
     
-    rawnavdata.reset_index(inplace=True);
+    # Index is kept rather than reset, so that it continues to match index_loc when only some 
+    # lines of the file are loaded (see load_rawnav_data_lines)
+    rawnavdata.insert(0, 'index', rawnavdata.index.to_numpy());
     # TODO: This line prevents the function from being rerun, need to address later.
     #   odd, given local scoping of functions 
     # IS okay on a first run though
     rawnavdata.rename(columns={"index": "index_loc"}, inplace=True)
+    if events_separate:
+        event_data.insert(0, 'index_loc', event_data.index.to_numpy())
     
     # Get End of route Info
-    tagline_data, delete_indices1 = add_end_route_info(rawnavdata, tagline_data)
+    tagline_data, delete_indices1 = add_end_route_info(event_data, 
+                                                       tagline_data, 
+                                                       last_index_loc=np.fmax(rawnavdata.index_loc.max(), 
+                                                                              event_data.index_loc.max()))
     rawnavdata = rawnavdata[~rawnavdata.index.isin(np.append(tag_indices, delete_indices1))]
+    # Tags only loaded to mark where the preceding run ends (see get_rawnav_run_line_ranges) 
+    # are dropped once end of route info is found
+    if 'run_loaded' in tagline_data.columns:
+        tagline_data = tagline_data[tagline_data.run_loaded].drop(columns=['run_loaded'])
    
     # Remove APC and CAL labels and keep APC locations. 
-    rawnavdata, apc_tag_loc = remove_apc_cal_tags(rawnavdata)
-    rawnavdata = rawnavdata[rawnavdata.apply(check_valid_data_entry, axis=1)]
+    if events_separate:
+        _, apc_tag_loc = remove_apc_cal_tags(event_data)
+    else:
+        rawnavdata, apc_tag_loc = remove_apc_cal_tags(rawnavdata)
+    rawnavdata = rawnavdata[check_valid_data_entries(rawnavdata)]
     apc_loc_dat = pd.Series(apc_tag_loc, name='apc_tag_loc')
     apc_loc_dat = \
         pd.merge_asof(apc_loc_dat, rawnavdata[["index_loc"]], left_on="apc_tag_loc", right_on="index_loc")
     rawnavdata.loc[:, 'row_before_apc'] = False
-    rawnavdata.loc[apc_loc_dat.index_loc, 'row_before_apc'] = True
+    rawnavdata.loc[apc_loc_dat.index_loc.dropna(), 'row_before_apc'] = True
     tagline_data.rename(columns={'new_line_no': "index_run_start_original"}, inplace=True)
     
     # Get trip summary
@@ -248,6 +656,10 @@ def clean_rawnav_data(data_dict, filename):
     rawnavdata = rawnavdata.assign(lat=lambda x: x.lat.astype('float'),
                                    long=lambda x: x.long.astype('float'),
                                    heading=lambda x: x.heading.astype('float'))
+    # Project all pings at once here so that merges downstream can use x_ft and y_ft (EPSG 2248)
+    # rather than building and reprojecting point geometry on each run
+    x_ft, y_ft = ll.get_projected_xy(rawnavdata.lat, rawnavdata.long)
+    rawnavdata = rawnavdata.assign(x_ft=x_ft, y_ft=y_ft)
     #TODO: divider came out wrong here
     # Add composite key to the data
     rawnavdata = add_run_dividers(rawnavdata, summary_data)
@@ -258,6 +670,191 @@ def clean_rawnav_data(data_dict, filename):
     return return_dict
 
 
+def parse_rawnav_to_parquet(rawnav_inventory_filtered, 
+                            analysis_routes, 
+                            path_rawnav_data, 
+                            path_summary_rawnav, 
+                            buffer_rows=2000000, 
+                            row_group_rows=250000,
+                            overwrite=False,
+                            quiet=True,
+                            rawnav_manifest=None,
+                            path_inventory=None,
+                            path_manifest=None):
+    '''
+    Load, clean, and write rawnav data to parquet one file at a time.
+    Parameters
+    ----------
+    rawnav_inventory_filtered : pd.DataFrame
+        Rawnav inventory for files including at least one of the analysis routes. All tags in 
+        each file should be included, as in the output of find_rawnav_routes.
+    analysis_routes : list or str
+        Routes to load and write.
+    path_rawnav_data : str
+        Path to the rawnav data parquet dataset, partitioned by route and wday. Data is 
+        appended to any existing partitions.
+    path_summary_rawnav : str
+        Path to the rawnav summary parquet dataset, partitioned by route and wday. Data is 
+        appended to any existing partitions.
+    buffer_rows : int, optional
+        Number of rows of cleaned rawnav data held in memory before they are written. The 
+        default is 2000000.
+    row_group_rows : int, optional
+        Target number of rows per parquet row group in the rawnav data, see 
+        rawnav_read_write.write_rawnav_data. The default is 250000.
+    overwrite : boolean, optional
+        Whether data written replaces all existing data for analysis_routes, rather than being 
+        appended to it. The old data is only removed once every file is parsed, see 
+        rawnav_read_write.replace_route_generations. The default is False.
+    quiet : boolean, optional
+        Whether to print status. The default is True.
+    rawnav_manifest : pd.DataFrame, optional
+        Output of get_changed_rawnav_files. If provided, new or changed files are searched for 
+        tags as they are parsed, and their inventory is saved to path_inventory (see 
+        save_rawnav_inventory) once all files are parsed. Rows of rawnav_inventory_filtered for
+        these files are ignored.
+    path_inventory, path_manifest : str, optional
+        Paths to the saved inventory and its manifest, see update_rawnav_inventory. Required 
+        with rawnav_manifest.
+    Returns
+    -------
+    rawnav_inventory_filtered_valid : pd.DataFrame
+        rawnav_inventory_filtered, and the inventory of new or changed files with analysis 
+        routes, less files that could not be loaded.
+    Notes
+    -----
+    Only one file is read at a time, and cleaned data is written out and released once 
+    buffer_rows is reached, so that peak memory use does not depend on the number of files.
+    New or changed files are decompressed once, with tags and data taken from the same 
+    contents, rather than searched for tags up front and read again to parse.
+    All buffers are written as one generation of each dataset's partition manifest, as each 
+    rawnav file is only parsed once, so reads need not look for duplicate runs unless data is 
+    appended to partitions written before.
+    '''
+    analysis_routes = ll.check_convert_list(analysis_routes)
+    if rawnav_manifest is not None:
+        assert (path_inventory is not None), print("path_inventory is needed with rawnav_manifest")
+        changed_files = rawnav_manifest.loc[rawnav_manifest.changed, 'fullpath'].tolist()
+        rawnav_inventory_filtered = (
+            rawnav_inventory_filtered[~rawnav_inventory_filtered.fullpath.isin(changed_files)]
+        )
+    else:
+        changed_files = []
+    rawnav_inventory_filtered = (
+        rawnav_inventory_filtered
+        .assign(line_num = lambda x: x.line_num.astype('int'))
+    )
+    rawnav_inventory_changed = []
+    rawnav_inventory_changed_filtered = []
+    invalid_files = []
+    data_buffer = []
+    summary_buffer = []
+    buffer_len = 0
+    generations = (rw.get_next_generation(path_rawnav_data), 
+                   rw.get_next_generation(path_summary_rawnav))
+    
+    for tag_info_line_no, rawnav_bytes, is_changed in iter_rawnav_file_tags(rawnav_inventory_filtered, 
+                                                                         changed_files,
+                                                                         quiet):
+        filename = tag_info_line_no.filename.iloc[0]
+        if is_changed:
+            rawnav_inventory_changed.append(tag_info_line_no)
+            if (rawnav_bytes is None) or (not tag_info_line_no.route.isin(analysis_routes).any()):
+                continue
+            tag_info_line_no = tag_info_line_no.assign(line_num = lambda x: x.line_num.astype('int'))
+            rawnav_inventory_changed_filtered.append(tag_info_line_no)
+        reference = tag_info_line_no.line_num.min()
+        # See load_rawnav_data_lines on the -1
+        tag_info_line_no = tag_info_line_no.assign(new_line_no = lambda x: x.line_num - reference - 1)
+        line_ranges, tag_info_line_no = get_rawnav_run_line_ranges(tag_info_line_no, analysis_routes)
+        if len(line_ranges) == 0:
+            continue
+        if quiet != True:
+            print("Parsing: " + filename)
+        raw_data, event_data = load_rawnav_data_typed(zip_folder_path=tag_info_line_no.fullpath.iloc[0],
+                                                      skiprows=reference,
+                                                      line_ranges=line_ranges,
+                                                      rawnav_bytes=rawnav_bytes)
+        rawnav_bytes = None
+        if raw_data is None:
+            invalid_files.append(filename)
+            continue
+        
+        cleaned_data = clean_rawnav_data({'RawData': raw_data, 
+                                          'EventData': event_data,
+                                          'tagLineInfo': tag_info_line_no}, 
+                                         filename)
+        rawnav_data, summary_data = format_rawnav_output(cleaned_data['rawnavdata'], 
+                                                         cleaned_data['summary_data'], 
+                                                         analysis_routes)
+        raw_data = event_data = cleaned_data = None
+        data_buffer.append(rawnav_data)
+        summary_buffer.append(summary_data)
+        buffer_len = buffer_len + len(rawnav_data)
+        
+        if buffer_len >= buffer_rows:
+            write_rawnav_buffer(data_buffer, summary_buffer, path_rawnav_data, path_summary_rawnav,
+                                row_group_rows, generations)
+            data_buffer = []
+            summary_buffer = []
+            buffer_len = 0
+            
+    write_rawnav_buffer(data_buffer, summary_buffer, path_rawnav_data, path_summary_rawnav,
+                        row_group_rows, generations)
+    
+    if overwrite:
+        rw.replace_route_generations(path_rawnav_data, analysis_routes, generations[0])
+        rw.replace_route_generations(path_summary_rawnav, analysis_routes, generations[1])
+    
+    if rawnav_manifest is not None:
+        save_rawnav_inventory(pd.concat(rawnav_inventory_changed, sort=False) 
+                              if len(rawnav_inventory_changed) > 0 else None, 
+                              rawnav_manifest, 
+                              path_inventory, 
+                              path_manifest)
+        rawnav_inventory_filtered = pd.concat(
+            [rawnav_inventory_filtered] + rawnav_inventory_changed_filtered, sort=False)
+    
+    rawnav_inventory_filtered_valid = (
+        rawnav_inventory_filtered[~rawnav_inventory_filtered.filename.isin(invalid_files)]
+    )
+    return rawnav_inventory_filtered_valid
+
+
+def iter_rawnav_file_tags(rawnav_inventory_filtered, changed_files=None, quiet=True):
+    '''
+    Parameters
+    ----------
+    rawnav_inventory_filtered : pd.DataFrame
+        Rawnav inventory of files already searched for tags.
+    changed_files : list, optional
+        Paths to zipped rawnav files not yet searched for tags.
+    quiet : boolean, optional
+        Whether to print status. The default is True.
+    Yields
+    ------
+    tag_info_line_no : pd.DataFrame
+        Inventory of one file, as in rawnav_inventory_filtered. Files in 
+        rawnav_inventory_filtered come first, then changed_files.
+    rawnav_bytes : bytes or None
+        Contents of a changed file, read to search for tags and kept so that the file need not
+        be read again to parse (see load_rawnav_data_typed). None for other files, or if the 
+        changed file can't be opened.
+    is_changed : bool
+        Whether the file is one of changed_files.
+    '''
+    for _, tag_info_line_no in rawnav_inventory_filtered.groupby('filename', sort=False):
+        yield tag_info_line_no, None, False
+    
+    if changed_files is None:
+        return
+    for zip_folder_path in changed_files:
+        tag_line_elements, rawnav_bytes = find_tags_read_rawnav_bytes(zip_folder_path, quiet)
+        file_universe_df = get_file_universe_df([zip_folder_path])
+        file_universe_df['taglist'] = [tag_line_elements]
+        yield format_rawnav_inventory(file_universe_df), rawnav_bytes, True
+
+
 def subset_rawnav_run(rawnav_data_dict_, rawnav_inventory_filtered_valid_, analysis_routes_):
     '''
     Subset data for analysis routes
@@ -291,6 +888,578 @@ def subset_rawnav_run(rawnav_data_dict_, rawnav_inventory_filtered_valid_, analy
 # Nested Functions
 ########################################################################################################################
 
+def read_rawnav_lines(zip_folder_path, skiprows, line_ranges, rawnav_bytes=None):
+    '''
+    Parameters
+    ----------
+    zip_folder_path: str
+        Path to zipped folder with rawnav text file.
+    skiprows : int
+        Number of rows with metadata.
+    line_ranges : list of tuples
+        (first line, last line) spans of the file to keep, see load_rawnav_data_lines.
+    rawnav_bytes : bytes, optional
+        Contents of the rawnav text file, if already read. By default, the file is read from 
+        zip_folder_path.
+    Returns
+    -------
+    rawnav_bytes : bytes
+        Contents of the rawnav text file.
+    line_bounds : np.array
+        Start and end byte offset of each line, not including the newline.
+    is_selected : np.array
+        True for non-blank lines within line_ranges.
+    n_fields : int
+        Number of fields in the first non-blank line after skiprows, None if there is no such line.
+    Notes
+    -----
+    Lines are found with numpy and regular expressions over the whole file rather than line by
+    line, see find_matching_lines.
+    '''
+    if rawnav_bytes is None:
+        with open_rawnav_file(zip_folder_path) as input_file:
+            rawnav_bytes = input_file.read()
+    newline_pos = np.flatnonzero(np.frombuffer(rawnav_bytes, dtype=np.uint8) == ord('\n'))
+    line_bounds = np.column_stack([np.append(0, newline_pos + 1), 
+                                   np.append(newline_pos, len(rawnav_bytes))])
+    n_lines = len(line_bounds)
+    
+    is_blank = np.zeros(n_lines, dtype=bool)
+    is_blank[find_matching_lines(rawnav_bytes, line_bounds, rb'[ \t\r\x0b\x0c]*$')] = True
+    is_selected = np.zeros(n_lines, dtype=bool)
+    for first_line, last_line in line_ranges:
+        last_line = n_lines if np.isinf(last_line) else int(min(last_line, n_lines))
+        is_selected[int(first_line) - 1:last_line] = True
+    is_selected[:skiprows] = False
+    is_selected = is_selected & ~is_blank
+    
+    first_line_pos = np.flatnonzero(~is_blank[skiprows:])
+    if len(first_line_pos) == 0:
+        n_fields = None
+    else:
+        first_start, first_end = line_bounds[skiprows + first_line_pos[0]]
+        n_fields = rawnav_bytes[first_start:first_end].count(b',') + 1
+    return rawnav_bytes, line_bounds, is_selected, n_fields
+
+
+def find_matching_lines(rawnav_bytes, line_bounds, pattern):
+    '''
+    Parameters
+    ----------
+    rawnav_bytes : bytes
+        Contents of the rawnav text file.
+    line_bounds : np.array
+        Output of read_rawnav_lines.
+    pattern : bytes
+        Regular expression matched at the start of each line, with $ matching the end of a line.
+    Returns
+    -------
+    np.array of positions of lines that match pattern. 
+    '''
+    # Searching for the newline before each line is much faster than matching ^ at each character
+    match_start = [match.start() + 1 for match in re.finditer(b'\n' + pattern, rawnav_bytes, flags=re.M)]
+    if re.match(pattern, rawnav_bytes, flags=re.M) is not None:
+        match_start = [0] + match_start
+    return np.searchsorted(line_bounds[:, 0], match_start, side='right') - 1
+
+
+def join_rawnav_lines(rawnav_bytes, line_bounds, is_selected):
+    '''
+    Parameters
+    ----------
+    rawnav_bytes : bytes
+        Contents of the rawnav text file.
+    line_bounds : np.array
+        Output of read_rawnav_lines.
+    is_selected : np.array
+        True for lines to keep.
+    Returns
+    -------
+    bytes of the selected lines, each ending in a newline. Consecutive lines are copied together.
+    '''
+    line_pos = np.flatnonzero(is_selected)
+    if len(line_pos) == 0:
+        return b''
+    breaks = np.flatnonzero(np.diff(line_pos) != 1)
+    block_first = line_pos[np.append(0, breaks + 1)]
+    block_last = line_pos[np.append(breaks, len(line_pos) - 1)]
+    return b''.join(rawnav_bytes[line_bounds[first, 0]:line_bounds[last, 1]] + b'\n'
+                    for first, last in zip(block_first, block_last))
+
+
+def parse_rawnav_lines(rawnav_lines, index, n_fields, dtype=None):
+    '''
+    Parameters
+    ----------
+    rawnav_lines : bytes
+        Lines of a rawnav file, from join_rawnav_lines.
+    index : array-like
+        Index for each line.
+    n_fields : int
+        Number of columns.
+    dtype : type or dict, optional
+        Passed to pd.read_csv. Dict keys are column numbers. If None, types are inferred.
+    Raises
+    ------
+    ParserError
+        A line has more than n_fields fields.
+    Returns
+    -------
+    pd.DataFrame with columns numbered from 0 and the given index.
+    '''
+    if isinstance(dtype, dict):
+        dtype = {str(col): col_type for col, col_type in dtype.items() if col < n_fields}
+    # A header line fixes the number of columns, so rows with extra commas raise an error 
+    # as they would in load_rawnav_data
+    header_line = (",".join(str(col) for col in range(n_fields)) + "\n").encode()
+    raw_data = pd.read_csv(io.BytesIO(header_line + rawnav_lines), header=0, dtype=dtype)
+    raw_data.columns = range(n_fields)
+    raw_data.index = index
+    return raw_data
+
+
+def rawnav_ping_dtypes():
+    '''
+    Returns
+    -------
+    dict of column number to type for pings in rawnav files, see load_rawnav_data_typed.
+    '''
+    rawnav_ping_dtypes = {0: 'float64',  # lat
+                          1: 'float64',  # long
+                          2: 'float64',  # heading
+                          3: 'category', # door_state
+                          4: 'category', # veh_state
+                          5: 'float64',  # odom_ft
+                          6: 'float64',  # sec_past_st
+                          7: 'float64',  # sat_cnt
+                          8: 'category', # stop_window
+                          9: 'float64',  # blank
+                          10: 'float64', # lat_raw
+                          11: 'float64'} # long_raw
+    return rawnav_ping_dtypes
+
+
+def get_rawnav_run_line_ranges(tag_info_line_no, analysis_routes):
+    '''
+    Parameters
+    ----------
+    tag_info_line_no : pd.DataFrame
+        Rows of the rawnav inventory for a single file, including line_num, line_num_next, 
+        and route.
+    analysis_routes : list
+        list of routes to load.
+    Returns
+    -------
+    line_ranges : list of tuples
+        (first line, last line) spans of the file covering runs on analysis_routes, for use with
+        load_rawnav_data_lines. Each span runs from the run's tag line through the next tag line,
+        or the end of the file. Overlapping spans are combined.
+    tag_info_line_no : pd.DataFrame
+        Rows for runs on analysis_routes and for the tags that immediately follow them, with a 
+        run_loaded column that is False for the latter. The following tags are kept so that 
+        add_end_route_info can find the end of runs without an end of route message, and are 
+        dropped by clean_rawnav_data afterward.
+    '''
+    line_num = pd.to_numeric(tag_info_line_no.line_num).to_numpy()
+    line_num_next = pd.to_numeric(tag_info_line_no.line_num_next).to_numpy(dtype='float')
+    run_loaded = tag_info_line_no.route.isin(analysis_routes).to_numpy()
+    
+    span_end = np.where(np.isnan(line_num_next), np.inf, line_num_next)[run_loaded]
+    span_start = line_num[run_loaded]
+    line_ranges = []
+    for first_line, last_line in sorted(zip(span_start, span_end)):
+        if (len(line_ranges) > 0) and (first_line <= line_ranges[-1][1] + 1):
+            line_ranges[-1] = (line_ranges[-1][0], max(line_ranges[-1][1], last_line))
+        else:
+            line_ranges.append((first_line, last_line))
+            
+    tag_keep = run_loaded | np.isin(line_num, span_end)
+    tag_info_line_no = tag_info_line_no[tag_keep].assign(run_loaded = run_loaded[tag_keep])
+    return line_ranges, tag_info_line_no
+
+
+def format_rawnav_output(rawnav_data, summary_data, analysis_routes):
+    '''
+    Parameters
+    ----------
+    rawnav_data : pd.DataFrame
+        Cleaned rawnav data for a file, output of clean_rawnav_data.
+    summary_data : pd.DataFrame
+        Run summary for the same file, output of clean_rawnav_data.
+    analysis_routes : list
+        Routes to keep.
+    Returns
+    -------
+    rawnav_data : pd.DataFrame
+        Rawnav data on analysis routes with run_id, wday and start_date_time from the run 
+        summary.
+    summary_data : pd.DataFrame
+        Run summary for analysis routes, less duplicate runs, with run_id (see 
+        ll.get_run_id).
+    '''
+    # Filter to analysis routes, convert col types once NAs removed
+    summary_data = summary_data[summary_data['route'].isin(analysis_routes)]
+    summary_data = summary_data.assign(
+        route=lambda x: x.route.astype('str'),
+        pattern=lambda x: x.pattern.astype('int32'))
+    # Remove duplicate runs
+    summary_data = summary_data[
+        ~summary_data.duplicated(['filename', 'index_run_start'], keep='last')]  
+    summary_data = ll.add_run_id(ll.drop_runs_without_pings(summary_data))
+
+    # Join Additional Identifying Information
+    rawnav_data = (
+        rawnav_data[rawnav_data['route'].isin(analysis_routes)]
+        .merge(summary_data[['filename', 'index_run_start', 'run_id', 'wday', 'start_date_time']],
+               on=['filename', 'index_run_start'],
+               how='left')
+    )
+    assert (len(rawnav_data) == 0) or \
+        (rawnav_data.groupby(['filename', 'index_run_start', 'index_loc'])['index_loc']
+         .count().values.max() == 1)
+    rawnav_data = rawnav_data.assign(
+        route=lambda x: x.route.astype('str'),
+        #should be okay as int32 if everything goes to plan, but for safety will keep as double
+        # and convert pattern later
+        pattern=lambda x: x.pattern.astype('double'))
+    return rawnav_data, summary_data
+
+
+def write_rawnav_buffer(data_buffer, summary_buffer, path_rawnav_data, path_summary_rawnav,
+                        row_group_rows=250000, generations=(None, None)):
+    '''
+    Parameters
+    ----------
+    data_buffer : list of pd.DataFrame
+        Rawnav data from format_rawnav_output.
+    summary_buffer : list of pd.DataFrame
+        Run summaries from format_rawnav_output.
+    path_rawnav_data : str
+        Path to the rawnav data parquet dataset.
+    path_summary_rawnav : str
+        Path to the rawnav summary parquet dataset.
+    row_group_rows : int, optional
+        Target number of rows per row group in the rawnav data. The default is 250000.
+    generations : tuple, optional
+        Partition manifest generations of the rawnav data and summary datasets to write to. 
+        The default is a new generation for each.
+    Returns
+    -------
+    None. Buffered data is appended to the datasets as new files in each route and wday partition,
+    and runs in the rawnav data are added to its run catalog.
+    '''
+    if len(summary_buffer) > 0:
+        summary_rawnav = pd.concat(summary_buffer, ignore_index=True)
+        if len(summary_rawnav) > 0:
+            rw.write_rawnav_summary(summary_rawnav, 
+                                    path_summary_rawnav, 
+                                    generation=generations[1])
+    if len(data_buffer) > 0:
+        rawnav_data = pd.concat(data_buffer, ignore_index=True)
+        if len(rawnav_data) > 0:
+            rw.write_rawnav_data(rawnav_data, 
+                                 path_rawnav_data, 
+                                 row_group_rows, 
+                                 generation=generations[0])
+
+
+def get_file_universe_df(file_universe, nmax=None):
+    '''
+    Parameters
+    ----------
+    file_universe : list
+        Paths to zipped folders with rawnav text files.
+    nmax : int, optional
+        limit files to read to this number. If None, all zip files read.
+    Returns
+    -------
+    file_universe_df : pd.DataFrame
+        One row per file with the path, filename, and bus id parsed from the file path.
+    '''
+    assert(len(file_universe)>0), print("No files present in file universe")
+    assert((nmax == None) or (nmax > 0)), print("nmax must be greater than 0 or None")
+    file_universe_set = file_universe[0:nmax]
+    # Setup dataframe for iteration
+    file_universe_df = pd.DataFrame({'fullpath': file_universe_set})
+
+    file_universe_df['filename'] = file_universe_df['fullpath'].str.extract(r'(rawnav\d+.txt)')
+    file_universe_df['file_busid'] = file_universe_df['fullpath'].str.extract(r'rawnav(\d{5})\S+.txt')
+    file_universe_df['file_id'] = file_universe_df['fullpath'].str.extract(r'rawnav(\d+).txt')
+    file_universe_df['file_busid'] = pd.to_numeric(file_universe_df['file_busid'])
+    return file_universe_df
+
+
+def map_over_files(func, paths, n_workers=None, chunksize=None):
+    '''
+    Parameters
+    ----------
+    func : function
+        Function applied to each path. Must be defined at the module level (or be a 
+        functools.partial of such a function) so that it can be sent to worker processes.
+    paths : iterable of str
+        Paths to rawnav files.
+    n_workers : int, optional
+        Number of worker processes. If None or 1, func is applied serially.
+    chunksize : int, optional
+        Number of paths sent to a worker at a time. If None, each worker receives about 
+        four chunks so that files of different sizes balance out across workers.
+    Returns
+    -------
+    list of results of func, in the same order as paths.
+    '''
+    paths = list(paths)
+    if (n_workers is None) or (n_workers <= 1) or (len(paths) <= 1):
+        return [func(path) for path in paths]
+    
+    if chunksize is None:
+        chunksize = max(1, len(paths) // (n_workers * 4))
+    # executor.map returns results in submission order regardless of completion order
+    with ProcessPoolExecutor(max_workers=n_workers) as executor:
+        results = list(executor.map(func, paths, chunksize=chunksize))
+    return results
+
+
+def get_file_manifest(file_universe_df):
+    '''
+    Parameters
+    ----------
+    file_universe_df : pd.DataFrame
+        Output of get_file_universe_df
+    Returns
+    -------
+    manifest : pd.DataFrame
+        fullpath, filename, size in bytes, and modified time of each file. The md5 column is 
+        left empty and filled only for files that need it (see update_rawnav_inventory).
+    '''
+    file_stats = map_by_outer_zip(stat_rawnav_zip, file_universe_df['fullpath'])
+    manifest = pd.DataFrame({
+        'fullpath': file_universe_df['fullpath'].to_numpy(),
+        'filename': file_universe_df['filename'].to_numpy(),
+        'size': [file_stat[0] for file_stat in file_stats],
+        'mtime': [file_stat[1] for file_stat in file_stats],
+        'md5': None
+    })
+    return manifest
+
+
+def hash_file(path, blocksize=2**20, outer_zip=None):
+    '''
+    Parameters
+    ----------
+    path : str
+        Path to a zipped rawnav file, either on disk or within a zipped directory (see 
+        get_zipped_files_from_zip_dir)
+    blocksize : int, optional
+        Number of bytes read at a time.
+    outer_zip : zipfile.ZipFile, optional
+        The zipped directory holding path, if already open (see map_by_outer_zip).
+    Returns
+    -------
+    str, md5 hex digest of the file contents.
+    '''
+    file_hash = hashlib.md5()
+    with open_rawnav_zip_bytes(path, outer_zip=outer_zip) as input_file:
+        for block in iter(lambda: input_file.read(blocksize), b''):
+            file_hash.update(block)
+    return file_hash.hexdigest()
+
+
+def split_nested_zip_path(path):
+    '''
+    Parameters
+    ----------
+    path : str
+        Path to a file on disk, or to a file within a zipped directory, 
+        ala 'Vehicles 0-2999.zip/Vehicles 0-2999/rawnav00001191007.txt.zip'.
+    Returns
+    -------
+    outer_path : str
+        Path to the zipped directory on disk, or path itself if it is a file on disk.
+    member_name : str or None
+        Name of the file within the zipped directory, None if path is a file on disk.
+    '''
+    if os.path.isfile(path):
+        return path, None
+    for match in re.finditer('\\.zip[\\\\/]', path, flags=re.IGNORECASE):
+        outer_path = path[:match.start() + 4]
+        if os.path.isfile(outer_path):
+            return outer_path, path[match.end():].replace('\\', '/')
+    return path, None
+
+
+def map_by_outer_zip(func, paths):
+    '''
+    Parameters
+    ----------
+    func : function
+        Function of a path to a zipped rawnav file taking an open zipped directory as the 
+        keyword argument outer_zip, such as stat_rawnav_zip or hash_file.
+    paths : list-like
+        Paths to zipped rawnav files, either on disk or within zipped directories.
+    Returns
+    -------
+    list of results of func, in the same order as paths.
+    Notes
+    -----
+    Each zipped directory is opened once for all of its files, rather than reading its list 
+    of contents again for every file.
+    '''
+    paths = list(paths)
+    results = [None] * len(paths)
+    paths_by_outer = {}
+    for pos, path in enumerate(paths):
+        outer_path, member_name = split_nested_zip_path(path)
+        if member_name is None:
+            results[pos] = func(path)
+        else:
+            paths_by_outer.setdefault(outer_path, []).append(pos)
+    for outer_path, positions in paths_by_outer.items():
+        with zipfile.ZipFile(outer_path) as outer_zip:
+            for pos in positions:
+                results[pos] = func(paths[pos], outer_zip=outer_zip)
+    return results
+
+
+@contextmanager
+def open_rawnav_zip_bytes(zip_folder_path, outer_zip=None):
+    '''
+    Parameters
+    ----------
+    zip_folder_path : str
+        Path to zipped rawnav file, either on disk or within a zipped directory.
+    outer_zip : zipfile.ZipFile, optional
+        The zipped directory holding zip_folder_path, if already open (see map_by_outer_zip).
+    Returns
+    -------
+    Context manager giving a binary file-like of the zipped rawnav file. Files within a 
+    zipped directory are read in place without unzipping the directory to disk.
+    '''
+    outer_path, member_name = split_nested_zip_path(zip_folder_path)
+    if member_name is None:
+        with open(zip_folder_path, 'rb') as input_file:
+            yield input_file
+    elif outer_zip is not None:
+        with outer_zip.open(member_name) as input_file:
+            yield input_file
+    else:
+        with zipfile.ZipFile(outer_path) as outer_zip, outer_zip.open(member_name) as input_file:
+            yield input_file
+
+
+def open_rawnav_file(zip_folder_path):
+    '''
+    Parameters
+    ----------
+    zip_folder_path : str
+        Path to zipped rawnav file, either on disk or within a zipped directory.
+        Assumes that included text file has the same name as the zipped file,
+        minus the '.zip' extension.
+    Raises
+    ------
+    BadZipfile
+        Zipped file can't be opened
+    KeyError
+        Text file name doesn't match zipped file name
+    Returns
+    -------
+    Binary file-like of the rawnav text file.
+    '''
+    zip_file_name = re.search(r'(rawnav\d+\.txt)', zip_folder_path).group(1)
+    outer_path, member_name = split_nested_zip_path(zip_folder_path)
+    if member_name is None:
+        zf = zipfile.ZipFile(zip_folder_path)
+    else:
+        # Nested zip files are small, so they are held in memory rather than seeking within the
+        # compressed parent
+        with open_rawnav_zip_bytes(zip_folder_path) as input_file:
+            zf = zipfile.ZipFile(io.BytesIO(input_file.read()))
+    return zf.open(zip_file_name, 'r')
+
+
+def stat_rawnav_zip(zip_folder_path, outer_zip=None):
+    '''
+    Parameters
+    ----------
+    zip_folder_path : str
+        Path to zipped rawnav file, either on disk or within a zipped directory.
+    outer_zip : zipfile.ZipFile, optional
+        The zipped directory holding zip_folder_path, if already open (see map_by_outer_zip).
+    Returns
+    -------
+    tuple of size in bytes and modified time in seconds since the epoch. For files within a
+    zipped directory, the size and modified time recorded in the zipped directory are used.
+    '''
+    outer_path, member_name = split_nested_zip_path(zip_folder_path)
+    if member_name is None:
+        file_stat = os.stat(zip_folder_path)
+        return file_stat.st_size, file_stat.st_mtime
+    if outer_zip is not None:
+        member_info = outer_zip.getinfo(member_name)
+    else:
+        with zipfile.ZipFile(outer_path) as zf:
+            member_info = zf.getinfo(member_name)
+    return member_info.file_size, time.mktime(member_info.date_time + (0, 0, -1))
+
+
+def format_rawnav_inventory(file_universe_df):
+    '''
+    Parameters
+    ----------
+    file_universe_df : pd.DataFrame
+        Output of get_file_universe_df with a 'taglist' column holding the list of tags
+        found in each file (see find_all_tags).
+    Returns
+    -------
+    file_universe_df : pd.DataFrame
+        rawnav inventory with one row per tag.
+    '''
+    file_universe_df = file_universe_df.explode('taglist')
+    file_universe_df[['line_num', 'route_pattern', 'tag_busid', 'tag_date', 'tag_time', 'Unk1', 'mi_to_ft']] = \
+        file_universe_df['taglist'].str.split(',', expand=True)
+    file_universe_df[['route', 'pattern']] = \
+        file_universe_df['route_pattern'].str.extract(r'^(?:\s*)(?:(?!PO))(?:(?!PI))(?:(?!DH))(\S+)(\d{2})$')
+    
+    # Convert Column Types and Create new ones
+    # Note that we leave some cols as text, as integer values don't support
+    # NAs in Pandas. Some of this conversion will occur later once 'empty' tags are removed
+    file_universe_df['tag_busid'] = pd.to_numeric(file_universe_df['tag_busid'])
+    file_universe_df['tag_datetime'] = file_universe_df['tag_date'] + ' ' + file_universe_df['tag_time']
+    file_universe_df['tag_datetime'] = pd.to_datetime(file_universe_df['tag_datetime'],
+                                                      infer_datetime_format=True, errors='coerce')
+    file_universe_df['tag_starthour'] = file_universe_df['tag_time'].str.extract(r'^(?:\s*)(\d{2}):')
+    file_universe_df['tag_starthour'] = pd.to_numeric(file_universe_df['tag_starthour'])
+    # Note that this will put some late Friday trips after 12AM into the "Saturday" bucket
+    #   should probably revisit at a later date to adjust trips before 4 AM to day before.
+    file_universe_df['tag_date'] = pd.to_datetime(file_universe_df['tag_date'], infer_datetime_format=True)
+    file_universe_df['wday'] = file_universe_df['tag_date'].dt.day_name()
+    file_universe_df['line_num_next'] =\
+        file_universe_df.groupby(['filename'], sort = False)['line_num'].shift(-1)
+    
+    #Reorder Cols
+    column_nm_map = ['fullpath', 
+                     'filename', 
+                     'file_id', 
+                     'file_busid', 
+                     'taglist',
+                     'line_num',
+                     'line_num_next',
+                     'route_pattern',
+                     'route', 
+                     'pattern', 
+                     'tag_busid', 
+                     'tag_date', 
+                     'tag_time', 
+                     'tag_datetime', 
+                     'tag_starthour',
+                     'wday',
+                     'Unk1',
+                     'mi_to_ft']
+    
+    file_universe_df = file_universe_df.reindex(columns = column_nm_map, copy = False)
+        
+    return file_universe_df
+
+
 def add_run_dividers(data, summary_data):
     '''
     Parameters
@@ -302,19 +1471,29 @@ def add_run_dividers(data, summary_data):
     Returns
     -------
     rawnav data with composite keys.
-
-    '''
-    summary_data.columns
-    tags_temp = summary_data[
-        ['route_pattern', 'route', 'pattern', 'index_run_start', 'index_run_end']]
-    q1 = '''SELECT data.index_loc,data.lat,data.long,data.heading,data.door_state,data.veh_state,data.odom_ft,
-    data.sec_past_st,data.sat_cnt,data.stop_window,data.blank,data.lat_raw,data.long_raw,data.row_before_apc,
-    tags_temp.route_pattern,tags_temp.route,tags_temp.pattern,tags_temp.index_run_start,
-    tags_temp.index_run_end
-    FROM data LEFT JOIN tags_temp on data.index_loc 
-    BETWEEN  tags_temp.index_run_start and tags_temp.index_run_end
+    Notes
+    -----
+    Each ping is labeled with the run whose index_run_start to index_run_end range (inclusive)
+    contains its index_loc, same as a left join of data on index_loc BETWEEN index_run_start 
+    AND index_run_end. Pings outside of any run are kept with missing run values. 
     '''
-    data = ps.sqldf(q1, locals())
+    tags_temp = (
+        summary_data[['route_pattern', 'route', 'pattern', 'index_run_start', 'index_run_end']]
+        .reset_index(drop=True)
+    )
+    data_cols = ['index_loc', 'lat', 'long', 'x_ft', 'y_ft', 'heading', 'door_state', 'veh_state', 
+                 'odom_ft', 'sec_past_st', 'sat_cnt', 'stop_window', 'blank', 'lat_raw', 'long_raw', 
+                 'row_before_apc']
+    
+    data_pos, run_pos = ll.interval_join_index(data.index_loc.to_numpy(),
+                                               tags_temp.index_run_start.to_numpy(),
+                                               tags_temp.index_run_end.to_numpy())
+    
+    # Position -1 is not in the index of tags_temp, and so is filled with missing values 
+    data = pd.concat(
+        [data[data_cols].iloc[data_pos].reset_index(drop=True),
+         tags_temp.reindex(run_pos).reset_index(drop=True)],
+        axis=1)
     return data
 
 
@@ -440,7 +1619,7 @@ def remove_apc_cal_tags(data):
     return data, apc_tag_loc
 
 
-def add_end_route_info(data, tagline_data):
+def add_end_route_info(data, tagline_data, last_index_loc=None):
     '''
     Parameters
     ----------
@@ -448,6 +1627,9 @@ def add_end_route_info(data, tagline_data):
         Unclean data with info on end of route.
     tagline_data : pd.DataFrame
         Tagline data.
+    last_index_loc : int, optional
+        End of the last run if no end of route message follows it. If None, the last index_loc
+        in data.
     Returns
     -------
     tagline_data : pd.DataFrame
@@ -458,7 +1640,7 @@ def add_end_route_info(data, tagline_data):
         indices to delete from raw data.
     '''
     pat = re.compile(
-        '^\s*/\s*(?P<run_end_time>\d{2}:\d{2}:\d{2})\s*(?:Buswares navigation reported end of route|Buswares is now using route zero)',
+        r'^\s*/\s*(?P<run_end_time>\d{2}:\d{2}:\d{2})\s*(?:Buswares navigation reported end of route|Buswares is now using route zero)',
         re.S)
     data.loc[:, 'run_end_time'] = data[0].str.extract(pat)
     end_of_route = data[['index_loc', 'run_end_time']]
@@ -479,7 +1661,9 @@ def add_end_route_info(data, tagline_data):
     tagline_data.loc[tagline_data.run_end_time.isna(), ['index_run_end_original', 'run_end_time']] = tagline_data.loc[
         tagline_data.run_end_time.isna(), ['tempLine', 'tempTime']].values
     if np.isnan(tagline_data.iloc[-1]['index_run_end_original']):
-        tagline_data.loc[tagline_data.index.max(), 'index_run_end_original'] = max(data.index_loc)
+        if (last_index_loc is None) or np.isnan(last_index_loc):
+            last_index_loc = data.index_loc.max()
+        tagline_data.loc[tagline_data.index.max(), 'index_run_end_original'] = last_index_loc
     tagline_data.rename(columns={'tag_time': "run_start_time"}, inplace=True)
     return tagline_data, delete_indices
 
@@ -504,37 +1688,9 @@ def get_distance_latlong_mi(data, lat1, long1, lat2, long2):
         distances in mile between (Lat1,long1) and (Lat2,long2) columns in Data.
         same size as number of rows in Data.
     '''
-    geometry1 = [Point(xy) for xy in zip(data[long1], data[lat1])]
-    gdf = gpd.GeoDataFrame(geometry=geometry1, crs={'init': 'epsg:4326'})
-    gdf.to_crs(epsg=3310, inplace=True)  # Distance in meters---Default is in degrees!
-    geometry2 = [Point(xy) for xy in zip(data[long2], data[lat2])]
-    gdf2 = gpd.GeoDataFrame(geometry=geometry2, crs={'init': 'epsg:4326'})
-    gdf2.to_crs(epsg=3310, inplace=True)  # Distance in meters---Default is in degrees!
-    # https://gis.stackexchange.com/questions/293310/how-to-use-geoseries-distance-to-get-the-right-answer
-    distance_mi = gdf.geometry.distance(gdf2) * 0.000621371  # meters to miles
-    return distance_mi.values
-
-
-def get_distance_latlong_ft_from_geom(geometry1, geometry2):
-    '''
-    Parameters
-    ----------
-    geometry1 : pd.series of shapely.geometry.point
-    geometry2 : pd.series of shapely.geometry.point
-        same size as geometry1
-    Returns
-    -------
-    DistanceFt: np.array
-    distances in feet between each points in geometry1 and geometry2.
-    same size as geometry1 or geometry2. 
-    '''
-    gdf = gpd.GeoDataFrame(geometry=geometry1, crs={'init': 'epsg:4326'})
-    gdf.to_crs(epsg=3310, inplace=True)  # Distance in meters---Default is in degrees!
-    gdf2 = gpd.GeoDataFrame(geometry=geometry2, crs={'init': 'epsg:4326'})
-    gdf2.to_crs(epsg=3310, inplace=True)  # Distance in meters---Default is in degrees!
-    # https://gis.stackexchange.com/questions/293310/how-to-use-geoseries-distance-to-get-the-right-answer
-    distance_ft = gdf.geometry.distance(gdf2) * 3.28084  # meters to feet
-    return (distance_ft.values)
+    # Distance in meters in EPSG 3310, see ll.get_distance_latlong
+    distance_mi = ll.get_distance_latlong(data[lat1], data[long1], data[lat2], data[long2]) * 0.000621371  # meters to miles
+    return distance_mi
 
 
 def find_all_tags(zip_folder_path, quiet=True):
@@ -556,23 +1712,8 @@ def find_all_tags(zip_folder_path, quiet=True):
     if quiet != True:
         print("Searching for tags in: " + zip_folder_path)
     try:
-        zf = zipfile.ZipFile(zip_folder_path)
-        # Get Filename
-        namepat = re.compile('(rawnav\d+\.txt)')
-        zip_file_name = namepat.search(zip_folder_path).group(1)
-        # Get Info
-        infopat = '^\s*(\S+),(\d{1,5}),(\d{2}\/\d{2}\/\d{2}),(\d{2}:\d{2}:\d{2}),(\S+),(\S+)'
-        tag_line_elements = []
-        tag_line_num = 1
-        with io.TextIOWrapper(zf.open(zip_file_name, 'r'), encoding="utf-8") as input_file:
-            for current_line in input_file:
-                for match in re.finditer(infopat, current_line, re.S):
-                    # Turns out we don't really need capture groups
-                    # with string split approach, but leaving in for possible
-                    # future changes
-                    returnvals = str(tag_line_num) + "," + match.group()
-                    tag_line_elements.append(returnvals)
-                tag_line_num = tag_line_num + 1
+        with io.TextIOWrapper(open_rawnav_file(zip_folder_path), encoding="utf-8") as input_file:
+            tag_line_elements = find_tags_in_lines(input_file)
         if len(tag_line_elements) == 0:
             tag_line_elements.append(',,,,,,')
     except BadZipfile as BadZipEr:
@@ -590,6 +1731,123 @@ def find_all_tags(zip_folder_path, quiet=True):
     return tag_line_elements
 
 
+def find_tags_in_lines(lines):
+    '''
+    Parameters
+    ----------
+    lines: iterable of str
+        Lines of a rawnav text file, such as an open file object.
+    Returns
+    -------
+    TagLineElements
+        List of Character strings including line number, pattern, vehicle,
+        date, and time. Line numbers start at 1.
+    '''
+    # Get Info
+    infopat = re.compile(r'^\s*(\S+),(\d{1,5}),(\d{2}\/\d{2}\/\d{2}),(\d{2}:\d{2}:\d{2}),(\S+),(\S+)', re.S)
+    tag_line_elements = []
+    tag_line_num = 1
+    for current_line in lines:
+        for match in infopat.finditer(current_line):
+            # Turns out we don't really need capture groups
+            # with string split approach, but leaving in for possible
+            # future changes
+            returnvals = str(tag_line_num) + "," + match.group()
+            tag_line_elements.append(returnvals)
+        tag_line_num = tag_line_num + 1
+    return tag_line_elements
+
+
+def find_tags_load_rawnav_data(zip_folder_path, analysis_routes=None, quiet=True):
+    '''
+    Parameters
+    ----------
+    zip_folder_path: str
+        Path to zipped folder with rawnav text file, as in find_all_tags.
+    analysis_routes: list, optional
+        If provided, rawnav data is only parsed if at least one tag in the file is on one of 
+        these routes. If None, data is parsed for any file with tags.
+    quiet : boolean, optional
+        Whether to print status. The default is True.
+    Returns
+    -------
+    tag_line_elements: list
+        Same as the output of find_all_tags.
+    raw_data: pd.DataFrame or None
+        Same as the output of load_rawnav_data with skiprows set to the line number of the
+        first tag. None if the file has no tags, no analysis routes, or can't be parsed.
+    Notes
+    -----
+    The zipped file is decompressed once and both the tags and the data are read from the 
+    same text held in memory.
+    '''
+    if quiet != True:
+        print("Searching for tags and loading: " + zip_folder_path)
+    tag_line_elements, rawnav_bytes = find_tags_read_rawnav_bytes(zip_folder_path)
+    if (rawnav_bytes is None) or (tag_line_elements == [',,,,,,']):
+        return tag_line_elements, None
+    
+    if analysis_routes is not None:
+        routepat = re.compile(r'^(?:\s*)(?:(?!PO))(?:(?!PI))(?:(?!DH))(\S+)(\d{2})$')
+        tag_routes = [routepat.match(tag.split(',')[1]) for tag in tag_line_elements]
+        if not any(route_match.group(1) in analysis_routes 
+                   for route_match in tag_routes if route_match is not None):
+            return tag_line_elements, None
+        
+    first_tag_line_num = int(tag_line_elements[0].split(',')[0])
+    try:
+        raw_data = pd.read_csv(io.BytesIO(rawnav_bytes), skiprows=first_tag_line_num, header=None)
+    except ParserError as parseerr:
+        print("*" * 100)
+        print("More number of ',' in a file {}. pandas has issue with tokenizing data. Error: {}".format(zip_folder_path,parseerr))
+        print("*" * 100)
+        raw_data = None
+    return tag_line_elements, raw_data
+
+
+def find_tags_read_rawnav_bytes(zip_folder_path, quiet=True):
+    '''
+    Parameters
+    ----------
+    zip_folder_path: str
+        Path to zipped folder with rawnav text file, as in find_all_tags.
+    quiet : boolean, optional
+        Whether to print status. The default is True.
+    Returns
+    -------
+    tag_line_elements: list
+        Same as the output of find_all_tags.
+    rawnav_bytes: bytes or None
+        Contents of the rawnav text file, None if the file can't be opened.
+    Notes
+    -----
+    The zipped file is decompressed once, so that data can be loaded from the same contents 
+    the tags were found in (see find_tags_load_rawnav_data and load_rawnav_data_typed).
+    '''
+    if quiet != True:
+        print("Searching for tags in: " + zip_folder_path)
+    empty_tags = [',,,,,,']
+    try:
+        with open_rawnav_file(zip_folder_path) as input_file:
+            rawnav_bytes = input_file.read()
+    except BadZipfile as BadZipEr:
+        print("*" * 100)
+        print("issue with opening zipped file: {}. Error: {}".format(zip_folder_path,BadZipEr))
+        print("*" * 100)
+        return empty_tags, None
+    except KeyError as keyerr:
+        print("*" * 100)
+        print("Text file name doesn't match parent zip folder for': {}. Error: {}".format(zip_folder_path,keyerr))
+        print("*" * 100)
+        return empty_tags, None
+    
+    # Newlines are handled as when reading the file as text, see find_all_tags
+    tag_line_elements = find_tags_in_lines(io.StringIO(rawnav_bytes.decode("utf-8"), newline=None))
+    if len(tag_line_elements) == 0:
+        tag_line_elements = empty_tags
+    return tag_line_elements, rawnav_bytes
+
+
 def move_empty_incorrect_label_files(file, path_source_data, issue='EmptyFiles'):
     '''
     Parameters
@@ -605,7 +1863,7 @@ def move_empty_incorrect_label_files(file, path_source_data, issue='EmptyFiles')
     None.
     '''
     # Copy empty files to another directory for checking.
-    pat = re.compile('.*(Vehicles\s*[0-9]*-[0-9]*)')
+    pat = re.compile(r'.*(Vehicles\s*[0-9]*-[0-9]*)')
     veh_nos = pat.search(file).group(1)
     move_folder_name = "EmptyMissClassFiles//" + veh_nos
     move_dir = os.path.join(path_source_data, move_folder_name, issue)
@@ -651,3 +1909,29 @@ def check_valid_data_entry(row):
     except:
         ""
     return is_valid_entry
+
+
+def check_valid_data_entries(data):
+    '''
+    Parameters
+    ----------
+    data : pd.DataFrame
+        Unclean rawnav data with unnamed columns, as in check_valid_data_entry.
+    Returns
+    -------
+    is_valid_entry : pd.Series
+        Boolean mask with the same index as data. Vectorized version of check_valid_data_entry:
+        values that can't be converted to numbers are treated as invalid, as are missing values.
+    '''
+    lat = pd.to_numeric(data[0], errors='coerce')
+    long = pd.to_numeric(data[1], errors='coerce')
+    heading = pd.to_numeric(data[2], errors='coerce')
+    # Comparisons against NaN are False, so rows that failed conversion drop out here
+    is_valid_entry = (
+        lat.between(-90, 90) 
+        & long.between(-180, 180) 
+        & heading.between(0, 360) 
+        & data[3].isin(['O', 'C']) 
+        & data[4].isin(['M', 'S'])
+    )
+    return is_valid_entry
@@ -6,14 +6,28 @@ Created on Thu Jul  9 12:20:18 2020
 """
 
 import os
+import glob
+import uuid
+import hashlib
+import numpy as np
 import pandas as pd
 import pyarrow as pa
 import pyarrow.parquet as pq
+import pyarrow.dataset as ds
+import pyarrow.feather as pf
+import pyarrow.fs as pfs
 from itertools import product
 from . import low_level_fns as ll
 
 
-def read_cleaned_rawnav(path, analysis_routes_, analysis_days_ = None):
+def read_cleaned_rawnav(path, 
+                        analysis_routes_, 
+                        analysis_days_ = None, 
+                        columns = None, 
+                        filenames = None, 
+                        runs = None, 
+                        start_date_time = None,
+                        cache_dir = None):
     """
     Parameters
     ----------
@@ -26,11 +40,34 @@ def read_cleaned_rawnav(path, analysis_routes_, analysis_days_ = None):
     analysis_days_: list,
         days of the week for which data is needed. Should be a subset of following:
         ['Monday','Tuesday','Wednesday','Thursday','Friday','Saturday','Sunday']
-
+    columns: list, optional
+        columns to read. By default all columns are read. Columns not in the dataset are 
+        skipped, such as x_ft and y_ft in data parsed before they were added. run_id is 
+        derived for data written before it was stored.
+    filenames: list, optional
+        rawnav filenames (e.g. 'rawnav02833191007.txt') to read. By default all files are read.
+    runs: pd.DataFrame, optional
+        runs to read, identified by columns filename and index_run_start or by run_id. By 
+        default all runs are read.
+    start_date_time: tuple, optional
+        (start, end) of the range of run start_date_time to read, as anything pd.Timestamp
+        accepts. Start is inclusive and end exclusive; either may be None.
+    cache_dir: str, optional
+        folder for a local cache of the route and wday partitions read, see get_rawnav_cache.
+        By default, no cache is used.
+        
     Returns
     -------
     rawnav_dat: pd.DataFrame,
       rawnav data
+    Notes
+    -----
+    Filters are passed to the pyarrow dataset scan, so that partitions and row groups without 
+    matching rows are skipped and only the columns requested are decoded. Runs are filtered
+    on filename and index_run_start separately in the scan, then on each pair after read in.
+    
+    Only files in the partition manifest are read (see list_partition_files). Duplicates are 
+    only looked for if a partition read was written more than once without being overwritten.
     """
     
     # Parameter Checks
@@ -50,22 +87,115 @@ def read_cleaned_rawnav(path, analysis_routes_, analysis_days_ = None):
               """)
     assert (len(analysis_days_) == len(set(analysis_days_))),\
         print("analysis_days_ entries cannot be duplicated")     
+    if runs is not None:
+        assert (set(['filename', 'index_run_start']).issubset(runs.columns) 
+                or ('run_id' in runs.columns)),\
+            print("runs should have columns filename and index_run_start or run_id")
+        if not set(['filename', 'index_run_start']).issubset(runs.columns):
+            runs = ll.get_run_keys(runs.run_id.unique())
+    if start_date_time is not None:
+        assert (len(start_date_time) == 2), print("start_date_time should be a (start, end) tuple")
          
     # Function Body
     
-    combo = pd.DataFrame(list(product(analysis_routes_, analysis_days_)), columns = ['route','wday'])
-    combo_zip = zip(combo.route, combo.wday)
-    filter_parquet = [[('route','=',route),('wday', '=', day)] for route, day in combo_zip]
-    
     try:
-        rawnav_temp_dat = (
-            pq.read_table(source=os.path.join(path),
-                          filters=filter_parquet,
-                          use_pandas_metadata = True)
-            .to_pandas())
-        
-        # NOTE: could selectt fewer columns to save memory/time on read in, but don't expect
-        # performance boost to be that great, could be obnoxious
+        partition_files = list_partition_files(path)
+        partition_files = (
+            partition_files[partition_files.route.isin(analysis_routes_) 
+                            & partition_files.wday.isin(analysis_days_)]
+            .sort_values('generation', kind='mergesort')
+        )
+        
+        if len(partition_files) == 0:
+            raise IndexError
+        
+        check_duplicates = len(get_partitions_with_duplicates(partition_files)) > 0
+        
+        if cache_dir is not None:
+            # Cached partitions hold route and wday as columns
+            rawnav_dataset = ds.dataset(
+                source=get_rawnav_cache(path, partition_files, cache_dir),
+                format='ipc',
+                filesystem=pfs.LocalFileSystem(use_mmap=True)
+            )
+        else:
+            rawnav_dataset = get_parquet_dataset(path, partition_files)
+        dataset_schema = rawnav_dataset.schema
+        # Filenames are dictionary-encoded from version 2 of rawnav_data_schema, and dictionary 
+        # fields can only be compared once cast back to strings
+        if pa.types.is_dictionary(dataset_schema.field('filename').type):
+            filename_field = ds.field('filename').cast(pa.string())
+        else:
+            filename_field = ds.field('filename')
+        
+        filter_expr = (
+            ds.field('route').isin(analysis_routes_) 
+            & ds.field('wday').isin(analysis_days_)
+        )
+        
+        if filenames is not None:
+            filter_expr = filter_expr & filename_field.isin(list(ll.check_convert_list(filenames)))
+        
+        if runs is not None:
+            filter_expr = (
+                filter_expr
+                & filename_field.isin(list(runs.filename.unique()))
+                & ds.field('index_run_start').isin(
+                    get_field_values(runs.index_run_start.unique(), 
+                                     dataset_schema.field('index_run_start').type))
+            )
+        
+        if start_date_time is not None:
+            # Timestamp scalars are not supported in dataset filters, so we compare the 
+            # underlying integers in the unit of the stored column
+            time_type = dataset_schema.field('start_date_time').type
+            time_int = ds.field('start_date_time').cast(pa.int64())
+            if start_date_time[0] is not None:
+                filter_expr = filter_expr & (
+                    time_int >= ds.scalar(get_timestamp_int(start_date_time[0], time_type.unit)))
+            if start_date_time[1] is not None:
+                filter_expr = filter_expr & (
+                    time_int < ds.scalar(get_timestamp_int(start_date_time[1], time_type.unit)))
+        
+        # Keys used to remove duplicates or filter runs below are read even if not requested
+        if check_duplicates:
+            key_cols = ['index_loc', 'filename', 'index_run_start']
+        elif runs is not None:
+            key_cols = ['filename', 'index_run_start']
+        else:
+            key_cols = []
+        
+        # run_id is derived from filename and index_run_start where it was not stored
+        check_run_id = (columns is None) or ('run_id' in ll.check_convert_list(columns))
+        if check_run_id:
+            key_cols = key_cols + [
+                col for col in ['filename', 'index_run_start'] if col not in key_cols
+            ]
+        
+        if columns is not None:
+            columns = [
+                col for col in ll.check_convert_list(columns) 
+                if (col in dataset_schema.names) or (col == 'run_id')
+            ]
+            read_columns = [col for col in columns if col in dataset_schema.names] + [
+                col for col in key_cols 
+                if (col in dataset_schema.names) and (col not in columns)
+            ]
+        else:
+            read_columns = None
+        
+        rawnav_temp_tab = rawnav_dataset.to_table(columns=read_columns, filter=filter_expr)
+        
+        if rawnav_temp_tab.num_rows == 0:
+            raise IndexError
+        
+        # Restore pandas metadata, which is dropped when selecting columns
+        if (dataset_schema.metadata is not None) and (b'pandas' in dataset_schema.metadata):
+            rawnav_temp_tab = rawnav_temp_tab.replace_schema_metadata(
+                {b'pandas': dataset_schema.metadata[b'pandas']})
+        
+        rawnav_temp_dat = rawnav_temp_tab.to_pandas()
+
     except Exception as e:
         if str(type(e)) == "<class 'IndexError'>":
             raise ValueError('No data found for any of given filter conditions')
@@ -79,7 +209,9 @@ def read_cleaned_rawnav(path, analysis_routes_, analysis_days_ = None):
         check_data =  all(item in list(rawnav_temp_dat.columns) for item in ['index_loc','filename','index_run_start'])
         check_summary = all(item in list(rawnav_temp_dat.columns) for item in ['filename','index_run_start'])
         
-        if check_data:
+        if not check_duplicates:
+            pass
+        elif check_data:
             rawnav_temp_dat = rawnav_temp_dat[
                 ~rawnav_temp_dat.duplicated(['index_loc', 'filename', 'index_run_start'], keep='last')] 
         elif check_summary:
@@ -89,53 +221,1269 @@ def read_cleaned_rawnav(path, analysis_routes_, analysis_days_ = None):
             print("Doesn't match expected input")
             raise
         
-        # Even after defining the schema on parquet write, we're still seeing some strings 
-        # read in as categories rather than as strings. Very odd.
-        rawnav_temp_dat.route = rawnav_temp_dat.route.astype('str') 
-        rawnav_temp_dat.wday = rawnav_temp_dat.wday.astype('str') 
-        # Even though we could store as int, in case the values have NA's, we store as float
-        # and then convert to int after the fact. If you happen to run into a problem here, do an adhoc
-        # load of the parquet file and then after filtering NA values, convert pattern to 
-        # integer.
-        rawnav_temp_dat.pattern = rawnav_temp_dat.pattern.astype('int') 
+        if runs is not None:
+            rawnav_temp_dat = (
+                rawnav_temp_dat
+                .merge(runs[['filename', 'index_run_start']]
+                       .drop_duplicates()
+                       .astype({'index_run_start': rawnav_temp_dat.index_run_start.dtype}),
+                       on=['filename', 'index_run_start'],
+                       how='inner')
+            )
+        
+        if check_run_id and check_summary:
+            # Summaries written before runs without pings were dropped at parse time
+            rawnav_temp_dat = ll.add_run_id(ll.drop_runs_without_pings(rawnav_temp_dat))
+            
+        if columns is not None:
+            rawnav_temp_dat = rawnav_temp_dat[columns]
+        
+        rawnav_temp_dat = format_cleaned_rawnav(rawnav_temp_dat)
 
     return rawnav_temp_dat
 
-def rawnav_data_schema():
+
+def iter_rawnav_batches(path, 
+                        analysis_routes_, 
+                        analysis_days_ = None, 
+                        by = 'run', 
+                        batch_rows = 100000, 
+                        columns = None):
     """
+    Parameters
+    ----------
+    path: str,
+       path where the parquet files for cleaned data is kept
+    analysis_routes_: list,
+        routes for which rawnav data is needed
+    analysis_days_: list, optional
+        days of the week for which data is needed. By default all days are read.
+    by: str, optional
+        'run' to yield one run at a time, 'file' to yield one rawnav file (e.g. 
+        'rawnav02833191007.txt') within a route and wday at a time, or 'rows' to yield up to 
+        batch_rows rows at a time regardless of runs. The default is 'run'.
+    batch_rows: int, optional
+        number of rows per batch when by is 'rows'. The default is 100000.
+    columns: list, optional
+        columns to read. By default all columns are read. 
+    Yields
+    ------
+    rawnav_dat: pd.DataFrame,
+      rawnav data for one run, rawnav file or batch of rows, as read_cleaned_rawnav would 
+      return it
+    Notes
+    -----
+    Each route and wday partition is scanned one record batch at a time, so only the current 
+    batch and the rows of the run or file it ends in are held in memory. This relies on the 
+    rows of each run and rawnav file being stored together, as they are by this package's 
+    writers. Partitions that need duplicates removed (see get_partitions_with_duplicates) are
+    read whole with read_cleaned_rawnav instead; compact_rawnav_dataset avoids this.
+    """
+    day_of_week = ['Monday', 'Tuesday', 'Wednesday', 'Thursday', 'Friday', 'Saturday', 'Sunday']
+    
+    if analysis_days_ is None:
+        analysis_days_ = day_of_week
+    
+    analysis_routes_ = ll.check_convert_list(analysis_routes_)    
+    analysis_days_ = ll.check_convert_list(analysis_days_)
+    
+    assert (set(analysis_days_).issubset(set(day_of_week))),\
+        print("analysis_days_ should be a subset of {}".format(day_of_week))
+    assert (by in ['run', 'file', 'rows']), print("by should be one of 'run', 'file' or 'rows'")
+    assert (batch_rows > 0), print("batch_rows must be greater than 0")
+    
+    partition_files = list_partition_files(path)
+    partition_files = (
+        partition_files[partition_files.route.isin(analysis_routes_) 
+                        & partition_files.wday.isin(analysis_days_)]
+        .sort_values('generation', kind='mergesort')
+    )
+    
+    if len(partition_files) == 0:
+        raise ValueError('No data found for any of given filter conditions')
+    
+    partitions_dup = get_partitions_with_duplicates(partition_files)
+    partitions_dup = set(zip(partitions_dup.route, partitions_dup.wday))
+    
+    key_cols = {'run': ['filename', 'index_run_start'], 'file': ['filename'], 'rows': []}[by]
+    # As in read_cleaned_rawnav, run_id is derived where it was not stored
+    check_run_id = (columns is None) or ('run_id' in ll.check_convert_list(columns))
+    if check_run_id:
+        extra_cols = ['filename', 'index_run_start']
+    else:
+        extra_cols = key_cols
+    if columns is not None:
+        columns = ll.check_convert_list(columns)
+        read_columns = columns + [col for col in extra_cols if col not in columns]
+    else:
+        read_columns = None
+    
+    for (route, wday), partition_files_1 in partition_files.groupby(['route', 'wday'], sort=False):
+        if (route, wday) in partitions_dup:
+            rawnav_partition = pa.Table.from_pandas(
+                read_cleaned_rawnav(path, route, wday, columns = read_columns),
+                preserve_index=False
+            )
+            pandas_metadata = None
+            rawnav_batches = rawnav_partition.to_batches(batch_rows)
+        else:
+            rawnav_dataset = get_parquet_dataset(path, partition_files_1)
+            if (rawnav_dataset.schema.metadata is not None) and \
+                (b'pandas' in rawnav_dataset.schema.metadata):
+                pandas_metadata = rawnav_dataset.schema.metadata[b'pandas']
+            else:
+                pandas_metadata = None
+            if read_columns is not None:
+                read_columns_1 = [
+                    col for col in read_columns if col in rawnav_dataset.schema.names
+                ]
+            else:
+                read_columns_1 = None
+            rawnav_batches = rawnav_dataset.to_batches(columns = read_columns_1)
+        
+        for rawnav_table in get_batch_groups(rawnav_batches, key_cols, batch_rows):
+            # Restore pandas metadata, which is dropped when selecting columns
+            if pandas_metadata is not None:
+                rawnav_table = rawnav_table.replace_schema_metadata({b'pandas': pandas_metadata})
+            rawnav_dat = format_cleaned_rawnav(rawnav_table.to_pandas())
+            if check_run_id:
+                rawnav_dat = ll.add_run_id(ll.drop_runs_without_pings(rawnav_dat))
+            if columns is not None:
+                rawnav_dat = rawnav_dat[[col for col in columns if col in rawnav_dat.columns]]
+            yield rawnav_dat
+
+
+def get_batch_groups(rawnav_batches, key_cols, batch_rows):
+    """
+    Parameters
+    ----------
+    rawnav_batches: iterable of pa.RecordBatch,
+        rawnav data in the order stored
+    key_cols: list,
+        columns identifying each group of rows to yield, e.g. filename and index_run_start for
+        runs. If empty, batch_rows rows are yielded at a time.
+    batch_rows: int,
+        number of rows to yield at a time if key_cols is empty
+    Yields
+    ------
+    rawnav_table: pa.Table,
+        rows of one group, or batch_rows rows. Rows of a group left at the end of a batch are 
+        held until the next batch shows the group is complete.
+    """
+    pending = None
+    
+    for rawnav_batch in rawnav_batches:
+        if rawnav_batch.num_rows == 0:
+            continue
+        
+        rawnav_table = pa.Table.from_batches([rawnav_batch])
+        if pending is not None:
+            rawnav_table = pa.concat_tables([pending, rawnav_table])
+        
+        if len(key_cols) == 0:
+            while rawnav_table.num_rows >= batch_rows:
+                yield rawnav_table.slice(0, batch_rows)
+                rawnav_table = rawnav_table.slice(batch_rows)
+            pending = rawnav_table
+            continue
+        
+        is_group_start = np.zeros(rawnav_table.num_rows, dtype=bool)
+        is_group_start[0] = True
+        for col in key_cols:
+            key_values = np.asarray(rawnav_table.column(col).to_pandas())
+            is_group_start[1:] |= key_values[1:] != key_values[:-1]
+        group_starts = np.flatnonzero(is_group_start)
+        group_ends = np.append(group_starts[1:], rawnav_table.num_rows)
+        
+        for start, end in zip(group_starts[:-1], group_ends[:-1]):
+            yield rawnav_table.slice(start, end - start)
+        pending = rawnav_table.slice(group_starts[-1])
+    
+    if (pending is not None) and (pending.num_rows > 0):
+        yield pending
+
+
+def get_parquet_dataset(path, partition_files):
+    """
+    Parameters
+    ----------
+    path: str,
+        path to the rawnav data or rawnav summary parquet dataset
+    partition_files: pd.DataFrame,
+        files to read, as from list_partition_files
+    Returns
+    -------
+    rawnav_dataset: ds.Dataset,
+        dataset of the files, with route and wday read from the partition folders
+    """
+    # Partition values are read as strings, as routes like '70' would otherwise be read as
+    # integers
+    rawnav_dataset = ds.dataset(
+        source=[os.path.join(path, file_path) for file_path in partition_files.file_path],
+        format='parquet',
+        partitioning=ds.partitioning(
+            pa.schema([('route', pa.string()), ('wday', pa.string())]), 
+            flavor='hive'),
+        partition_base_dir=path
+    )
+    
+    return rawnav_dataset
+
+
+def get_rawnav_cache(path, partition_files, cache_dir):
+    """
+    Parameters
+    ----------
+    path: str,
+        path to the rawnav data or rawnav summary parquet dataset
+    partition_files: pd.DataFrame,
+        files to read, as from list_partition_files, in the order they were written
+    cache_dir: str,
+        folder for cached partitions, created if needed
+    Returns
+    -------
+    cache_paths: list,
+        paths of the cached copy of each route and wday partition in partition_files.
+    Notes
+    -----
+    Each partition is cached as an uncompressed Arrow IPC (Feather version 2) file, which 
+    read_cleaned_rawnav memory-maps rather than decoding parquet again; the operating system
+    shares the pages between processes reading the same partition. Cached files are named by
+    a hash of the dataset path and the partition's files, generations, sizes and modification 
+    times, so any write to a partition leads to a new cached copy on the next read. Older 
+    copies are not removed; the folder can be cleared at any time.
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    
+    cache_paths = []
+    for (route, wday), partition_files_1 in partition_files.groupby(['route', 'wday'], sort=False):
+        full_paths = [os.path.join(path, file_path) for file_path in partition_files_1.file_path]
+        cache_key = repr((
+            os.path.abspath(path),
+            route,
+            wday,
+            [(file_path, generation, os.stat(full_path).st_size, os.stat(full_path).st_mtime_ns)
+             for file_path, generation, full_path 
+             in zip(partition_files_1.file_path, partition_files_1.generation, full_paths)]
+        ))
+        cache_path = os.path.join(
+            cache_dir, 
+            '{}.arrow'.format(hashlib.sha1(cache_key.encode('utf-8')).hexdigest())
+        )
+        
+        if not os.path.isfile(cache_path):
+            rawnav_table = get_parquet_dataset(path, partition_files_1).to_table()
+            
+            # Each parquet file has its own dictionaries, but an IPC file only holds one per 
+            # column
+            for index, field in enumerate(rawnav_table.schema):
+                if pa.types.is_dictionary(field.type):
+                    values = pa.concat_arrays([
+                        chunk.cast(pa.string()) for chunk in rawnav_table.column(index).chunks
+                    ])
+                    rawnav_table = rawnav_table.set_column(
+                        index, 
+                        field, 
+                        pa.chunked_array([values.dictionary_encode()], type=field.type)
+                    )
+            
+            # Written to a temporary file first so that a read never sees a partial copy
+            pf.write_feather(rawnav_table, cache_path + '.tmp', compression='uncompressed')
+            os.replace(cache_path + '.tmp', cache_path)
+        
+        cache_paths.append(cache_path)
+    
+    return cache_paths
+
+
+def format_cleaned_rawnav(rawnav_dat):
+    """
+    Parameters
+    ----------
+    rawnav_dat: pd.DataFrame,
+      rawnav data or summary data as read from parquet
+    Returns
+    -------
+    rawnav_dat: pd.DataFrame,
+      the same, with key columns converted to the types used in later processing.
+    """
+    # Even after defining the schema on parquet write, we're still seeing some strings 
+    # read in as categories rather than as strings. Very odd.
+    if 'route' in rawnav_dat.columns:
+        rawnav_dat.route = rawnav_dat.route.astype('str') 
+    if 'wday' in rawnav_dat.columns:
+        rawnav_dat.wday = rawnav_dat.wday.astype('str') 
+    # Version 2 of rawnav_data_schema stores these as dictionaries, but they are used as 
+    # grouping keys, where categories would add groups for every unobserved combination. 
+    # State columns (door_state, veh_state, stop_window) are left as categories.
+    for col in ['filename', 'route_pattern']:
+        if (col in rawnav_dat.columns) and \
+            pd.api.types.is_categorical_dtype(rawnav_dat[col]):
+            rawnav_dat[col] = rawnav_dat[col].astype('str')
+    # Even though we could store as int, in case the values have NA's, we store as float
+    # and then convert to int after the fact. If you happen to run into a problem here, do an adhoc
+    # load of the parquet file and then after filtering NA values, convert pattern to 
+    # integer. Patterns already stored as integers (summary data and version 2 of 
+    # rawnav_data_schema) are kept as is.
+    if ('pattern' in rawnav_dat.columns) and \
+        (not pd.api.types.is_integer_dtype(rawnav_dat.pattern)):
+        rawnav_dat.pattern = rawnav_dat.pattern.astype('int') 
+
+    return rawnav_dat
+
+
+def read_runs(path, run_keys, columns = None):
+    """
+    Parameters
+    ----------
+    path: str,
+       path where the parquet files for cleaned rawnav data are kept
+    run_keys: pd.DataFrame,
+        runs to read, identified by columns filename and index_run_start or by run_id
+    columns: list, optional
+        columns to read. By default all columns are read. 
+    Returns
+    -------
+    rawnav_dat: pd.DataFrame,
+      rawnav data for the runs requested that are found in the data
+    Notes
+    -----
+    The run catalog kept by write_rawnav_data is used to read only the row groups holding 
+    each run, rather than scanning the partitions. If there is no catalog (data written before
+    the catalog was kept), read_cleaned_rawnav is used instead; see also build_run_catalog.
+    run_id is taken from the catalog rather than the files, so is also returned for data 
+    written before run_id was stored.
+    """
+    assert (set(['filename', 'index_run_start']).issubset(run_keys.columns) 
+            or ('run_id' in run_keys.columns)),\
+        print("run_keys should have columns filename and index_run_start or run_id")
+    
+    if not set(['filename', 'index_run_start']).issubset(run_keys.columns):
+        run_keys = ll.get_run_keys(run_keys.run_id.unique())
+    
+    run_catalog = read_run_catalog(path)
+    
+    if run_catalog is None:
+        routes = [
+            folder.split('=', 1)[1] for folder in os.listdir(path) if folder.startswith('route=')
+        ]
+        return read_cleaned_rawnav(path, routes, columns = columns, runs = run_keys)
+    
+    # Last entry added wins if a run was written more than once, as in read_cleaned_rawnav
+    run_catalog_fil = (
+        run_catalog
+        .drop_duplicates(['filename', 'index_run_start'], keep='last')
+        .merge(run_keys[['filename', 'index_run_start']]
+               .drop_duplicates()
+               .astype({'index_run_start': run_catalog.index_run_start.dtype}),
+               on=['filename', 'index_run_start'],
+               how='inner')
+    )
+    
+    if len(run_catalog_fil) == 0:
+        raise ValueError('No data found for any of given filter conditions')
+    
+    if columns is not None:
+        columns = ll.check_convert_list(columns)
+        read_columns = [col for col in columns if col not in ['route', 'wday', 'run_id']]
+        read_columns = read_columns + [
+            col for col in ['filename', 'index_run_start'] if col not in read_columns
+        ]
+    else:
+        read_columns = None
+    
+    rawnav_list = []
+    for file_path, file_runs in run_catalog_fil.groupby('file_path', sort=False):
+        parquet_file = pq.ParquetFile(os.path.join(path, file_path))
+        if read_columns is None:
+            file_columns = [col for col in parquet_file.schema.names if col != 'run_id']
+        else:
+            file_columns = read_columns
+        row_groups = sorted(set(
+            row_group 
+            for start, end in zip(file_runs.row_group_start, file_runs.row_group_end)
+            for row_group in range(start, end + 1)
+        ))
+        rawnav_file = (
+            parquet_file
+            .read_row_groups(row_groups, columns = file_columns, use_pandas_metadata = True)
+            .to_pandas()
+        )
+        # Row groups can also hold other runs
+        rawnav_file = rawnav_file.merge(
+            file_runs[['filename', 'index_run_start', 'route', 'wday', 'run_id']],
+            on=['filename', 'index_run_start'],
+            how='inner'
+        )
+        rawnav_list.append(rawnav_file)
+    
+    rawnav_dat = pd.concat(rawnav_list, ignore_index=True)
+    
+    if columns is not None:
+        rawnav_dat = rawnav_dat[[col for col in columns if col in rawnav_dat.columns]]
+    
+    rawnav_dat = format_cleaned_rawnav(rawnav_dat)
+    
+    return rawnav_dat
+
+
+def write_rawnav_data(rawnav_data, 
+                      path, 
+                      row_group_rows = 250000, 
+                      generation = None, 
+                      overwrite = False):
+    """
+    Parameters
+    ----------
+    rawnav_data: pd.DataFrame,
+        rawnav data, such as the output of parse_rawnav.format_rawnav_output
+    path: str,
+        path to the rawnav data parquet dataset, partitioned by route and wday
+    row_group_rows: int, optional
+        target number of rows per row group. Row groups hold whole runs, so a row group is 
+        only larger than this if a single run is.
+    generation: int, optional
+        generation of the partition manifest to write to, see write_rawnav_partitions. By 
+        default, a new generation.
+    overwrite: bool, optional
+        whether to replace files from other generations in each partition written. The default
+        is False.
+    Returns
+    -------
+    None. A new file is added to each route and wday partition, as with pq.write_to_dataset, 
+    and the runs in it are added to the run catalog.
+    Notes
+    -----
+    run_id is added if not already present (see low_level_fns.get_run_id). Rows are sorted by 
+    run_id and index_loc before writing, which orders runs by filename and index_run_start, so
+    that the min/max statistics kept for each row group cover a narrow range of runs and 
+    start times and can be used to skip row groups on read (see read_cleaned_rawnav and 
+    read_runs).
+    """
+    assert(row_group_rows > 0), print("row_group_rows must be greater than 0")
+    
+    rawnav_data = (
+        conform_rawnav_data(ll.add_run_id(rawnav_data))
+        .sort_values(['run_id', 'index_loc'])
+        .reset_index(drop=True)
+    )
+    
+    # zstd roughly halves file size relative to the default snappy on rawnav data
+    files_written = write_rawnav_partitions(rawnav_data, 
+                                            path, 
+                                            rawnav_data_schema(), 
+                                            generation = generation,
+                                            overwrite = overwrite,
+                                            row_group_rows = row_group_rows,
+                                            compression = 'zstd')
+    
+    run_catalog_list = [
+        get_run_catalog_entries(rawnav_partition, 
+                                pq.ParquetFile(os.path.join(path, file_path)).metadata,
+                                file_path)
+        for rawnav_partition, file_path in files_written
+    ]
+    
+    if len(run_catalog_list) > 0:
+        update_run_catalog(path, pd.concat(run_catalog_list, ignore_index=True))
+
+
+def write_rawnav_summary(summary_rawnav, path, generation = None, overwrite = False):
+    """
+    Parameters
+    ----------
+    summary_rawnav: pd.DataFrame,
+        rawnav run summaries, such as the output of parse_rawnav.format_rawnav_output
+    path: str,
+        path to the rawnav summary parquet dataset, partitioned by route and wday
+    generation: int, optional
+        generation of the partition manifest to write to, see write_rawnav_partitions. By 
+        default, a new generation.
+    overwrite: bool, optional
+        whether to replace files from other generations in each partition written. The default
+        is False.
+    Returns
+    -------
+    None. A new file is added to each route and wday partition. run_id is added if not
+    already present.
+    """
+    summary_rawnav = (
+        ll.add_run_id(summary_rawnav)
+        .sort_values('run_id')
+        .reset_index(drop=True)
+    )
+    
+    write_rawnav_partitions(summary_rawnav, 
+                            path, 
+                            rawnav_summary_schema(), 
+                            generation = generation,
+                            overwrite = overwrite)
+
+
+def write_rawnav_partitions(rawnav_data, 
+                            path, 
+                            schema, 
+                            generation = None, 
+                            overwrite = False, 
+                            row_group_rows = None, 
+                            compression = 'snappy'):
+    """
+    Parameters
+    ----------
+    rawnav_data: pd.DataFrame,
+        rawnav data or summary data with columns route and wday
+    path: str,
+        path to the parquet dataset, partitioned by route and wday
+    schema: pa.schema,
+        schema of the data, including route and wday
+    generation: int, optional
+        generation of the partition manifest to write to. By default, a new generation 
+        (see get_next_generation). Writes that cannot hold the same run more than once, such
+        as buffers flushed during a single parse, can share a generation.
+    overwrite: bool, optional
+        whether to replace files from other generations in each partition written. The default
+        is False, in which case files are added to each partition.
+    row_group_rows: int, optional
+        target number of rows per row group, see get_row_group_bounds. By default, one row 
+        group per file.
+    compression: str, optional
+        parquet compression codec. The default is 'snappy', as in pq.write_to_dataset.
+    Returns
+    -------
+    files_written: list of tuples,
+        data written to each partition and the path of its file, relative to path. 
+    Notes
+    -----
+    New files are recorded in the partition manifest (see update_partition_manifest), which 
+    is replaced in one step once all files are written, and files replaced are only removed
+    afterwards. read_cleaned_rawnav reads the files in the manifest, so a read sees either the 
+    partitions before the write or after, never a mix.
+    """
+    if generation is None:
+        generation = get_next_generation(path)
+    
+    # Partition columns are kept in the folder names rather than the files
+    file_schema = pa.schema(
+        [field for field in schema if field.name not in ['route', 'wday']],
+        metadata = schema.metadata
+    )
+    
+    files_written = []
+    for (route, wday), rawnav_partition in rawnav_data.groupby(['route', 'wday'], sort=False):
+        partition_dir = os.path.join('route={}'.format(route), 'wday={}'.format(wday))
+        
+        if row_group_rows is not None:
+            row_group_bounds = get_row_group_bounds(rawnav_partition, row_group_rows)
+        else:
+            row_group_bounds = [(0, len(rawnav_partition))]
+        
+        file_path = write_partition_file(
+            pa.Table.from_pandas(rawnav_partition.drop(columns=['route', 'wday']), 
+                                 schema=file_schema,
+                                 preserve_index=False),
+            path,
+            partition_dir,
+            row_group_bounds,
+            compression=compression
+        )
+        files_written.append((rawnav_partition, file_path))
+    
+    if len(files_written) == 0:
+        return files_written
+    
+    manifest_new = pd.DataFrame({
+        'route': [rawnav_partition.route.iloc[0] for rawnav_partition, _ in files_written],
+        'wday': [rawnav_partition.wday.iloc[0] for rawnav_partition, _ in files_written],
+        'file_path': [file_path for _, file_path in files_written],
+        'generation': generation
+    }).astype({'route': 'str', 'wday': 'str'})
+    
+    files_replaced = update_partition_manifest(path, manifest_new, overwrite)
+    
+    for file_path in files_replaced:
+        if os.path.isfile(os.path.join(path, file_path)):
+            os.remove(os.path.join(path, file_path))
+    
+    return files_written
+
+
+def list_partition_files(path):
+    """
+    Parameters
+    ----------
+    path: str,
+        path to the rawnav data or rawnav summary parquet dataset
+    Returns
+    -------
+    partition_files: pd.DataFrame,
+        one row per file in the dataset, with route, wday, file_path (relative to path) and 
+        generation, in the order the files were written. 
+    Notes
+    -----
+    Files come from the partition manifest if there is one. Otherwise (data written before the
+    manifest was kept), every file in the partition folders is listed as generation 0, in the 
+    order of modification time. Files listed in the manifest that no longer exist are dropped.
+    """
+    partition_files = read_partition_manifest(path)
+    
+    if partition_files is None:
+        full_paths = [
+            full_path 
+            for full_path in glob.glob(os.path.join(path, 'route=*', 'wday=*', '*.parquet'))
+            if not os.path.basename(full_path).startswith('_')
+        ]
+        full_paths = sorted(full_paths, key=lambda x: (os.path.getmtime(x), x))
+        file_paths = [os.path.relpath(full_path, path) for full_path in full_paths]
+        partition_keys = [
+            [folder.split('=', 1)[1] for folder in os.path.dirname(file_path).split(os.sep)]
+            for file_path in file_paths
+        ]
+        partition_files = pd.DataFrame({
+            'route': [keys[0] for keys in partition_keys],
+            'wday': [keys[1] for keys in partition_keys],
+            'file_path': file_paths,
+            'generation': 0
+        })
+    else:
+        file_exists = partition_files.file_path.map(
+            lambda x: os.path.isfile(os.path.join(path, x))
+        )
+        partition_files = partition_files[file_exists]
+    
+    partition_files = partition_files.astype({'generation': 'int64'}).reset_index(drop=True)
+    
+    return partition_files
+
+
+def read_partition_manifest(path):
+    """
+    Parameters
+    ----------
+    path: str,
+        path to the rawnav data or rawnav summary parquet dataset
+    Returns
+    -------
+    partition_manifest: pd.DataFrame,
+        one row per file written, see partition_manifest_schema, or None if there is no 
+        manifest.
+    """
+    path_manifest = os.path.join(path, '_partition_manifest.parquet')
+    
+    if not os.path.isfile(path_manifest):
+        return None
+    
+    partition_manifest = pq.read_table(path_manifest).to_pandas()
+    
+    return partition_manifest
+
+
+def update_partition_manifest(path, manifest_new, overwrite = False):
+    """
+    Parameters
+    ----------
+    path: str,
+        path to the rawnav data or rawnav summary parquet dataset
+    manifest_new: pd.DataFrame,
+        files to add, see partition_manifest_schema
+    overwrite: bool, optional
+        whether to drop files from other generations in the partitions of manifest_new. 
+        The default is False.
+    Returns
+    -------
+    files_replaced: list,
+        files dropped from the manifest, relative to path, which can now be removed.
+    Notes
+    -----
+    The manifest is kept at path/_partition_manifest.parquet, which parquet readers skip 
+    because of the leading underscore. If there is no manifest yet, files already in the 
+    dataset are added to it first (see list_partition_files).
+    """
+    # Files being added are already in the partition folders if there was no manifest yet
+    partition_manifest = list_partition_files(path)
+    partition_manifest = partition_manifest[
+        ~partition_manifest.file_path.isin(manifest_new.file_path)
+    ]
+    
+    files_replaced = []
+    if overwrite:
+        is_replaced = (
+            partition_manifest
+            .merge(manifest_new[['route', 'wday', 'generation']]
+                   .drop_duplicates(['route', 'wday'])
+                   .rename(columns={'generation': 'generation_new'}),
+                   on=['route', 'wday'],
+                   how='left')
+            .pipe(lambda x: x.generation_new.notna() & (x.generation != x.generation_new))
+            .to_numpy()
+        )
+        files_replaced = partition_manifest.file_path[is_replaced].tolist()
+        partition_manifest = partition_manifest[~is_replaced]
+    
+    partition_manifest = pd.concat([partition_manifest, manifest_new], ignore_index=True)
+    
+    write_partition_manifest(path, partition_manifest)
+    
+    return files_replaced
+
+
+def write_partition_manifest(path, partition_manifest):
+    """
+    Parameters
+    ----------
+    path: str,
+        path to the rawnav data or rawnav summary parquet dataset
+    partition_manifest: pd.DataFrame,
+        all files in the dataset, see partition_manifest_schema
+    Returns
+    -------
+    None. The manifest is written to a temporary file first and then swapped in with 
+    os.replace, so that a read sees either the old or the new manifest.
+    """
+    path_manifest = os.path.join(path, '_partition_manifest.parquet')
+    pq.write_table(pa.Table.from_pandas(partition_manifest, 
+                                        schema=partition_manifest_schema(), 
+                                        preserve_index=False),
+                   path_manifest + '.tmp')
+    os.replace(path_manifest + '.tmp', path_manifest)
+
+
+def replace_route_generations(path, routes, generation):
+    """
+    Parameters
+    ----------
+    path: str,
+        path to the rawnav data or rawnav summary parquet dataset
+    routes: list or str,
+        routes whose partitions are replaced
+    generation: int,
+        generation to keep, e.g. the generation of a parse just finished
+    Returns
+    -------
+    None. Files from any other generation in each partition of routes, on any wday, are 
+    dropped from the partition manifest in one step and then removed, along with partition 
+    folders left empty.
+    Notes
+    -----
+    Used to replace routes written over several writes, e.g. the buffers of 
+    parse_rawnav_to_parquet. The new data is added as its own generation alongside the old, 
+    so reads see the old data until this step (with duplicate runs removed, see 
+    get_partitions_with_duplicates), and a write that fails part way leaves the old data in 
+    place. Partitions not written this time, such as a wday with no runs, are also cleared, 
+    as when a route's folder is removed before writing.
+    """
+    routes = ll.check_convert_list(routes)
+    partition_manifest = list_partition_files(path)
+    
+    is_replaced = (
+        partition_manifest.route.isin([str(route) for route in routes])
+        & (partition_manifest.generation != generation)
+    ).to_numpy()
+    if not is_replaced.any():
+        return
+    files_replaced = partition_manifest.file_path[is_replaced].tolist()
+    
+    write_partition_manifest(path, partition_manifest[~is_replaced])
+    
+    for file_path in files_replaced:
+        if os.path.isfile(os.path.join(path, file_path)):
+            os.remove(os.path.join(path, file_path))
+    for partition_dir in set(os.path.dirname(file_path) for file_path in files_replaced):
+        for folder in [partition_dir, os.path.dirname(partition_dir)]:
+            if os.path.isdir(os.path.join(path, folder)) and \
+                len(os.listdir(os.path.join(path, folder))) == 0:
+                os.rmdir(os.path.join(path, folder))
+    
+    # Drop catalog entries of the files removed
+    run_catalog = read_run_catalog(path)
+    if run_catalog is not None:
+        update_run_catalog(path, run_catalog.iloc[0:0])
+
+
+def get_next_generation(path):
+    """
+    Parameters
+    ----------
+    path: str,
+        path to the rawnav data or rawnav summary parquet dataset
+    Returns
+    -------
+    generation: int,
+        one more than the latest generation in the partition manifest, or 1 if there is none.
+    """
+    partition_manifest = read_partition_manifest(path)
+    
+    if (partition_manifest is None) or (len(partition_manifest) == 0):
+        return 1
+    
+    return int(partition_manifest.generation.max()) + 1
+
+
+def get_partitions_with_duplicates(partition_files):
+    """
+    Parameters
+    ----------
+    partition_files: pd.DataFrame,
+        files in a dataset, as from list_partition_files
+    Returns
+    -------
+    partitions_dup: pd.DataFrame,
+        route and wday of partitions that may hold the same run more than once: partitions 
+        with files from more than one generation, or more than one file of generation 0 (files
+        written before the manifest was kept).
+    """
+    partition_summary = (
+        partition_files
+        .groupby(['route', 'wday'])
+        .agg(n_files = ('file_path', 'count'),
+             n_generations = ('generation', 'nunique'),
+             min_generation = ('generation', 'min'))
+        .reset_index()
+    )
+    
+    partitions_dup = partition_summary.loc[
+        (partition_summary.n_generations > 1) 
+        | ((partition_summary.n_files > 1) & (partition_summary.min_generation == 0)),
+        ['route', 'wday']
+    ]
+    
+    return partitions_dup
+
+
+def write_partition_file(table, path, partition_dir, row_group_bounds, compression='snappy'):
+    """
+    Parameters
+    ----------
+    table: pa.Table,
+        data to write, without the partition columns
+    path: str,
+        path to the parquet dataset
+    partition_dir: str,
+        partition folder relative to path, e.g. route=S9/wday=Monday
+    row_group_bounds: list of tuples,
+        start and end (exclusive) rows of each row group, see get_row_group_bounds
+    compression: str, optional
+        parquet compression codec. The default is 'snappy', as in pq.write_to_dataset.
+    Returns
+    -------
+    file_path: str,
+        path of the file written, relative to path. 
+    Notes
+    -----
+    The file is written under a name starting with an underscore, which parquet readers skip, and
+    renamed once complete, so that readers never see a partly written file.
+    """
+    os.makedirs(os.path.join(path, partition_dir), exist_ok=True)
+    file_name = uuid.uuid4().hex
+    file_path = os.path.join(partition_dir, '{}.parquet'.format(file_name))
+    path_temp = os.path.join(path, partition_dir, '_{}.parquet'.format(file_name))
+    
+    with pq.ParquetWriter(path_temp, table.schema, compression=compression) as writer:
+        for start, end in row_group_bounds:
+            writer.write_table(table.slice(start, end - start), row_group_size=end - start)
+    os.replace(path_temp, os.path.join(path, file_path))
+    
+    return file_path
+
+
+def compact_rawnav_dataset(path, row_group_rows = 250000, quiet = True):
+    """
+    Parameters
+    ----------
+    path: str,
+        path to a rawnav data or rawnav summary parquet dataset, partitioned by route and wday
+    row_group_rows: int, optional
+        target number of rows per row group for rawnav data, see write_rawnav_data
+    quiet: boolean, optional
+        Whether to print status. The default is True.
+    Returns
+    -------
+    None. Each partition with more than one file is rewritten as a single file, with duplicate 
+    runs (rawnav summary) or pings (rawnav data) removed. 
+    Notes
+    -----
+    As in read_cleaned_rawnav, the last entry written wins. Each compacted partition replaces 
+    the old files as a new generation of the partition manifest (see write_rawnav_partitions), 
+    so a read during compaction sees the partition either before or after.
+    """
+    had_run_catalog = read_run_catalog(path) is not None
+    partition_files = list_partition_files(path)
+    is_data = None
+    
+    for (route, wday), partition_files_1 in partition_files.groupby(['route', 'wday']):
+        if len(partition_files_1) <= 1:
+            continue
+        
+        if quiet != True:
+            print("Compacting {} files in route={}, wday={}".format(len(partition_files_1), 
+                                                                   route, 
+                                                                   wday))
+        
+        rawnav_partition = pd.concat(
+            [pq.read_table(os.path.join(path, file_path)).to_pandas() 
+             for file_path in partition_files_1.sort_values('generation', kind='mergesort').file_path],
+            ignore_index=True
+        ).assign(route = route, wday = wday)
+        
+        is_data = 'index_loc' in rawnav_partition.columns
+        if is_data:
+            write_rawnav_data(
+                rawnav_partition
+                .drop_duplicates(['index_loc', 'filename', 'index_run_start'], keep='last'),
+                path,
+                row_group_rows = row_group_rows,
+                overwrite = True
+            )
+        else:
+            write_rawnav_summary(
+                rawnav_partition
+                .drop_duplicates(['filename', 'index_run_start'], keep='last'),
+                path,
+                overwrite = True
+            )
+    
+    # Otherwise the catalog would only hold the partitions compacted
+    if is_data and not had_run_catalog:
+        build_run_catalog(path)
+
+
+def get_row_group_bounds(rawnav_file, row_group_rows):
+    """
+    Parameters
+    ----------
+    rawnav_file: pd.DataFrame,
+        rawnav data sorted by run, with columns filename and index_run_start
+    row_group_rows: int,
+        target number of rows per row group
+    Returns
+    -------
+    row_group_bounds: list of tuples,
+        start and end (exclusive) row positions of each row group. Runs are added to a row group
+        while it stays within row_group_rows rows, so no run is split across row groups and a 
+        row group is only larger than row_group_rows if it holds a single run that is.
+    """
+    run_key = rawnav_file[['filename', 'index_run_start']]
+    run_ends = np.flatnonzero(
+        (run_key != run_key.shift(-1)).any(axis=1).to_numpy()
+    ) + 1
+    
+    row_group_bounds = []
+    start = 0
+    group_end = 0
+    for end in run_ends:
+        # Close the row group before a run that would take it over the target
+        if (end - start > row_group_rows) and (group_end > start):
+            row_group_bounds.append((start, group_end))
+            start = group_end
+        group_end = end
+        if end - start >= row_group_rows:
+            row_group_bounds.append((start, end))
+            start = end
+    if start < len(rawnav_file):
+        row_group_bounds.append((start, len(rawnav_file)))
+    
+    return row_group_bounds
+
+
+def get_run_catalog_entries(rawnav_file, file_metadata, file_path):
+    """
+    Parameters
+    ----------
+    rawnav_file: pd.DataFrame,
+        rawnav data in the order written to one file, with columns filename, index_run_start,
+        route, pattern, wday and start_date_time
+    file_metadata: pq.FileMetaData,
+        metadata of the file written
+    file_path: str,
+        path of the file relative to the dataset root
+    Returns
+    -------
+    run_catalog: pd.DataFrame,
+        one row per run in the file, see run_catalog_schema
+    """
+    row_group_ends = np.cumsum(
+        [file_metadata.row_group(i).num_rows for i in range(file_metadata.num_row_groups)]
+    )
+    
+    run_catalog = (
+        rawnav_file[['filename', 'index_run_start', 'route', 'pattern', 'wday', 'start_date_time']]
+        .assign(row_pos = np.arange(len(rawnav_file)))
+        # filename is a category after conform_rawnav_data; only keep runs in the file
+        .groupby(['filename', 'index_run_start'], sort=False, observed=True)
+        .agg(route = ('route', 'first'),
+             pattern = ('pattern', 'first'),
+             wday = ('wday', 'first'),
+             start_date_time = ('start_date_time', 'first'),
+             n_rows = ('row_pos', 'count'),
+             first_row = ('row_pos', 'min'),
+             last_row = ('row_pos', 'max'))
+        .reset_index()
+        .pipe(ll.add_run_id)
+        .assign(
+            file_path = file_path,
+            row_group_start = lambda x: np.searchsorted(row_group_ends, x.first_row, side='right'),
+            row_group_end = lambda x: np.searchsorted(row_group_ends, x.last_row, side='right'))
+        .drop(columns=['first_row', 'last_row'])
+    )
+    
+    return run_catalog
+
+
+def read_run_catalog(path):
+    """
+    Parameters
+    ----------
+    path: str,
+        path to the rawnav data parquet dataset
+    Returns
+    -------
+    run_catalog: pd.DataFrame,
+        one row per run written, see run_catalog_schema, or None if there is no catalog.
+    """
+    path_catalog = os.path.join(path, '_run_catalog.parquet')
+    
+    if not os.path.isfile(path_catalog):
+        return None
+    
+    run_catalog = pq.read_table(path_catalog).to_pandas()
+    
+    # Catalogs written before run_id was kept
+    run_catalog = ll.add_run_id(run_catalog)
+    
+    return run_catalog
+
+
+def update_run_catalog(path, run_catalog_new):
+    """
+    Parameters
+    ----------
+    path: str,
+        path to the rawnav data parquet dataset
+    run_catalog_new: pd.DataFrame,
+        catalog entries to add, see run_catalog_schema
+    Returns
+    -------
+    None. Entries are appended to the catalog at path/_run_catalog.parquet, which parquet 
+    readers skip because of the leading underscore. Entries for files that no longer exist 
+    (e.g., partitions removed before a rerun) are dropped.
+    """
+    run_catalog = read_run_catalog(path)
+    
+    if run_catalog is not None:
+        run_catalog = pd.concat([run_catalog, run_catalog_new], ignore_index=True)
+    else:
+        run_catalog = run_catalog_new
+    
+    file_exists = {
+        file_path: os.path.isfile(os.path.join(path, file_path)) 
+        for file_path in run_catalog.file_path.unique()
+    }
+    run_catalog = run_catalog[run_catalog.file_path.map(file_exists)]
+    
+    # Written to a temporary file first so that a failed write leaves the old catalog in place
+    path_catalog = os.path.join(path, '_run_catalog.parquet')
+    pq.write_table(pa.Table.from_pandas(run_catalog, 
+                                        schema=run_catalog_schema(), 
+                                        preserve_index=False),
+                   path_catalog + '.tmp')
+    os.replace(path_catalog + '.tmp', path_catalog)
+
+
+def build_run_catalog(path):
+    """
+    Parameters
+    ----------
+    path: str,
+        path to the rawnav data parquet dataset
+    Returns
+    -------
+    None. The run catalog is rebuilt from all files in the dataset, including files written 
+    before the catalog was kept. 
+    Notes
+    -----
+    Files are cataloged in the order they were written (see list_partition_files), so that the
+    last copy of a run written more than once is used by read_runs, as in read_cleaned_rawnav.
+    """
+    path_catalog = os.path.join(path, '_run_catalog.parquet')
+    if os.path.isfile(path_catalog):
+        os.remove(path_catalog)
+    
+    run_catalog_list = []
+    partition_files = list_partition_files(path).sort_values('generation', kind='mergesort')
+    for route, wday, file_path in zip(partition_files.route, 
+                                      partition_files.wday, 
+                                      partition_files.file_path):
+        parquet_file = pq.ParquetFile(os.path.join(path, file_path))
+        rawnav_file = (
+            parquet_file
+            .read(columns = ['filename', 'index_run_start', 'pattern', 'start_date_time'])
+            .to_pandas()
+            .assign(route = route, wday = wday)
+        )
+        run_catalog_list.append(
+            get_run_catalog_entries(rawnav_file, parquet_file.metadata, file_path)
+        )
+    
+    if len(run_catalog_list) > 0:
+        update_run_catalog(path, pd.concat(run_catalog_list, ignore_index=True))
+
+
+def get_field_values(values, field_type):
+    """
+    Parameters
+    ----------
+    values: np.array
+        values to filter a dataset field on
+    field_type: pa.DataType
+        type of the field in the dataset
+    Returns
+    -------
+    values: list
+        values as python floats or ints, matching field_type, for use in ds.field().isin()
+    """
+    if pa.types.is_integer(field_type):
+        return [int(value) for value in values]
+    elif pa.types.is_floating(field_type):
+        return [float(value) for value in values]
+    return list(values)
+
+
+def get_timestamp_int(value, unit):
+    """
+    Parameters
+    ----------
+    value: str, datetime or pd.Timestamp
+        time to convert
+    unit: str
+        unit of a pa.timestamp type, one of 's', 'ms', 'us' or 'ns'
+    Returns
+    -------
+    value_int: int
+        value as an integer count of unit since the epoch
+    """
+    unit_ns = {'s': 10**9, 'ms': 10**6, 'us': 10**3, 'ns': 1}
+    return pd.Timestamp(value).value // unit_ns[unit]
+
+
+def rawnav_data_schema(version = 3):
+    """
+    Parameters
+    ----------
+    version: int, optional
+        1 for the original schema, 2 for the compact schema, which uses dictionary-encoded 
+        strings, booleans, int32 indices and float32 for values that are whole numbers in the 
+        raw data (heading, odometer, seconds and satellite count), or 3 (the default), which 
+        adds the int64 run_id key (see low_level_fns.get_run_id) to version 2. Coordinates 
+        are kept as float64.
     Returns
     -------
     rawnav_data_schema: pa.schema,
       a schema for rawnav data, put here to keep code a bit tidier
+    Notes
+    -----
+    The version is kept in the schema metadata as rawnav_schema_version. Data should be passed
+    through conform_rawnav_data before conversion with the version 2 or 3 schema. All versions 
+    are read by read_cleaned_rawnav, which derives run_id for data written without it.
     """
+    assert (version in [1, 2, 3]), print("version should be 1, 2 or 3")
     
-    rawnav_data_schema = pa.schema([
-        pa.field('index_loc', pa.float64()),
-        pa.field('lat', pa.float64()),
-        pa.field('long', pa.float64()),
-        pa.field('heading', pa.float64()),
-        pa.field('door_state', pa.string()),
-        pa.field('veh_state', pa.string()),
-        pa.field('odom_ft',pa.float64()),
-        pa.field('sec_past_st', pa.float64()),
-        pa.field('sat_cnt', pa.float64()),
-        pa.field('stop_window', pa.string()),
-        pa.field('blank', pa.float64()),
-        pa.field('lat_raw', pa.float64()),
-        pa.field('long_raw',pa.float64()),
-        pa.field('row_before_apc', pa.float64()),
-        pa.field('route_pattern', pa.string()),
-        pa.field('route', pa.string()),
-        pa.field('pattern', pa.float64()),
-        pa.field('index_run_start', pa.float64()),
-        pa.field('index_run_end', pa.float64()),
-        pa.field('filename', pa.string()),
-        pa.field('wday', pa.string()),
-        pa.field('start_date_time', pa.timestamp('us'))
-    ])
+    if version == 1:
+        rawnav_data_schema = pa.schema([
+            pa.field('index_loc', pa.float64()),
+            pa.field('lat', pa.float64()),
+            pa.field('long', pa.float64()),
+            pa.field('x_ft', pa.float64()),
+            pa.field('y_ft', pa.float64()),
+            pa.field('heading', pa.float64()),
+            pa.field('door_state', pa.string()),
+            pa.field('veh_state', pa.string()),
+            pa.field('odom_ft',pa.float64()),
+            pa.field('sec_past_st', pa.float64()),
+            pa.field('sat_cnt', pa.float64()),
+            pa.field('stop_window', pa.string()),
+            pa.field('blank', pa.float64()),
+            pa.field('lat_raw', pa.float64()),
+            pa.field('long_raw',pa.float64()),
+            pa.field('row_before_apc', pa.float64()),
+            pa.field('route_pattern', pa.string()),
+            pa.field('route', pa.string()),
+            pa.field('pattern', pa.float64()),
+            pa.field('index_run_start', pa.float64()),
+            pa.field('index_run_end', pa.float64()),
+            pa.field('filename', pa.string()),
+            pa.field('wday', pa.string()),
+            pa.field('start_date_time', pa.timestamp('us'))
+        ])
+    else:
+        dict_string = pa.dictionary(pa.int32(), pa.string())
+        rawnav_data_schema = pa.schema([
+            pa.field('index_loc', pa.int32()),
+            pa.field('lat', pa.float64()),
+            pa.field('long', pa.float64()),
+            pa.field('x_ft', pa.float64()),
+            pa.field('y_ft', pa.float64()),
+            pa.field('heading', pa.float32()),
+            pa.field('door_state', dict_string),
+            pa.field('veh_state', dict_string),
+            pa.field('odom_ft',pa.float32()),
+            pa.field('sec_past_st', pa.float32()),
+            pa.field('sat_cnt', pa.float32()),
+            pa.field('stop_window', dict_string),
+            pa.field('blank', pa.float32()),
+            pa.field('lat_raw', pa.float64()),
+            pa.field('long_raw',pa.float64()),
+            pa.field('row_before_apc', pa.bool_()),
+            pa.field('route_pattern', dict_string),
+            # route and wday are partition columns, and so are not stored in the files
+            pa.field('route', pa.string()),
+            pa.field('pattern', pa.int32()),
+            pa.field('index_run_start', pa.int32()),
+            pa.field('index_run_end', pa.int32()),
+            pa.field('filename', dict_string),
+            pa.field('wday', pa.string()),
+            pa.field('start_date_time', pa.timestamp('us'))
+        ])
+        
+        if version == 3:
+            rawnav_data_schema = rawnav_data_schema.append(pa.field('run_id', pa.int64()))
+    
+    rawnav_data_schema = rawnav_data_schema.with_metadata({'rawnav_schema_version': str(version)})
         
     return rawnav_data_schema
 
+
+def conform_rawnav_data(rawnav_data):
+    """
+    Parameters
+    ----------
+    rawnav_data: pd.DataFrame,
+        rawnav data, such as the output of parse_rawnav.format_rawnav_output
+    Returns
+    -------
+    rawnav_data: pd.DataFrame,
+        rawnav data with the pandas dtypes matching version 3 of rawnav_data_schema. These are
+        also the dtypes read back in by read_cleaned_rawnav, other than filename and 
+        route_pattern, which are read as strings.
+    """
+    schema_dtypes = {
+        pa.int32(): 'int32',
+        pa.int64(): 'int64',
+        pa.float32(): 'float32',
+        pa.float64(): 'float64',
+        pa.bool_(): 'bool',
+        pa.dictionary(pa.int32(), pa.string()): 'category'
+    }
+    
+    rawnav_data_dtypes = {
+        field.name: schema_dtypes[field.type] 
+        for field in rawnav_data_schema(version = 3) 
+        if (field.type in schema_dtypes) and (field.name in rawnav_data.columns)
+    }
+    
+    rawnav_data = rawnav_data.astype(rawnav_data_dtypes)
+    
+    return rawnav_data
+
+
 def rawnav_summary_schema():
     """
     Returns
@@ -174,7 +1522,86 @@ def rawnav_summary_schema():
         pa.field('lat_start',pa.float64()),
         pa.field('long_start',pa.float64()),
         pa.field('lat_end',pa.float64()),
-        pa.field('long_end',pa.float64())
+        pa.field('long_end',pa.float64()),
+        pa.field('run_id', pa.int64())
     ])
     
     return rawnav_summary_schema
+
+def rawnav_inventory_schema():
+    """
+    Returns
+    -------
+    rawnav_inventory_schema: pa.schema,
+      a schema for the rawnav inventory, so that partitions written at different times 
+      can be read back together
+    """
+    
+    rawnav_inventory_schema = pa.schema([
+        pa.field('fullpath', pa.string()),
+        pa.field('filename', pa.string()),
+        pa.field('file_id', pa.string()),
+        pa.field('file_busid', pa.int64()),
+        pa.field('taglist', pa.string()),
+        pa.field('line_num', pa.string()),
+        pa.field('line_num_next', pa.string()),
+        pa.field('route_pattern', pa.string()),
+        pa.field('route', pa.string()),
+        pa.field('pattern', pa.string()),
+        pa.field('tag_busid', pa.float64()),
+        pa.field('tag_date', pa.timestamp(unit = 'ns')),
+        pa.field('tag_time', pa.string()),
+        pa.field('tag_datetime', pa.timestamp(unit = 'ns')),
+        pa.field('tag_starthour', pa.float64()),
+        pa.field('wday', pa.string()),
+        pa.field('Unk1', pa.string()),
+        pa.field('mi_to_ft', pa.string())
+    ])
+    
+    return rawnav_inventory_schema
+
+
+def run_catalog_schema():
+    """
+    Returns
+    -------
+    run_catalog_schema: pa.schema,
+      a schema for the run catalog of a rawnav dataset, with the file (relative to the dataset
+      root) and row groups holding each run. The catalog also serves as the lookup from 
+      run_id back to filename and index_run_start.
+    """
+    
+    run_catalog_schema = pa.schema([
+        pa.field('filename', pa.string()),
+        pa.field('index_run_start', pa.int32()),
+        pa.field('route', pa.string()),
+        pa.field('pattern', pa.int32()),
+        pa.field('wday', pa.string()),
+        pa.field('start_date_time', pa.timestamp('us')),
+        pa.field('n_rows', pa.int64()),
+        pa.field('file_path', pa.string()),
+        pa.field('row_group_start', pa.int32()),
+        pa.field('row_group_end', pa.int32()),
+        pa.field('run_id', pa.int64())
+    ])
+        
+    return run_catalog_schema
+
+
+def partition_manifest_schema():
+    """
+    Returns
+    -------
+    partition_manifest_schema: pa.schema,
+      a schema for the partition manifest of a rawnav data or summary dataset, with the files 
+      (relative to the dataset root) in each partition and the generation each was written in
+    """
+    
+    partition_manifest_schema = pa.schema([
+        pa.field('route', pa.string()),
+        pa.field('wday', pa.string()),
+        pa.field('file_path', pa.string()),
+        pa.field('generation', pa.int64())
+    ])
+        
+    return partition_manifest_schema